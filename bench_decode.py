@@ -0,0 +1,94 @@
+"""
+Разбор страниц /records за один опрос:
+было — resp.json(): байты -> строка -> полные словари ответа;
+стало — разбор прямо из байтов (orjson, если установлен) и проекция
+в Record, исходные словари сразу освобождаются.
+Для каждого способа — время разбора и пиковая память (tracemalloc).
+
+Запустите: python bench_decode.py [кол-во_записей] [повторов]
+"""
+
+import json
+import sys
+import time
+import tracemalloc
+
+import models
+from bench_records import make_payload
+from models import parse_records_page
+
+PAGE_SIZE = 200
+
+
+def make_pages(count: int) -> list:
+    """Тела ответов по PAGE_SIZE записей, как их отдаёт YClients"""
+    records = make_payload(count)
+    return [
+        json.dumps({"success": True, "data": records[i:i + PAGE_SIZE], "meta": {"total_count": count}},
+                   ensure_ascii=False).encode()
+        for i in range(0, count, PAGE_SIZE)
+    ]
+
+
+def decode_text(pages: list) -> list:
+    """Как было: текст ответа целиком, затем полные словари"""
+    snapshot = []
+    for body in pages:
+        snapshot.extend(json.loads(body.decode("utf-8"))["data"])
+    return snapshot
+
+
+def decode_projected(pages: list) -> list:
+    """Как стало: из байтов сразу в Record"""
+    snapshot = []
+    for body in pages:
+        snapshot.extend(parse_records_page(body)[0])
+    return snapshot
+
+
+def measure(decode, pages: list, repeats: int) -> tuple:
+    """(лучшее время, пиковая память, память снимка)"""
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        decode(pages)
+        best = min(best, time.perf_counter() - started)
+
+    tracemalloc.start()
+    snapshot = decode(pages)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del snapshot
+    return best, peak, retained
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    pages = make_pages(count)
+    size = sum(len(body) for body in pages)
+    print(f"📊 Записей: {count}, страниц: {len(pages)}, ответы {size / 1024 / 1024:.1f} МБ\n")
+
+    variants = [("resp.json(): строка + словари", decode_text, None)]
+    fast = models.orjson
+    models.orjson = None
+    variants.append(("json из байтов + Record", decode_projected, None))
+    if fast is not None:
+        variants.append(("orjson из байтов + Record", decode_projected, fast))
+    else:
+        print("orjson не установлен (pip install orjson) — вариант с ним пропущен\n")
+
+    print(f"{'':<32} {'время':>9} {'пик памяти':>12} {'снимок':>10}")
+    baseline = None
+    for title, decode, library in variants:
+        models.orjson = library
+        elapsed, peak, retained = measure(decode, pages, repeats)
+        baseline = baseline or elapsed
+        print(f"{title:<32} {elapsed * 1000:7.1f} мс {peak / 1024 / 1024:9.1f} МБ "
+              f"{retained / 1024 / 1024:7.1f} МБ  ({baseline / elapsed:.1f}x)")
+    models.orjson = fast
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Разбор записей YClients за один цикл проверки:
+было — каждый потребитель заново читает словарь ответа (отпечаток, телефон,
+услуги, мастер, дата); стало — запись разбирается один раз в Record, а при
+опросе без изменений считается только отпечаток и берётся запись из снимка.
+Память сравнивается для снимка опроса: исходные словари против Record.
+
+Запустите: python bench_records.py [кол-во_записей] [повторов]
+"""
+
+import hashlib
+import json
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from models import Record, phone_key
+
+
+def make_payload(count: int) -> list:
+    """Записи в формате ответа /records со служебными полями, которые бот не читает"""
+    start = datetime(2026, 2, 5, 9, 0)
+    records = []
+    for i in range(count):
+        records.append({
+            "id": 500000000 + i,
+            "company_id": 1540716,
+            "staff_id": 1000 + i % 12,
+            "services": [
+                {"id": 9000 + i % 7, "title": "Мужская стрижка", "cost": 1800, "cost_to_pay": 1800,
+                 "manual_cost": 1800, "cost_per_unit": 1800, "discount": 0, "first_cost": 1800,
+                 "amount": 1, "length": 60},
+                {"id": 9100 + i % 5, "title": "Моделирование бороды", "cost": 900, "cost_to_pay": 900,
+                 "manual_cost": 900, "cost_per_unit": 900, "discount": 0, "first_cost": 900,
+                 "amount": 1, "length": 30},
+            ],
+            "goods_transactions": [],
+            "staff": {
+                "id": 1000 + i % 12, "api_id": None, "name": f"Мастер {i % 12}",
+                "specialization": "Барбер", "position": {"id": 1, "title": "Барбер"},
+                "avatar": "https://assets.yclients.com/masters/origin/a/ab/abcdef.jpg",
+                "avatar_big": "https://assets.yclients.com/masters/origin/a/ab/abcdef_big.jpg",
+                "rating": 5, "votes_count": 120,
+            },
+            "client": {
+                "id": 700000 + i, "name": f"Клиент {i}", "surname": "", "patronymic": "",
+                "display_name": f"Клиент {i}", "comment": "", "phone": f"+7999{i:07d}",
+                "card": "", "email": "", "success_visits_count": 5, "fail_visits_count": 0,
+                "discount": 0, "is_new": False, "custom_fields": [],
+            },
+            "date": (start + timedelta(minutes=30 * i)).strftime("%Y-%m-%d %H:%M:%S"),
+            "datetime": (start + timedelta(minutes=30 * i)).strftime("%Y-%m-%dT%H:%M:%S+03:00"),
+            "create_date": "2026-02-01T12:00:00+03:00",
+            "comment": "",
+            "online": True,
+            "visit_attendance": 0,
+            "attendance": 0,
+            "confirmed": 1,
+            "seance_length": 5400,
+            "length": 5400,
+            "sms_before": 0,
+            "sms_now": 0,
+            "sms_now_text": "",
+            "email_now": 0,
+            "notified": 0,
+            "master_request": 1,
+            "api_id": "",
+            "from_url": "",
+            "review_requested": 0,
+            "visit_id": 800000000 + i,
+            "created_user_id": 0,
+            "deleted": False,
+            "paid_full": 0,
+            "prepaid": False,
+            "prepaid_confirmed": False,
+            "last_change_date": "2026-02-01T12:00:00+03:00",
+            "custom_color": "",
+            "custom_font_color": "",
+            "record_labels": [],
+            "activity_id": 0,
+            "custom_fields": [],
+            "documents": [{"id": 1, "type_id": 7, "storage_id": 0, "user_id": 0,
+                           "company_id": 1540716, "number": i, "comment": "",
+                           "date_created": "2026-02-01 12:00:00", "category_id": 0,
+                           "visit_id": 800000000 + i, "record_id": 500000000 + i,
+                           "type_title": "Визит"}],
+            "sms_remain_hours": 0,
+            "email_remain_hours": 0,
+            "bookform_id": 0,
+            "record_from": "",
+            "is_mobile": 0,
+            "short_link": f"https://n1729941.yclients.com/r/{i:08d}",
+        })
+    return records
+
+
+def legacy_staff_info(staff: dict) -> str:
+    staff_name = staff.get("name", "") if isinstance(staff, dict) else ""
+    staff_position = staff.get("specialization", "") if isinstance(staff, dict) else ""
+    if not staff_position:
+        staff_position = staff.get("position", {}).get("title", "") if isinstance(staff.get("position"), dict) else ""
+    return f"{staff_name}, {staff_position}" if staff_position else staff_name
+
+
+def legacy_link(record: dict):
+    for field in ["visit_url", "client_link", "short_link", "record_link", "link", "links"]:
+        link = record.get(field)
+        if isinstance(link, str) and link.startswith("http"):
+            return link
+    return None
+
+
+def legacy_cycle(records: list, new: bool):
+    """Как было: каждый потребитель разбирает словарь сам"""
+    # телефоны страницы -> Telegram ID
+    [phone_key(r["client"].get("phone", "")) for r in records if isinstance(r.get("client"), dict)]
+    for record in records:
+        client = record.get("client") or {}
+        staff = record.get("staff") or {}
+        services_list = record.get("services") or []
+        phone_key(client.get("phone", ""))
+        datetime_str = record.get("datetime", "")
+        ", ".join([s.get("title", "") for s in services_list if isinstance(s, dict)])
+        staff.get("name", "") if isinstance(staff, dict) else ""
+
+        # отпечаток
+        fields = [
+            record.get("datetime"),
+            [(s.get("id"), s.get("title"), s.get("length")) for s in services_list if isinstance(s, dict)],
+            staff.get("id"), staff.get("name"), client.get("phone"),
+            record.get("deleted"), record.get("confirmed"),
+            record.get("attendance"), record.get("visit_attendance"),
+        ]
+        payload = json.dumps(fields, ensure_ascii=False, separators=(",", ":"), default=str)
+        hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+        if not new:
+            continue
+
+        # уведомление о новой записи, напоминания, индекс «Мои записи»
+        datetime.fromisoformat(datetime_str.replace("Z", "+00:00")).replace(tzinfo=None)
+        ", ".join([s.get("title", "") for s in services_list if isinstance(s, dict)])
+        legacy_staff_info(staff)
+        legacy_link(record)
+        datetime.fromisoformat(datetime_str.replace("Z", "+00:00")).timestamp()
+        json.dumps(record, ensure_ascii=False, default=str)
+        phone_key(client.get("phone", ""))
+
+
+def model_cycle(records: list, new: bool, known: dict = None):
+    """Как стало: разбор один раз при получении, дальше — атрибуты"""
+    records = [Record.from_api(r, known) for r in records]
+    [r.phone_key for r in records if r.client_phone]
+    for record in records:
+        record.phone_key
+        record.fingerprint
+        if not new:
+            continue
+
+        record.start
+        record.services_title
+        record.staff.label
+        record.link
+        record.starts_at
+        json.dumps(record.to_dict(), ensure_ascii=False, default=str)
+        record.phone_key
+
+
+def timed(func, repeats: int, *args) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def retained(build) -> int:
+    """Память, которую удерживает результат build()"""
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    body = json.dumps({"success": True, "data": make_payload(count)}, ensure_ascii=False)
+    print(f"📊 Записей: {count}, ответ API {len(body.encode()) / 1024 / 1024:.1f} МБ\n")
+
+    records = json.loads(body)["data"]
+    # Снимок прошлого опроса: при опросе без изменений записи берутся из него
+    snapshot = {r.id: r for r in (Record.from_api(data) for data in records)}
+    for title, new, known in (("Опрос без изменений", False, snapshot), ("Все записи новые", True, None)):
+        legacy = timed(legacy_cycle, repeats, records, new)
+        model = timed(model_cycle, repeats, records, new, known)
+        print(title)
+        print(f"  {'разбор в каждом потребителе':<33} {legacy * 1000:8.1f} мс")
+        print(f"  {'Record.from_api один раз':<33} {model * 1000:8.1f} мс  ({legacy / model:.1f}x)")
+    print()
+
+    raw = retained(lambda: json.loads(body)["data"])
+    parsed = retained(lambda: [Record.from_api(r) for r in json.loads(body)["data"]])
+    print(f"{'Снимок: словари ответа':<35} {raw / 1024 / 1024:8.1f} МБ")
+    print(f"{'Снимок: Record':<35} {parsed / 1024 / 1024:8.1f} МБ  "
+          f"({parsed / count:.0f} Б на запись, в {raw / parsed:.1f} раза меньше)")
+
+
+if __name__ == "__main__":
+    main()
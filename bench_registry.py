@@ -0,0 +1,147 @@
+"""
+Поиск клиентов по телефонам за один цикл проверки записей:
+было — запрос к базе через Storage.read (пул чтения) на каждую страницу;
+стало — реестр в памяти (registry.ClientRegistry), без ожидания потоков.
+Память реестра сравнивается со словарями telegram_id -> кортеж.
+
+Запустите: python bench_registry.py [кол-во_клиентов] [записей_в_опросе]
+"""
+
+import asyncio
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from models import phone_key
+from registry import ClientRegistry
+from storage import Storage
+
+PAGE_SIZE = 200
+MESSAGES = 1000
+
+
+def make_clients(count: int) -> list:
+    """(telegram_id, phone_number, yclients_client_id) как в таблице clients"""
+    rng = random.Random(1)
+    return [(rng.randrange(10 ** 8, 8 * 10 ** 9), f"+7999{i:07d}", 700000 + i if i % 3 else None)
+            for i in range(count)]
+
+
+def make_db(path: Path, clients: list):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE clients (telegram_id INTEGER UNIQUE, phone_number TEXT, phone_key TEXT, "
+                 "yclients_client_id INTEGER)")
+    conn.execute("CREATE UNIQUE INDEX idx_phone_key ON clients(phone_key, telegram_id)")
+    conn.executemany("INSERT INTO clients VALUES (?, ?, ?, ?)",
+                     [(tid, phone, phone_key(phone), cid) for tid, phone, cid in clients])
+    conn.commit()
+    conn.close()
+
+
+async def storage_lookup(storage: Storage, keys: list) -> dict:
+    """Как было: запрос через пул чтения на каждую страницу опроса"""
+    def query(conn, chunk):
+        rows = conn.execute(
+            f"SELECT phone_key, telegram_id FROM clients WHERE phone_key IN ({','.join('?' * len(chunk))})", chunk
+        )
+        return rows.fetchall()
+
+    found = {}
+    for i in range(0, len(keys), PAGE_SIZE):
+        for key, telegram_id in await storage.read(query, keys[i:i + PAGE_SIZE]):
+            found.setdefault(key, telegram_id)
+    return found
+
+
+def registry_lookup(registry: ClientRegistry, keys: list) -> dict:
+    """Как стало: реестр в памяти, тоже постранично"""
+    found = {}
+    for i in range(0, len(keys), PAGE_SIZE):
+        found.update(registry.lookup(keys[i:i + PAGE_SIZE]))
+    return found
+
+
+def best(func, repeats: int = 5) -> float:
+    result = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        result = min(result, time.perf_counter() - started)
+    return result
+
+
+def retained(build) -> int:
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    polled = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+
+    clients = make_clients(count)
+    path = Path(tempfile.mkdtemp()) / "clients.db"
+    make_db(path, clients)
+    storage = Storage(path)
+    storage.open()
+    registry = ClientRegistry()
+    registry.load(clients)
+
+    # Половина записей опроса — клиенты бота, половина — нет
+    keys = [phone_key(f"+7{'999' if i % 2 else '888'}{i % count:07d}") for i in range(polled)]
+    print(f"📊 Клиентов: {count}, записей в опросе: {polled}\n")
+
+    loop = asyncio.new_event_loop()
+    expected = loop.run_until_complete(storage_lookup(storage, keys))
+    assert {key: ids[0] for key, ids in registry_lookup(registry, keys).items()} == expected
+    in_db = best(lambda: loop.run_until_complete(storage_lookup(storage, keys)))
+    in_memory = best(lambda: registry_lookup(registry, keys))
+
+    # Обработчик сообщения: «зарегистрирован ли отправитель»
+    senders = [clients[i][0] for i in range(0, count, max(1, count // MESSAGES))][:MESSAGES]
+
+    async def fetch_senders():
+        for telegram_id in senders:
+            await storage.fetchone("SELECT 1 FROM clients WHERE telegram_id = ?", (telegram_id,))
+
+    per_message_db = best(lambda: loop.run_until_complete(fetch_senders())) / len(senders)
+    per_message = best(lambda: [telegram_id in registry for telegram_id in senders]) / len(senders)
+    loop.close()
+    storage.close()
+
+    print("Телефоны записей опроса")
+    print(f"  {'Storage.read на страницу':<28} {in_db * 1000:8.1f} мс")
+    print(f"  {'Реестр в памяти':<28} {in_memory * 1000:8.1f} мс  ({in_db / in_memory:.1f}x)")
+    print("Одно сообщение (клиент зарегистрирован?)")
+    print(f"  {'storage.fetchone':<28} {per_message_db * 1e6:8.1f} мкс")
+    print(f"  {'telegram_id in реестр':<28} {per_message * 1e6:8.1f} мкс  ({per_message_db / per_message:.0f}x)\n")
+
+    def as_dicts():
+        by_id = {tid: (phone, phone_key(phone), cid) for tid, phone, cid in clients}
+        by_key = {}
+        for tid, (_, key, _) in by_id.items():
+            by_key.setdefault(key, []).append(tid)
+        return by_id, by_key
+
+    def as_registry():
+        fresh = ClientRegistry()
+        fresh.load(clients)
+        return fresh
+
+    plain = retained(as_dicts)
+    compact = retained(as_registry)
+    print(f"{'Словари с кортежами':<30} {plain / 1024 / 1024:8.1f} МБ")
+    print(f"{'ClientRegistry (array)':<30} {compact / 1024 / 1024:8.1f} МБ  "
+          f"({compact / count:.0f} Б на клиента, в {plain / compact:.1f} раза меньше)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Время старта бота до готовности принимать обновления:
+было — скачать базу из S3, затем init_db и restore_backup_data по отдельности;
+стало — проверить локальную копию и подготовить базу одной транзакцией,
+сверка с S3 идёт в фоне. S3 имитируется с задержкой и ограниченной скоростью.
+
+Запустите: python bench_startup.py [кол-во_клиентов] [задержка_S3_мс] [скорость_S3_МБ/с]
+"""
+
+import asyncio
+import gzip
+import io
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import bot as bot_module
+from persistence import S3Persistence, local_copy_is_valid, snapshot_bytes, write_metadata
+from storage import Storage
+
+BUCKET = "bench"
+KEY = "clients.db"
+
+
+class SimulatedS3:
+    """S3 в памяти: каждый запрос ждёт latency, передача — со скоростью bandwidth"""
+
+    def __init__(self, latency: float, bandwidth: float):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.objects = {}
+
+    def _wait(self, size: int = 0):
+        time.sleep(self.latency + size / self.bandwidth)
+
+    def put_object(self, Bucket, Key, Body, Metadata=None):
+        self._wait(len(Body))
+        self.objects[Key] = bytes(Body)
+        return {"ETag": f'"{hash(self.objects[Key])}"'}
+
+    def head_object(self, Bucket, Key):
+        self._wait()
+        if Key not in self.objects:
+            raise KeyError(Key)
+        return {"ETag": f'"{hash(self.objects[Key])}"'}
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            self._wait()
+            raise KeyError(Key)
+        self._wait(len(self.objects[Key]))
+        return {"Body": io.BytesIO(self.objects[Key]), "ETag": f'"{hash(self.objects[Key])}"'}
+
+
+async def build_database(path: Path, clients: int):
+    """База с clients клиентами и втрое большим числом отслеживаемых записей"""
+    bot_module.storage = Storage(path)
+    bot_module.storage.open()
+    await bot_module.init_db()
+
+    def fill(conn: sqlite3.Connection):
+        conn.executemany(
+            "INSERT INTO clients (telegram_id, phone_number, phone_key, first_name) VALUES (?, ?, ?, ?)",
+            ((100000 + i, f"+7999{i:07d}", f"999{i:07d}", f"Клиент {i}") for i in range(clients)),
+        )
+        conn.executemany(
+            "INSERT INTO tracked_records (record_id, client_phone, datetime, services, staff_name, status) "
+            "VALUES (?, ?, '2026-02-05T13:30:00+03:00', 'Мужская стрижка', 'Мастер', 'active')",
+            ((i, f"+7999{i % clients:07d}") for i in range(clients * 3)),
+        )
+
+    await bot_module.storage.write(fill)
+    await bot_module.storage.checkpoint()
+    bot_module.storage.close()
+
+
+async def start_s3_first(db_path: Path, persistence: S3Persistence) -> float:
+    """Старый порядок: загрузка из S3 → открыть → init_db → restore_backup_data"""
+    started = time.perf_counter()
+    persistence.restore()
+    bot_module.storage = Storage(db_path)
+    bot_module.storage.open()
+    await bot_module.init_db()
+    await bot_module.restore_backup_data()
+    elapsed = time.perf_counter() - started
+    bot_module.storage.close()
+    return elapsed
+
+
+async def start_local_first(db_path: Path, persistence: S3Persistence) -> tuple:
+    """Новый порядок: quick_check → открыть → prepare_db; сверка с S3 — в фоне"""
+    started = time.perf_counter()
+    assert local_copy_is_valid(db_path)
+    bot_module.storage = Storage(db_path)
+    bot_module.storage.open()
+    await bot_module.prepare_db()
+    ready = time.perf_counter() - started
+
+    bot_module.DB_PATH = db_path
+    bot_module.db_persistence = persistence
+    await bot_module.reconcile_with_s3()
+    reconciled = time.perf_counter() - started
+    bot_module.storage.close()
+    return ready, reconciled
+
+
+async def run(clients: int, latency_ms: float, bandwidth_mb: float):
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        source = tmp / "source.db"
+        await build_database(source, clients)
+        data = snapshot_bytes(source)
+
+        s3 = SimulatedS3(latency_ms / 1000, bandwidth_mb * 1024 * 1024)
+        s3.objects[KEY + ".gz"] = gzip.compress(data, compresslevel=6)
+
+        print(f"📊 База: {clients} клиентов, {len(data) / 1024 / 1024:.1f} МБ "
+              f"(в S3 {len(s3.objects[KEY + '.gz']) / 1024 / 1024:.1f} МБ), "
+              f"S3: {latency_ms:.0f} мс + {bandwidth_mb:.0f} МБ/с\n")
+
+        cold_path = tmp / "cold.db"
+        cold = await start_s3_first(cold_path, S3Persistence(cold_path, lambda: s3, BUCKET, KEY))
+        print(f"{'Загрузка из S3 перед стартом':<45} {cold:7.2f} с до готовности")
+
+        # Локальная копия совпадает с S3 — сверка ограничится HEAD-запросом
+        local_path = tmp / "local.db"
+        local_path.write_bytes(data)
+        persistence = S3Persistence(local_path, lambda: s3, BUCKET, KEY)
+        write_metadata(local_path, s3.head_object(Bucket=BUCKET, Key=KEY + ".gz")["ETag"])
+        ready, reconciled = await start_local_first(local_path, persistence)
+        print(f"{'Локальная копия, S3 не менялась':<45} {ready:7.2f} с до готовности, "
+              f"сверка в фоне {reconciled:.2f} с")
+
+        # Копия в S3 новее — фоновая сверка скачает её и допишет строки
+        write_metadata(local_path, "устаревшая")
+        ready, reconciled = await start_local_first(local_path, persistence)
+        print(f"{'Локальная копия, S3 новее':<45} {ready:7.2f} с до готовности, "
+              f"сверка в фоне {reconciled:.2f} с")
+        persistence.worker.shutdown()
+
+
+if __name__ == "__main__":
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    latency_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 80
+    bandwidth_mb = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+    asyncio.run(run(clients, latency_ms, bandwidth_mb))
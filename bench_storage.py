@@ -0,0 +1,142 @@
+"""
+Микро-бенчмарк хранилища: sqlite3.connect на каждый вызов vs Storage (WAL + писатель + пул чтения).
+Запустите: python bench_storage.py [кол-во_записей]
+"""
+
+import asyncio
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from storage import Storage
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS tracked_records (
+        record_id INTEGER PRIMARY KEY,
+        client_phone TEXT,
+        datetime TEXT,
+        services TEXT,
+        staff_name TEXT,
+        status TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sent_notifications (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        record_id INTEGER NOT NULL,
+        notification_type TEXT NOT NULL,
+        sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(record_id, notification_type)
+    )
+    """,
+]
+
+UPSERT_SQL = """
+    INSERT INTO tracked_records (record_id, client_phone, datetime, services, staff_name, status, updated_at)
+    VALUES (?, ?, ?, ?, ?, 'active', CURRENT_TIMESTAMP)
+    ON CONFLICT(record_id) DO UPDATE SET
+        datetime = excluded.datetime,
+        services = excluded.services,
+        staff_name = excluded.staff_name,
+        status = excluded.status,
+        updated_at = CURRENT_TIMESTAMP
+"""
+SELECT_TRACKED_SQL = "SELECT * FROM tracked_records WHERE record_id = ?"
+SELECT_SENT_SQL = "SELECT 1 FROM sent_notifications WHERE record_id = ? AND notification_type = ?"
+
+
+def record_args(i: int):
+    return (i, "+79990000000", "2026-02-05T13:30:00+03:00", "Стрижка", "Мастер")
+
+
+def create_db(path: Path):
+    conn = sqlite3.connect(path)
+    for sql in SCHEMA:
+        conn.execute(sql)
+    conn.commit()
+    conn.close()
+
+
+# ---------- было: новое соединение на каждый вызов ----------
+
+def old_get_tracked(path, record_id):
+    conn = sqlite3.connect(path)
+    result = conn.execute(SELECT_TRACKED_SQL, (record_id,)).fetchone()
+    conn.close()
+    return result
+
+
+def old_is_sent(path, record_id):
+    conn = sqlite3.connect(path)
+    result = conn.execute(SELECT_SENT_SQL, (record_id, "new")).fetchone()
+    conn.close()
+    return result is not None
+
+
+def old_save_tracked(path, record_id):
+    conn = sqlite3.connect(path)
+    conn.execute(UPSERT_SQL, record_args(record_id))
+    conn.commit()
+    conn.close()
+
+
+def bench_old(path: Path, n: int) -> float:
+    start = time.perf_counter()
+    for i in range(n):
+        old_get_tracked(path, i)
+        old_is_sent(path, i)
+        old_save_tracked(path, i)
+    return time.perf_counter() - start
+
+
+# ---------- стало: Storage ----------
+
+async def new_cycle_step(storage: Storage, record_id: int):
+    await storage.fetchone(SELECT_TRACKED_SQL, (record_id,))
+    await storage.fetchone(SELECT_SENT_SQL, (record_id, "new"))
+    await storage.execute(UPSERT_SQL, record_args(record_id))
+
+
+async def bench_new(path: Path, n: int, concurrency: int) -> float:
+    storage = Storage(path)
+    storage.open()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def step(i):
+        async with semaphore:
+            await new_cycle_step(storage, i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(step(i) for i in range(n)))
+    elapsed = time.perf_counter() - start
+    storage.close()
+    return elapsed
+
+
+def report(title: str, n: int, elapsed: float):
+    ops = n * 3
+    print(f"{title:<40} {elapsed:8.3f} с   {ops / elapsed:10.0f} оп/с")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        old_path = Path(tmp) / "old.db"
+        new_path = Path(tmp) / "new.db"
+        create_db(old_path)
+        create_db(new_path)
+
+        print(f"📊 {n} записей × 3 операции (get_tracked + is_sent + save_tracked)\n")
+        report("sqlite3.connect на каждый вызов", n, bench_old(old_path, n))
+        report("Storage, последовательно", n, asyncio.run(bench_new(new_path, n, 1)))
+        report("Storage, 32 параллельных задачи", n, asyncio.run(bench_new(new_path, n, 32)))
+
+
+if __name__ == "__main__":
+    main()
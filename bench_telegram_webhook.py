@@ -0,0 +1,116 @@
+"""
+Стенд для вебхук-режима Telegram: поднимает приложение бота локально и
+отправляет в него синтетические обновления, без обращения к Telegram.
+Исходящие вызовы Bot API подменяются заглушкой, база — временная.
+
+Запустите: python bench_telegram_webhook.py [кол-во_обновлений] [параллельность]
+"""
+
+import asyncio
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+
+import bot as bot_module
+from storage import Storage
+
+HOST = "127.0.0.1"
+PORT = 8781
+SECRET = "bench-secret"
+TEXTS = ["/start", "📞 Связаться", "✏️ Записаться", "привет"]
+
+
+class NullSession(BaseSession):
+    """Сессия Bot API, которая никуда не ходит и считает вызовы"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls += 1
+        return None
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def make_update(update_id: int) -> dict:
+    user_id = 100000 + update_id % 500
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Тест"},
+            "text": TEXTS[update_id % len(TEXTS)],
+        },
+    }
+
+
+async def run(total: int, concurrency: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        bot_module.storage = Storage(Path(tmp) / "bench.db")
+        bot_module.storage.open()
+        await bot_module.init_db()
+
+        session = NullSession()
+        bot_module.bot = Bot(token="123456:BENCH", session=session)
+        bot_module.TELEGRAM_MODE = "webhook"
+        bot_module.TELEGRAM_WEBHOOK_SECRET = SECRET
+        # Ждём завершения обработчика, чтобы мерить именно его пропускную способность
+        bot_module.TELEGRAM_WEBHOOK_BACKGROUND = False
+        bot_module.YCLIENTS_WEBHOOK_ENABLED = False
+        bot_module.WEB_SERVER_HOST, bot_module.WEB_SERVER_PORT = HOST, PORT
+
+        runner = await bot_module.start_web_server(bot_module.create_web_app())
+        url = f"http://{HOST}:{PORT}{bot_module.TELEGRAM_WEBHOOK_PATH}"
+        headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+
+        latencies = []
+        errors = 0
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async with aiohttp.ClientSession() as client:
+            async def send(update_id: int):
+                nonlocal errors
+                async with semaphore:
+                    started = time.perf_counter()
+                    async with client.post(url, json=make_update(update_id), headers=headers) as resp:
+                        await resp.read()
+                        if resp.status != 200:
+                            errors += 1
+                    latencies.append(time.perf_counter() - started)
+
+            # Прогрев
+            await asyncio.gather(*(send(i) for i in range(min(50, total))))
+            latencies.clear()
+
+            started = time.perf_counter()
+            await asyncio.gather(*(send(i) for i in range(total)))
+            elapsed = time.perf_counter() - started
+
+        await runner.cleanup()
+        bot_module.storage.close()
+
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    print(f"📊 Обновлений: {total}, параллельно: {concurrency}, ошибок: {errors}")
+    print(f"   Пропускная способность: {total / elapsed:.0f} обновлений/с")
+    print(f"   Задержка: p50 {p(0.5):.1f} мс, p95 {p(0.95):.1f} мс, p99 {p(0.99):.1f} мс")
+    print(f"   Вызовов Bot API (заглушка): {session.calls}")
+
+
+if __name__ == "__main__":
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    asyncio.run(run(total, concurrency))
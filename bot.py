@@ -7,11 +7,16 @@ Telegram бот для барбершопа с интеграцией YClients.
 """
 
 import asyncio
+import heapq
+import hmac
 import logging
+import random
 import sqlite3
 import json
 import locale
-from datetime import datetime, timedelta
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta, timezone
 from pathlib import Path
 
 # Устанавливаем русскую локаль для дней недели
@@ -38,34 +43,16 @@ MONTHS_RU = {
 }
 
 
-def generate_ics_file(record: dict) -> bytes:
+def generate_ics_file(record: "Record") -> bytes:
     """Генерация .ics файла для добавления в календарь"""
-    datetime_str = record.get("datetime", "")
-    services_list = record.get("services") or []
-    services = ", ".join([s.get("title", "") for s in services_list if isinstance(s, dict)])
+    services = record.services_title
+    staff_name = record.staff.name
+    record_id = record.id or "0"
     
-    staff = record.get("staff") or {}
-    staff_name = staff.get("name", "") if isinstance(staff, dict) else ""
-    
-    record_id = record.get("id", "0")
-    
-    # Парсим дату
-    try:
-        if "T" in datetime_str:
-            dt_start = datetime.fromisoformat(datetime_str.replace("Z", "+00:00")).replace(tzinfo=None)
-        else:
-            dt_start = datetime.strptime(datetime_str, "%Y-%m-%d %H:%M:%S")
-    except:
-        dt_start = datetime.now() + timedelta(days=1)
+    dt_start = record.start or datetime.now() + timedelta(days=1)
     
     # Длительность услуги (по умолчанию 1 час)
-    duration_minutes = 60
-    for s in services_list:
-        if isinstance(s, dict) and s.get("length"):
-            duration_minutes = s.get("length", 60)
-            break
-    
-    dt_end = dt_start + timedelta(minutes=duration_minutes)
+    dt_end = dt_start + timedelta(minutes=record.duration_minutes)
     
     # Форматируем даты для ICS
     dt_format = "%Y%m%dT%H%M%S"
@@ -103,20 +90,18 @@ END:VCALENDAR"""
     return ics_content.encode('utf-8')
 
 
-# Хранилище записей для callback (временное)
-records_cache = {}
-
-
-def format_record_datetime(datetime_str: str) -> str:
+def format_record_datetime(value) -> str:
     """Форматирование даты и времени записи: '5 февраля (среда) в 13:30'"""
-    if not datetime_str:
+    if not value:
         return ""
     
     try:
-        if "T" in datetime_str:
-            dt = datetime.fromisoformat(datetime_str.replace("Z", "+00:00")).replace(tzinfo=None)
+        if isinstance(value, datetime):
+            dt = value
+        elif "T" in value:
+            dt = datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
         else:
-            dt = datetime.strptime(datetime_str, "%Y-%m-%d")
+            dt = datetime.strptime(value, "%Y-%m-%d")
         
         day = dt.day
         month = MONTHS_RU.get(dt.month, "")
@@ -125,9 +110,10 @@ def format_record_datetime(datetime_str: str) -> str:
         
         return f"{day} {month} ({weekday}) в {time_str}"
     except:
-        return datetime_str
+        return value
 
 import aiohttp
+from aiohttp import web
 from aiogram import Bot, Dispatcher, F
 from aiogram.filters import CommandStart, Command
 from aiogram.types import (
@@ -141,6 +127,16 @@ from aiogram.types import (
     BufferedInputFile,
 )
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from cache import RecordCache, TTLCache
+from models import Record, loads, normalize_phone, parse_datetime, parse_records_page, phone_key
+from persistence import S3Persistence, WalReplicator, local_copy_is_valid, make_s3_client, read_metadata
+from registry import ClientRegistry
+from retention import RetentionJob
+from staff_directory import StaffDirectory
+from storage import DATA_DIR, DB_PATH, Storage
 
 # ==================== НАСТРОЙКИ ====================
 
@@ -163,6 +159,75 @@ BARBERSHOP_PHONE = "+7 (4832) 377-888"
 # Интервал проверки записей (в секундах)
 CHECK_INTERVAL = 5  # Проверяем каждые 5 секунд
 
+# Адаптивный интервал: замедляемся без изменений и в нерабочее время,
+# ускоряемся после изменений, соблюдаем лимиты YClients
+POLL_INTERVAL_MAX = 60             # потолок в рабочее время
+POLL_INTERVAL_OFF_HOURS = 300      # в нерабочее время
+POLL_IDLE_CYCLES = 3               # циклов без изменений до начала замедления
+POLL_BACKOFF_FACTOR = 1.5
+POLL_JITTER = 0.1                  # ±10% случайного разброса
+BUSINESS_HOURS = (9, 22)           # [начало, конец) по часам салона
+SALON_UTC_OFFSET_HOURS = 3         # часовой пояс салона (как в датах записей YClients), не сервера
+RATE_LIMIT_LOW_REMAINING = 10      # остаток лимита, при котором притормаживаем
+
+# Уровни опроса: (название, первый день, последний день от сегодня, интервал в секундах).
+# Дни считаются от сегодня (0). Ближайшие опрашиваются часто, дальние — редко;
+# вместе покрывают сегодня и 7 дней вперёд (как upcoming_range).
+POLL_TIERS = [
+    ("сегодня", 0, 0, CHECK_INTERVAL),
+    ("завтра", 1, 1, 30),
+    ("через 2-7 дней", 2, 7, 300),
+]
+
+# «Мои записи» отвечают из снимка опроса, если он не старше стольких секунд
+MY_RECORDS_MAX_AGE = 600
+# Иначе — запрос записей клиента в YClients, ответ кэшируется на столько секунд
+MY_RECORDS_CACHE_TTL = 60
+
+# Записи для кнопки «В календарь» (вытеснение LRU + TTL, лимит по памяти)
+RECORD_CACHE_MAX_ITEMS = 2000
+RECORD_CACHE_MAX_BYTES = 4 * 1024 * 1024
+RECORD_CACHE_TTL = 6 * 3600
+
+# Список мастеров YClients (для /staff): кэш на столько секунд, обновление в фоне чаще
+STAFF_LIST_CACHE_TTL = 6 * 3600
+STAFF_LIST_REFRESH_INTERVAL = 3600
+
+# Размер страницы и число параллельных запросов страниц записей YClients
+RECORDS_PAGE_SIZE = 200
+RECORDS_PAGE_CONCURRENCY = 4
+
+# Напоминания: за сколько часов до визита
+REMINDER_HOURS = [24, 2]  # Можно добавить: [48, 24, 2]
+REMINDER_GRACE_MINUTES = 60  # опоздавшее напоминание (простой, перенос) ещё отправляем
+
+# Отправка сообщений из очереди: лимиты Telegram и повторы
+TELEGRAM_GLOBAL_RATE = 25          # сообщений в секунду на бота (лимит Telegram ~30)
+TELEGRAM_CHAT_RATE = 1             # сообщений в секунду в один чат
+OUTBOX_BATCH_SIZE = 100
+NOTIFY_CONCURRENCY = 16            # одновременных отправок (в разные чаты)
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_RETRY_BASE = 5              # сек, удваивается с каждой попыткой
+OUTBOX_RETRY_MAX = 3600
+
+# Веб-сервер для вебхуков (общий для всех входящих HTTP-запросов)
+WEB_SERVER_HOST = "0.0.0.0"
+WEB_SERVER_PORT = 8080
+
+# Режим получения обновлений Telegram: "polling" (getUpdates) или "webhook"
+TELEGRAM_MODE = "polling"
+TELEGRAM_WEBHOOK_URL = ""                 # публичный адрес сервера, напр. https://bot.example.com
+TELEGRAM_WEBHOOK_PATH = "/telegram/webhook"
+TELEGRAM_WEBHOOK_SECRET = ""              # проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+TELEGRAM_WEBHOOK_BACKGROUND = True        # отвечать Telegram сразу, обработчик — в фоне
+
+# Вебхуки YClients: события записей приходят сразу, опрос становится сверкой.
+# В YClients указывается URL вида https://<хост>/yclients/webhook?secret=<секрет>
+YCLIENTS_WEBHOOK_ENABLED = False
+YCLIENTS_WEBHOOK_PATH = "/yclients/webhook"
+YCLIENTS_WEBHOOK_SECRET = ""      # обязателен при включённых вебхуках
+YCLIENTS_RECONCILE_INTERVAL = 300  # интервал сверки опросом при включённых вебхуках
+
 # Минимальный перенос для уведомления (в минутах)
 MIN_RESCHEDULE_MINUTES = 15
 
@@ -185,6 +250,15 @@ S3_BUCKET = "09756767-976b-412c-8e2b-dc5b155d26a8"
 S3_ENDPOINT = "https://s3.twcstorage.ru"
 S3_DB_KEY = "clients.db"
 
+# Как сохранять базу в S3:
+#   "snapshot" — сжатый снимок целиком, не чаще раза в S3_SYNC_DEBOUNCE сек
+#   "wal"      — непрерывная репликация WAL + базовый снимок раз в S3_SNAPSHOT_INTERVAL сек
+#   "off"      — не сохранять
+S3_SYNC_MODE = "snapshot"
+S3_SYNC_DEBOUNCE = 30
+S3_WAL_PREFIX = "replica"
+S3_SNAPSHOT_INTERVAL = 3600
+
 # Резервные данные клиентов (не теряются при перезапуске)
 # Формат: telegram_id: phone
 BACKUP_CLIENTS = {
@@ -199,72 +273,136 @@ BACKUP_STAFF = {
 
 # ==================== БАЗА ДАННЫХ ====================
 
-DB_PATH = Path(__file__).parent / "clients.db"
+# Одно соединение на запись (WAL) + пул на чтение
+storage = Storage(DB_PATH)
+
+# Очистка истории: строки старше RETENTION_DAYS (отменённые и прошедшие записи,
+# отметки об уведомлениях, доставленные сообщения) уходят в gzip-архив на диске
+RETENTION_DAYS = 90
+RETENTION_INTERVAL = 24 * 3600
+RETENTION_FIRST_RUN_DELAY = 600     # после старта, чтобы не мешать запуску
+RETENTION_ARCHIVE_DIR = DATA_DIR / "archive"
+
+# Размер чанка для запросов WHERE ... IN (...)
+SQL_IN_CHUNK = 500
+
+
+def _s3_client():
+    logger.info(f"Подключаюсь к S3: {S3_ENDPOINT}, bucket: {S3_BUCKET}")
+    return make_s3_client(S3_ENDPOINT, S3_ACCESS_KEY, S3_SECRET_KEY)
+
+
+# Фоновое сохранение базы в S3 (выгрузка — в отдельном потоке)
+if S3_SYNC_MODE == "wal":
+    db_persistence = WalReplicator(
+        storage, _s3_client, S3_BUCKET, S3_WAL_PREFIX, snapshot_interval=S3_SNAPSHOT_INTERVAL
+    )
+elif S3_SYNC_MODE == "snapshot":
+    db_persistence = S3Persistence(DB_PATH, _s3_client, S3_BUCKET, S3_DB_KEY, debounce=S3_SYNC_DEBOUNCE)
+else:
+    db_persistence = None
 
 
 def sync_db_from_s3():
     """Скачать базу данных из S3 при старте"""
-    try:
-        import boto3
-        from botocore.config import Config
-        from botocore.exceptions import ClientError
-        
-        logger.info(f"Подключаюсь к S3: {S3_ENDPOINT}, bucket: {S3_BUCKET}")
-        
-        s3 = boto3.client(
-            's3',
-            endpoint_url=S3_ENDPOINT,
-            aws_access_key_id=S3_ACCESS_KEY,
-            aws_secret_access_key=S3_SECRET_KEY,
-            region_name='ru-1',
-            config=Config(signature_version='s3v4')
-        )
-        
-        s3.download_file(S3_BUCKET, S3_DB_KEY, str(DB_PATH))
-        logger.info("✅ База данных загружена из S3")
-        return True
-    except ClientError as e:
-        error_code = e.response.get('Error', {}).get('Code', 'Unknown')
-        logger.info(f"S3 ClientError ({error_code}): {e}")
-        return False
-    except Exception as e:
-        logger.info(f"S3 ошибка загрузки: {type(e).__name__}: {e}")
+    if db_persistence is None:
         return False
+    return db_persistence.restore()
+
+
+def _read_remote_rows(path: Path) -> dict:
+    """Клиенты, сотрудники и отметки об уведомлениях из скачанной копии"""
+    queries = {
+        "clients": "SELECT telegram_id, phone_number, first_name, last_name, username FROM clients",
+        "staff": "SELECT telegram_id, staff_name, yclients_staff_id, phone_number, is_active FROM staff",
+        "sent": "SELECT record_id, notification_type FROM sent_notifications",
+    }
+    rows = {}
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        for name, sql in queries.items():
+            try:
+                rows[name] = conn.execute(sql).fetchall()
+            except sqlite3.OperationalError as e:
+                logger.info(f"Сверка с S3: нет данных {name} ({e})")
+                rows[name] = []
+    finally:
+        conn.close()
+    return rows
+
+
+def _merge_remote_rows(conn: sqlite3.Connection, rows: dict) -> int:
+    """Добавить недостающие строки из копии S3 (локальные данные не перезаписываются)"""
+    before = conn.total_changes
+    conn.executemany("""
+        INSERT OR IGNORE INTO clients (telegram_id, phone_number, phone_key, first_name, last_name, username)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [(tid, phone, phone_key(phone), first, last, username)
+          for tid, phone, first, last, username in rows["clients"]])
+    conn.executemany("""
+        INSERT OR IGNORE INTO staff (telegram_id, staff_name, yclients_staff_id, phone_number, is_active)
+        VALUES (?, ?, ?, ?, ?)
+    """, rows["staff"])
+    conn.executemany(MARK_NOTIFICATION_SENT_SQL, rows["sent"])
+    return conn.total_changes - before
+
+
+async def reconcile_with_s3():
+    """Сверить локальную базу с копией в S3 и дописать недостающее"""
+    remote = await db_persistence.remote_version()
+    known = read_metadata(DB_PATH).get("version")
+    if remote is None:
+        logger.info("Сверка с S3: копии в S3 нет")
+        return
+    if remote == known:
+        logger.info("Сверка с S3: локальная база актуальна")
+        return
+    
+    remote_path = DB_PATH.with_name(DB_PATH.name + ".remote")
+    try:
+        if not await db_persistence.download(remote_path):
+            return
+        rows = await asyncio.to_thread(_read_remote_rows, remote_path)
+        added = await storage.write(_merge_remote_rows, rows)
+        logger.info(f"✅ Сверка с S3: добавлено строк {added}")
+        # Локальные строки не перезаписываются — в реестр добавляем только новых клиентов
+        for telegram_id, phone, *_ in rows["clients"]:
+            if telegram_id not in client_registry:
+                client_registry.add(telegram_id, phone)
+        if rows["staff"]:
+            staff_directory.invalidate()
+        notify_db_changed()
+    finally:
+        for suffix in ("", "-wal", "-shm"):
+            Path(str(remote_path) + suffix).unlink(missing_ok=True)
 
 
-def sync_db_to_s3():
-    """Загрузить базу данных в S3"""
-    try:
-        import boto3
-        from botocore.config import Config
-        from botocore.exceptions import ClientError
-        
-        logger.info("Сохраняю базу в S3...")
-        
-        s3 = boto3.client(
-            's3',
-            endpoint_url=S3_ENDPOINT,
-            aws_access_key_id=S3_ACCESS_KEY,
-            aws_secret_access_key=S3_SECRET_KEY,
-            region_name='ru-1',
-            config=Config(signature_version='s3v4')
-        )
-        
-        s3.upload_file(str(DB_PATH), S3_BUCKET, S3_DB_KEY)
-        logger.info("✅ База данных сохранена в S3")
-        return True
-    except ClientError as e:
-        error_code = e.response.get('Error', {}).get('Code', 'Unknown')
-        logger.error(f"S3 ClientError ({error_code}): {e}")
-        return False
-    except Exception as e:
-        logger.error(f"S3 ошибка сохранения: {type(e).__name__}: {e}")
-        return False
+async def sync_with_s3(reconcile: bool):
+    """Фоном: сверка с S3 (если стартовали с локальной копии), затем выгрузка изменений"""
+    if reconcile:
+        try:
+            await reconcile_with_s3()
+        except Exception as e:
+            logger.error(f"Ошибка сверки с S3: {type(e).__name__}: {e}")
+    await db_persistence.start()
 
 
-def init_db():
-    """Инициализация базы данных"""
-    conn = sqlite3.connect(DB_PATH)
+def notify_db_changed():
+    """Отметить, что база изменилась (выгрузка в S3 — в фоне)"""
+    if db_persistence is not None:
+        db_persistence.notify_change()
+
+
+retention_job = RetentionJob(storage, RETENTION_ARCHIVE_DIR, RETENTION_DAYS, on_change=notify_db_changed)
+
+# Клиенты в памяти (telegram_id <-> телефон): обработчики и проверка записей не ходят в базу
+client_registry = ClientRegistry()
+
+CLIENT_REGISTRY_SQL = "SELECT telegram_id, phone_number, yclients_client_id FROM clients"
+
+
+def _create_schema(conn: sqlite3.Connection):
+    """Создание таблиц (выполняется в потоке-писателе)"""
     cursor = conn.cursor()
     
     # Таблица клиентов
@@ -326,146 +464,203 @@ def init_db():
         )
     """)
     
+    # Очередь исходящих сообщений Telegram (отправляет OutboxDispatcher)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            record_id INTEGER,
+            notification_type TEXT NOT NULL,
+            text TEXT NOT NULL,
+            reply_markup TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP,
+            UNIQUE(record_id, notification_type, chat_id)
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_outbox_chat ON outbox(chat_id, status, id)
+    """)
+    
     # Индекс для быстрого поиска по телефону
     cursor.execute("""
         CREATE INDEX IF NOT EXISTS idx_phone ON clients(phone_number)
     """)
     
-    conn.commit()
-    conn.close()
+    # Активные записи по дате: отмены в окне опроса и закрытие прошедших
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_tracked_status_datetime ON tracked_records(status, datetime)
+    """)
+    
+    # Миграция: канонический ключ телефона (последние 10 цифр)
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(clients)")}
+    if "phone_key" not in columns:
+        cursor.execute("ALTER TABLE clients ADD COLUMN phone_key TEXT")
+    # ID клиента в YClients: «Мои записи» запрашивают только его записи
+    if "yclients_client_id" not in columns:
+        cursor.execute("ALTER TABLE clients ADD COLUMN yclients_client_id INTEGER")
+    
+    rows = cursor.execute("SELECT id, phone_number FROM clients WHERE phone_key IS NULL").fetchall()
+    if rows:
+        cursor.executemany(
+            "UPDATE clients SET phone_key = ? WHERE id = ?",
+            [(phone_key(phone), client_id) for client_id, phone in rows]
+        )
+        logger.info(f"Заполнен phone_key для {len(rows)} клиентов")
+    
+    # Миграция: отпечаток полей записи для пропуска неизменённых записей
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(tracked_records)")}
+    if "fingerprint" not in columns:
+        cursor.execute("ALTER TABLE tracked_records ADD COLUMN fingerprint TEXT")
+    
+    # Запланированные напоминания (в памяти — куча ReminderScheduler)
+    has_reminders_table = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'scheduled_reminders'"
+    ).fetchone()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS scheduled_reminders (
+            record_id INTEGER NOT NULL,
+            offset_hours INTEGER NOT NULL,
+            fire_at REAL NOT NULL,
+            payload TEXT NOT NULL,
+            PRIMARY KEY (record_id, offset_hours)
+        )
+    """)
+    if not has_reminders_table:
+        # Сбрасываем отпечатки, чтобы первый цикл запланировал напоминания для уже известных записей
+        cursor.execute("UPDATE tracked_records SET fingerprint = NULL")
+    
+    # Покрывающий индекс: поиск telegram_id по ключу без обращения к таблице.
+    # Один номер может быть у нескольких аккаунтов, поэтому уникальна пара.
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_phone_key ON clients(phone_key, telegram_id)
+    """)
+
+
+async def init_db():
+    """Инициализация базы данных"""
+    await storage.write(_create_schema)
     logger.info("База данных инициализирована")
 
 
-def save_client(telegram_id: int, phone: str, first_name: str = None,
-                last_name: str = None, username: str = None):
+async def prepare_db():
+    """Схема и резервные данные — одной транзакцией, затем загрузка реестра клиентов"""
+    def apply(conn: sqlite3.Connection):
+        _create_schema(conn)
+        _restore_backup_rows(conn)
+        return conn.execute(CLIENT_REGISTRY_SQL).fetchall()
+    
+    rows = await storage.write(apply)
+    client_registry.load(rows)
+    logger.info(
+        f"База данных готова, из резерва: {len(BACKUP_CLIENTS)} клиентов, {len(BACKUP_STAFF)} сотрудников; "
+        f"реестр клиентов: {len(client_registry)} ({client_registry.memory_bytes() / 1024:.0f} КБ)"
+    )
+
+
+async def save_client(telegram_id: int, phone: str, first_name: str = None,
+                      last_name: str = None, username: str = None):
     """Сохранение клиента"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
     phone = normalize_phone(phone)
     
     try:
-        cursor.execute("""
-            INSERT INTO clients (telegram_id, phone_number, first_name, last_name, username)
-            VALUES (?, ?, ?, ?, ?)
+        await storage.execute("""
+            INSERT INTO clients (telegram_id, phone_number, phone_key, first_name, last_name, username)
+            VALUES (?, ?, ?, ?, ?, ?)
             ON CONFLICT(telegram_id) DO UPDATE SET
                 phone_number = excluded.phone_number,
+                phone_key = excluded.phone_key,
+                -- Другой телефон — другой клиент YClients: его ID найдём заново
+                yclients_client_id = CASE WHEN clients.phone_key = excluded.phone_key
+                                          THEN clients.yclients_client_id END,
                 first_name = excluded.first_name,
                 last_name = excluded.last_name,
                 username = excluded.username
-        """, (telegram_id, phone, first_name, last_name, username))
-        conn.commit()
+        """, (telegram_id, phone, phone_key(phone), first_name, last_name, username))
+        client_registry.add(telegram_id, phone)
         logger.info(f"Клиент сохранён: {phone} (Telegram ID: {telegram_id})")
         
-        # Сохраняем базу в S3
-        sync_db_to_s3()
+        # Сохраняем базу в S3 (в фоне, изменения за несколько секунд — одной выгрузкой)
+        notify_db_changed()
         
         return True
     except Exception as e:
         logger.error(f"Ошибка сохранения клиента: {e}")
         return False
-    finally:
-        conn.close()
 
 
-def get_telegram_id_by_phone(phone: str):
-    """Получение Telegram ID по номеру телефона"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    phone_clean = ''.join(filter(str.isdigit, phone))[-10:]
-    
-    cursor.execute(
-        "SELECT telegram_id FROM clients WHERE phone_number LIKE ?",
-        (f"%{phone_clean}",)
-    )
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else None
+async def get_telegram_ids_by_phones(phones) -> dict:
+    """Пакетное получение Telegram ID: {phone_key: [telegram_id, ...]} из реестра в памяти"""
+    return client_registry.lookup(phone_key(p) for p in phones if p)
 
 
-def get_tracked_record(record_id: int):
-    """Получить сохранённую запись"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM tracked_records WHERE record_id = ?", (record_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result
-
-
-def save_tracked_record(record_id: int, client_phone: str, datetime_str: str, 
-                        services: str, staff_name: str, status: str = "active"):
-    """Сохранить запись для отслеживания"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO tracked_records (record_id, client_phone, datetime, services, staff_name, status, updated_at)
-        VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-        ON CONFLICT(record_id) DO UPDATE SET
-            datetime = excluded.datetime,
-            services = excluded.services,
-            staff_name = excluded.staff_name,
-            status = excluded.status,
-            updated_at = CURRENT_TIMESTAMP
-    """, (record_id, client_phone, datetime_str, services, staff_name, status))
-    conn.commit()
-    conn.close()
-
-
-def get_all_tracked_record_ids():
-    """Получить все ID отслеживаемых записей"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT record_id, datetime FROM tracked_records WHERE status = 'active'")
-    results = cursor.fetchall()
-    conn.close()
-    return {r[0]: r[1] for r in results}
-
-
-def mark_record_cancelled(record_id: int):
-    """Отметить запись как отменённую"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE tracked_records SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP WHERE record_id = ?",
-        (record_id,)
-    )
-    conn.commit()
-    conn.close()
-
-
-def is_notification_sent(record_id: int, notification_type: str) -> bool:
-    """Проверка, было ли отправлено уведомление"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT 1 FROM sent_notifications WHERE record_id = ? AND notification_type = ?",
-        (record_id, notification_type)
-    )
-    result = cursor.fetchone()
-    conn.close()
-    return result is not None
-
+SAVE_TRACKED_RECORD_SQL = """
+    INSERT INTO tracked_records (record_id, client_phone, datetime, services, staff_name, status,
+                                 fingerprint, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(record_id) DO UPDATE SET
+        client_phone = excluded.client_phone,
+        datetime = excluded.datetime,
+        services = excluded.services,
+        staff_name = excluded.staff_name,
+        status = excluded.status,
+        fingerprint = excluded.fingerprint,
+        updated_at = CURRENT_TIMESTAMP
+"""
+TRACKED_COLUMNS = "record_id, client_phone, datetime, services, staff_name, status, fingerprint"
 
-def mark_notification_sent(record_id: int, notification_type: str):
-    """Отметить уведомление как отправленное"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT OR IGNORE INTO sent_notifications (record_id, notification_type) VALUES (?, ?)",
-        (record_id, notification_type)
-    )
-    conn.commit()
-    conn.close()
+# Строка tracked_records в порядке TRACKED_COLUMNS
+TrackedRecord = namedtuple("TrackedRecord", TRACKED_COLUMNS)
+MARK_RECORD_CANCELLED_SQL = (
+    "UPDATE tracked_records SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP WHERE record_id = ?"
+)
+MARK_NOTIFICATION_SENT_SQL = (
+    "INSERT OR IGNORE INTO sent_notifications (record_id, notification_type) VALUES (?, ?)"
+)
+MARK_ATTENDANCE_NOTIFIED_SQL = "INSERT OR IGNORE INTO attendance_notified (record_id) VALUES (?)"
+SAVE_REMINDER_SQL = """
+    INSERT INTO scheduled_reminders (record_id, offset_hours, fire_at, payload)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(record_id, offset_hours) DO UPDATE SET
+        fire_at = excluded.fire_at,
+        payload = excluded.payload
+"""
+DROP_REMINDERS_SQL = "DELETE FROM scheduled_reminders WHERE record_id = ?"
+# С fire_at: срок, перепланированный одновременно с отправкой, не удаляется
+DROP_REMINDER_SQL = "DELETE FROM scheduled_reminders WHERE record_id = ? AND offset_hours = ? AND fire_at = ?"
+RESET_REMINDERS_SENT_SQL = "DELETE FROM sent_notifications WHERE record_id = ? AND notification_type LIKE 'reminder_%'"
+RESET_REMINDERS_OUTBOX_SQL = "DELETE FROM outbox WHERE record_id = ? AND notification_type LIKE 'reminder_%'"
+DROP_PENDING_REMINDERS_OUTBOX_SQL = (
+    "DELETE FROM outbox WHERE record_id = ? AND notification_type LIKE 'reminder_%' AND status = 'pending'"
+)
+# Прошедшие записи закрываются одним запросом, без уведомлений
+COMPLETE_PAST_RECORDS_SQL = """
+    UPDATE tracked_records SET status = 'completed', updated_at = CURRENT_TIMESTAMP
+    WHERE status = 'active' AND datetime < ?
+"""
+# Отменённые — активные записи окна опроса, которых нет в ответе API
+VANISHED_RECORDS_SQL = """
+    SELECT record_id FROM tracked_records
+    WHERE status = 'active' AND datetime >= ? AND datetime < ?
+      AND record_id NOT IN (SELECT record_id FROM temp.poll_record_ids)
+"""
+ENQUEUE_OUTBOX_SQL = """
+    INSERT OR IGNORE INTO outbox (chat_id, record_id, notification_type, text, reply_markup)
+    VALUES (?, ?, ?, ?, ?)
+"""
 
 
-def save_staff(telegram_id: int, staff_name: str, yclients_staff_id: int = None, phone: str = None):
+async def save_staff(telegram_id: int, staff_name: str, yclients_staff_id: int = None, phone: str = None):
     """Сохранение сотрудника"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute("""
+        await storage.execute("""
             INSERT INTO staff (telegram_id, staff_name, yclients_staff_id, phone_number)
             VALUES (?, ?, ?, ?)
             ON CONFLICT(telegram_id) DO UPDATE SET
@@ -473,81 +668,225 @@ def save_staff(telegram_id: int, staff_name: str, yclients_staff_id: int = None,
                 yclients_staff_id = excluded.yclients_staff_id,
                 phone_number = excluded.phone_number
         """, (telegram_id, staff_name, yclients_staff_id, phone))
-        conn.commit()
+        staff_directory.invalidate()
         logger.info(f"Сотрудник сохранён: {staff_name} (Telegram ID: {telegram_id})")
         
-        # Сохраняем базу в S3
-        sync_db_to_s3()
+        # Сохраняем базу в S3 (в фоне, изменения за несколько секунд — одной выгрузкой)
+        notify_db_changed()
         
         return True
     except Exception as e:
         logger.error(f"Ошибка сохранения сотрудника: {e}")
         return False
-    finally:
-        conn.close()
 
 
-def get_all_staff_telegram_ids():
-    """Получить Telegram ID всех активных сотрудников"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT telegram_id FROM staff WHERE is_active = 1")
-    results = cursor.fetchall()
-    conn.close()
-    return [r[0] for r in results]
+async def get_registered_yclients_staff_ids() -> set:
+    """YClients ID уже зарегистрированных сотрудников (из справочника в памяти)"""
+    return await staff_directory.registered_ids()
 
 
-def get_registered_yclients_staff_ids():
-    """Получить список YClients ID уже зарегистрированных сотрудников"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT yclients_staff_id FROM staff WHERE is_active = 1 AND yclients_staff_id IS NOT NULL")
-    results = cursor.fetchall()
-    conn.close()
-    return [r[0] for r in results]
+async def get_staff_by_yclients_id(yclients_staff_id: int):
+    """Сотрудник по YClients ID: ([telegram_id, ...], staff_name) или None (из справочника в памяти)"""
+    return await staff_directory.accounts(yclients_staff_id)
 
 
-def get_staff_by_yclients_id(yclients_staff_id: int):
-    """Получить сотрудника по YClients ID"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT telegram_id, staff_name FROM staff WHERE yclients_staff_id = ? AND is_active = 1", 
-                   (yclients_staff_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result
+def _diff_poll_window(conn: sqlite3.Connection, record_ids: list, window_start: str, window_end: str) -> tuple:
+    """Закрыть прошедшие записи и найти исчезнувшие из окна [window_start, window_end).
+    
+    Выполняется в потоке-писателе: временная таблица с ID из ответа API
+    живёт в его соединении (соединения чтения — query_only).
+    Возвращает (сколько закрыто, [record_id исчезнувших]).
+    """
+    completed = conn.execute(COMPLETE_PAST_RECORDS_SQL, (window_start,)).rowcount
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS poll_record_ids (record_id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.poll_record_ids")
+    conn.executemany("INSERT INTO temp.poll_record_ids VALUES (?)", ((rid,) for rid in record_ids))
+    vanished = [row[0] for row in conn.execute(VANISHED_RECORDS_SQL, (window_start, window_end))]
+    conn.execute("DELETE FROM temp.poll_record_ids")
+    return completed, vanished
 
 
-def is_attendance_notified(record_id: int) -> bool:
-    """Проверить, было ли уже отправлено уведомление о приходе"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT 1 FROM attendance_notified WHERE record_id = ?", (record_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result is not None
+def _select_in_chunks(conn: sqlite3.Connection, sql: str, ids: list):
+    """Выполнить SELECT ... IN ({}) чанками, вернуть все строки"""
+    rows = []
+    for i in range(0, len(ids), SQL_IN_CHUNK):
+        chunk = ids[i:i + SQL_IN_CHUNK]
+        rows.extend(conn.execute(sql.format(",".join("?" * len(chunk))), chunk).fetchall())
+    return rows
 
 
-def mark_attendance_notified(record_id: int):
-    """Отметить, что уведомление о приходе отправлено"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("INSERT OR IGNORE INTO attendance_notified (record_id) VALUES (?)", (record_id,))
-    conn.commit()
-    conn.close()
+class CycleState:
+    """Состояние записей на один цикл проверки.
+    
+    Читает tracked_records / sent_notifications / attendance_notified пачкой,
+    а все изменения копит и записывает одной транзакцией в commit().
+    """
+    
+    def __init__(self):
+        self.tracked = {}       # record_id -> TrackedRecord
+        self.sent = set()       # (record_id, notification_type)
+        self.attended = set()   # record_id
+        self._writes = []       # (sql, params) в порядке появления
+        self.stats = {"new": 0, "changed": 0, "skipped": 0, "cancelled": 0, "completed": 0}
+        self._loaded_ids = set()    # record_id, для которых уже загружены отметки
+        self._after_commit = []     # вызываются после успешной записи
+        self.enqueued = 0
+    
+    async def load(self, record_ids):
+        """Загрузить состояние для записей"""
+        record_ids = list(set(record_ids))
+        
+        def query(conn: sqlite3.Connection):
+            tracked = {}
+            missing = [rid for rid in record_ids if rid not in self.tracked]
+            for row in _select_in_chunks(
+                conn, f"SELECT {TRACKED_COLUMNS} FROM tracked_records WHERE record_id IN ({{}})", missing
+            ):
+                tracked[row[0]] = TrackedRecord(*row)
+            
+            ids = list((set(record_ids) | set(tracked)) - loaded_ids)
+            sent = _select_in_chunks(
+                conn, "SELECT record_id, notification_type FROM sent_notifications WHERE record_id IN ({})", ids
+            )
+            attended = _select_in_chunks(
+                conn, "SELECT record_id FROM attendance_notified WHERE record_id IN ({})", ids
+            )
+            return tracked, sent, attended
+        
+        loaded_ids = set(self._loaded_ids)
+        tracked, sent, attended = await storage.read(query)
+        self._loaded_ids.update(record_ids)
+        self._loaded_ids.update(tracked)
+        self.tracked.update(tracked)
+        self.sent.update(sent)
+        self.attended.update(r[0] for r in attended)
+    
+    def get_tracked(self, record_id: int):
+        return self.tracked.get(record_id)
+    
+    def is_unchanged(self, record_id: int, fingerprint: str) -> bool:
+        """Запись активна и её отпечаток не изменился с прошлого цикла"""
+        row = self.tracked.get(record_id)
+        return row is not None and row.status == "active" and row.fingerprint == fingerprint
+    
+    def save_tracked(self, record_id: int, client_phone: str, datetime_str: str,
+                     services: str, staff_name: str, status: str = "active",
+                     fingerprint: str = None):
+        row = TrackedRecord(record_id, client_phone, datetime_str, services, staff_name, status, fingerprint)
+        self.tracked[record_id] = row
+        self._writes.append((SAVE_TRACKED_RECORD_SQL, tuple(row)))
+    
+    def mark_cancelled(self, record_id: int):
+        row = self.tracked.get(record_id)
+        if row:
+            self.tracked[record_id] = row._replace(status="cancelled")
+        self.stats["cancelled"] += 1
+        self._writes.append((MARK_RECORD_CANCELLED_SQL, (record_id,)))
+    
+    def is_sent(self, record_id: int, notification_type: str) -> bool:
+        return (record_id, notification_type) in self.sent
+    
+    def enqueue(self, chat_ids, record_id: int, notification_type: str, text: str,
+                reply_markup: InlineKeyboardMarkup = None):
+        """Поставить сообщение в outbox всем чатам записи одной пачкой.
+        
+        chat_ids — один Telegram ID или несколько (все аккаунты клиента);
+        повтор той же тройки запись/тип/чат игнорируется (UNIQUE в outbox).
+        """
+        if isinstance(chat_ids, int):
+            chat_ids = (chat_ids,)
+        chat_ids = list(dict.fromkeys(chat_ids))
+        if not chat_ids:
+            return
+        markup_json = reply_markup.model_dump_json(exclude_none=True) if reply_markup else None
+        self._writes.append((ENQUEUE_OUTBOX_SQL, [
+            (chat_id, record_id, notification_type, text, markup_json) for chat_id in chat_ids
+        ]))
+        self.enqueued += len(chat_ids)
+    
+    def save_reminder(self, record_id: int, offset_hours: int, fire_at: float, payload: str):
+        self._writes.append((SAVE_REMINDER_SQL, (record_id, offset_hours, fire_at, payload)))
+    
+    def drop_reminder(self, record_id: int, offset_hours: int, fire_at: float):
+        self._writes.append((DROP_REMINDER_SQL, (record_id, offset_hours, fire_at)))
+    
+    def drop_reminders(self, record_id: int):
+        """Снять все напоминания записи, включая ещё не отправленные из очереди"""
+        self._writes.append((DROP_REMINDERS_SQL, (record_id,)))
+        self._writes.append((DROP_PENDING_REMINDERS_OUTBOX_SQL, (record_id,)))
+    
+    def reset_reminders_sent(self, record_id: int):
+        """Забыть отправленные напоминания (запись перенесена — напомнить заново)"""
+        self.sent = {key for key in self.sent if not (key[0] == record_id and key[1].startswith("reminder_"))}
+        self._writes.append((RESET_REMINDERS_SENT_SQL, (record_id,)))
+        self._writes.append((RESET_REMINDERS_OUTBOX_SQL, (record_id,)))
+    
+    def after_commit(self, callback):
+        """Выполнить callback() после того, как изменения записаны в базу"""
+        self._after_commit.append(callback)
+    
+    def is_attendance_notified(self, record_id: int) -> bool:
+        return record_id in self.attended
+    
+    def mark_attendance_notified(self, record_id: int):
+        self.attended.add(record_id)
+        self._writes.append((MARK_ATTENDANCE_NOTIFIED_SQL, (record_id,)))
+    
+    async def commit(self):
+        """Записать все накопленные изменения одной транзакцией"""
+        if not self._writes:
+            self._after_commit.clear()
+            return
+        writes, self._writes = self._writes, []
+        
+        def apply(conn: sqlite3.Connection):
+            for sql, params in writes:
+                # Список параметров — пачка строк (рассылка по всем чатам записи)
+                if isinstance(params, list):
+                    conn.executemany(sql, params)
+                else:
+                    conn.execute(sql, params)
+        
+        await storage.write(apply)
+        notify_db_changed()
+        
+        callbacks, self._after_commit = self._after_commit, []
+        for callback in callbacks:
+            callback()
+        
+        if self.enqueued:
+            self.enqueued = 0
+            outbox_dispatcher.wake()
 
 
-def normalize_phone(phone: str) -> str:
-    """Нормализация номера телефона"""
-    digits = ''.join(filter(str.isdigit, phone))
-    if len(digits) == 11 and digits.startswith('8'):
-        digits = '7' + digits[1:]
-    elif len(digits) == 10:
-        digits = '7' + digits
-    return '+' + digits
+# ==================== YCLIENTS API ====================
 
+class YClientsAPIError(Exception):
+    """Ошибочный ответ API YClients"""
+
+
+class YClientsRateLimitError(YClientsAPIError):
+    """YClients ответил 429 Too Many Requests"""
+    
+    def __init__(self, retry_after: float):
+        super().__init__(f"YClients API rate limit, Retry-After: {retry_after:.0f} сек")
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: str, default: float = 60) -> float:
+    """Retry-After: число секунд или HTTP-дата"""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(tz=timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return default
 
-# ==================== YCLIENTS API ====================
 
 class YClientsAPI:
     """Клиент для работы с API YClients"""
@@ -559,6 +898,45 @@ class YClientsAPI:
         self.user_token = user_token
         self.company_id = company_id
         self._session = None
+        self._retry_after_until = 0.0      # time.monotonic(), до которого запросы нежелательны
+        self.rate_limit_remaining = None   # из заголовков X-RateLimit-Remaining
+        self.decode_stats = self._empty_decode_stats()
+    
+    def _track_rate_limit(self, resp):
+        """Запомнить лимиты из заголовков ответа"""
+        remaining = resp.headers.get("X-RateLimit-Remaining")
+        if remaining is not None:
+            try:
+                self.rate_limit_remaining = int(remaining)
+            except ValueError:
+                pass
+        if resp.status == 429:
+            retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+            self._retry_after_until = time.monotonic() + retry_after
+            raise YClientsRateLimitError(retry_after)
+    
+    @staticmethod
+    def _empty_decode_stats() -> dict:
+        return {"pages": 0, "bytes": 0, "seconds": 0.0}
+    
+    def take_decode_stats(self) -> dict:
+        """Статистика разбора страниц записей с прошлого вызова (и сброс)"""
+        stats, self.decode_stats = self.decode_stats, self._empty_decode_stats()
+        return stats
+    
+    def _decode_records_page(self, body: bytes, known: dict = None) -> tuple:
+        """Разбор страницы записей с замером времени (память — в bench_decode.py)"""
+        started = time.perf_counter()
+        result = parse_records_page(body, known)
+        stats = self.decode_stats
+        stats["seconds"] += time.perf_counter() - started
+        stats["pages"] += 1
+        stats["bytes"] += len(body)
+        return result
+    
+    def retry_after(self) -> float:
+        """Сколько секунд ещё ждать после 429 (0 — можно)"""
+        return max(0.0, self._retry_after_until - time.monotonic())
     
     async def _get_session(self):
         """Получить или создать сессию"""
@@ -574,33 +952,144 @@ class YClientsAPI:
             "Content-Type": "application/json"
         }
     
-    async def get_records(self, date_from: str, date_to: str) -> list:
-        """Получение записей за период"""
+    async def _get_records_page(self, date_from: str, date_to: str, page: int, client_id: int = None,
+                                known: dict = None):
+        """Одна страница записей: (список Record, total_count из meta или None)"""
         url = f"{self.BASE_URL}/records/{self.company_id}"
         params = {
             "start_date": date_from,
             "end_date": date_to,
-            "count": 500
+            "page": page,
+            "count": RECORDS_PAGE_SIZE
         }
+        if client_id is not None:
+            params["client_id"] = client_id
+        
+        session = await self._get_session()
+        async with session.get(url, headers=self._headers(), params=params) as resp:
+            self._track_rate_limit(resp)
+            if resp.status != 200:
+                raise YClientsAPIError(f"YClients API error: {resp.status} (страница {page})")
+            body = await resp.read()
+        
+        # Разбираем один раз здесь — дальше бот работает только с Record
+        return self._decode_records_page(body, known)
+    
+    async def iter_record_pages(self, date_from: str, date_to: str, client_id: int = None, known: dict = None):
+        """Поток страниц записей за период.
+        
+        Первая страница сообщает total_count, остальные запрашиваются
+        параллельно (не более RECORDS_PAGE_CONCURRENCY) и отдаются по мере
+        готовности. Любая ошибка страницы прерывает поток исключением —
+        неполный результат нельзя принимать за полный. known — записи
+        прошлого опроса по id: неизменённые не разбираются заново.
+        
+        Страницы по смещению запрашиваются в разные моменты: если между ними
+        запись добавили или удалили, смещения сдвигаются и запись может
+        выпасть. Поэтому в конце проверяется, что total_count всех страниц
+        тот же, что у первой, и уникальных записей ровно столько же;
+        иначе — исключение после всех страниц.
+        """
+        records, total = await self._get_records_page(date_from, date_to, 1, client_id, known)
+        yield records
+        
+        if total is None:
+            # meta без total_count — читаем последовательно до неполной страницы
+            page = 1
+            while len(records) >= RECORDS_PAGE_SIZE:
+                page += 1
+                records, _ = await self._get_records_page(date_from, date_to, page, client_id, known)
+                yield records
+            return
+        
+        pages = -(-int(total) // RECORDS_PAGE_SIZE)
+        if pages <= 1:
+            return
+        
+        semaphore = asyncio.Semaphore(RECORDS_PAGE_CONCURRENCY)
         
+        async def fetch(page: int) -> tuple:
+            async with semaphore:
+                return await self._get_records_page(date_from, date_to, page, client_id, known)
+        
+        ids = {r.id for r in records}
+        totals = set()
+        tasks = [asyncio.create_task(fetch(page)) for page in range(2, pages + 1)]
         try:
-            session = await self._get_session()
-            async with session.get(url, headers=self._headers(), params=params) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    return data.get("data", [])
-                else:
-                    logger.error(f"YClients API error: {resp.status}")
-                    return []
+            for next_page in asyncio.as_completed(tasks):
+                page_records, page_total = await next_page
+                ids.update(r.id for r in page_records)
+                totals.add(page_total)
+                yield page_records
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        if totals != {total} or len(ids) != int(total):
+            raise YClientsAPIError(
+                f"Записи изменились во время чтения страниц: total_count {total} → {sorted(totals)}, "
+                f"получено {len(ids)} уникальных"
+            )
+    
+    async def get_records(self, date_from: str, date_to: str) -> list:
+        """Получение всех записей за период"""
+        records = []
+        try:
+            async for page in self.iter_record_pages(date_from, date_to):
+                records.extend(page)
+            return records
         except Exception as e:
             logger.error(f"YClients API exception: {e}")
             return []
     
-    async def get_upcoming_records(self) -> list:
-        """Получение записей на ближайшие 7 дней"""
+    @staticmethod
+    def upcoming_range() -> tuple:
+        """Период ближайших 7 дней: (сегодня, через неделю)"""
         today = datetime.now().strftime("%Y-%m-%d")
         week_later = (datetime.now() + timedelta(days=7)).strftime("%Y-%m-%d")
-        return await self.get_records(today, week_later)
+        return today, week_later
+    
+    async def get_upcoming_records(self) -> list:
+        """Получение записей на ближайшие 7 дней"""
+        return await self.get_records(*self.upcoming_range())
+    
+    async def get_record(self, record_id: int):
+        """Одна запись по ID (None — не найдена)"""
+        url = f"{self.BASE_URL}/record/{self.company_id}/{record_id}"
+        
+        session = await self._get_session()
+        async with session.get(url, headers=self._headers()) as resp:
+            self._track_rate_limit(resp)
+            if resp.status == 404:
+                return None
+            if resp.status != 200:
+                raise YClientsAPIError(f"YClients Record API error: {resp.status}")
+            data = loads(await resp.read())
+        
+        record = data.get("data")
+        return Record.from_api(record) if isinstance(record, dict) else None
+    
+    async def get_client_records(self, client_id: int) -> list:
+        """Записи одного клиента на ближайшие 7 дней (ошибки — исключением)"""
+        records = []
+        async for page in self.iter_record_pages(*self.upcoming_range(), client_id=client_id):
+            records.extend(page)
+        return records
+    
+    async def find_client_id(self, phone: str):
+        """ID клиента в YClients по телефону (None — не найден)"""
+        url = f"{self.BASE_URL}/clients/{self.company_id}"
+        params = {"phone": normalize_phone(phone).lstrip("+"), "count": 1}
+        
+        session = await self._get_session()
+        async with session.get(url, headers=self._headers(), params=params) as resp:
+            self._track_rate_limit(resp)
+            if resp.status != 200:
+                raise YClientsAPIError(f"YClients Clients API error: {resp.status}")
+            data = loads(await resp.read())
+        
+        clients = data.get("data") or []
+        return clients[0].get("id") if clients and isinstance(clients[0], dict) else None
     
     async def get_staff_list(self) -> list:
         """Получение списка мастеров"""
@@ -609,8 +1098,9 @@ class YClientsAPI:
         try:
             session = await self._get_session()
             async with session.get(url, headers=self._headers()) as resp:
+                self._track_rate_limit(resp)
                 if resp.status == 200:
-                    data = await resp.json()
+                    data = loads(await resp.read())
                     return data.get("data", [])
                 else:
                     logger.error(f"YClients Staff API error: {resp.status}")
@@ -628,7 +1118,7 @@ class YClientsAPI:
             async with aiohttp.ClientSession() as session:
                 async with session.get(url, headers=self._headers()) as resp:
                     if resp.status == 200:
-                        data = await resp.json()
+                        data = loads(await resp.read())
                         visit_data = data.get("data", {})
                         
                         # Ищем ссылку в данных визита
@@ -647,6 +1137,9 @@ bot = Bot(token=BOT_TOKEN)
 dp = Dispatcher()
 yclients = YClientsAPI(YCLIENTS_PARTNER_TOKEN, YCLIENTS_USER_TOKEN, YCLIENTS_COMPANY_ID)
 
+# Мастера: зарегистрированные в боте и список из YClients — в памяти
+staff_directory = StaffDirectory(storage, yclients, STAFF_LIST_CACHE_TTL)
+
 
 def get_contact_keyboard():
     """Клавиатура с кнопкой для отправки контакта"""
@@ -705,6 +1198,34 @@ async def cmd_my_records(message: Message):
     await show_my_records(message)
 
 
+@dp.message(Command("metrics"))
+async def cmd_metrics(message: Message):
+    """Команда /metrics: метрики последнего цикла проверки (только сотрудникам)"""
+    row = await storage.fetchone(
+        "SELECT 1 FROM staff WHERE telegram_id = ? AND is_active = 1", (message.from_user.id,)
+    )
+    if row is None:
+        await message.answer("❌ Команда доступна только сотрудникам.")
+        return
+
+    m = poll_metrics
+    if not m:
+        await message.answer("📊 Проверка записей ещё не выполнялась.")
+        return
+
+    await message.answer(
+        "📊 <b>Последняя проверка записей</b>\n\n"
+        f"🕐 {m.get('checked_at', '—')}\n"
+        f"Записей: {m.get('records', 0)} (новых {m.get('new', 0)}, изменённых {m.get('changed', 0)}, "
+        f"без изменений {m.get('skipped', 0)}, отменённых {m.get('cancelled', 0)}, "
+        f"прошедших {m.get('completed', 0)})\n"
+        f"Обновлены уровни: {', '.join(m.get('tiers_fetched', [])) or 'нет'}\n"
+        f"Разбор: {m.get('decode_pages', 0)} стр. ({m.get('decode_kb', 0)} КБ) за {m.get('decode_ms', 0)} мс\n"
+        f"Следующая проверка через {m.get('poll_interval', '—')} сек ({m.get('poll_interval_reason', '—')})",
+        parse_mode=ParseMode.HTML
+    )
+
+
 # Временное хранилище для регистрации сотрудников
 staff_registration = {}
 
@@ -735,7 +1256,7 @@ async def handle_staff_select(callback: CallbackQuery):
     staff_name = staff_names.get(staff_id, "Мастер")
     
     # Сохраняем сотрудника с YClients ID
-    save_staff(
+    await save_staff(
         telegram_id=user_id,
         staff_name=staff_name,
         yclients_staff_id=staff_id,
@@ -758,13 +1279,52 @@ async def handle_my_records_button(message: Message):
     await show_my_records(message)
 
 
+# Ответы «Мои записи» по phone_key (запросы одного клиента объединяются)
+my_records_cache = TTLCache(MY_RECORDS_CACHE_TTL)
+
+# Записи, показанные клиенту, — для кнопки «В календарь»
+records_cache = RecordCache(RECORD_CACHE_MAX_ITEMS, RECORD_CACHE_MAX_BYTES, RECORD_CACHE_TTL)
+
+
+def remember_record(record: Record):
+    """Запомнить запись для кнопки «В календарь»"""
+    if record.id is not None:
+        records_cache.put(record.id, record)
+
+
+async def resolve_yclients_client_id(telegram_id: int, phone: str, client_id):
+    """ID клиента в YClients: из таблицы clients, иначе поиск по телефону с сохранением"""
+    if client_id:
+        return client_id
+    client_id = await yclients.find_client_id(phone)
+    if client_id:
+        await storage.execute(
+            "UPDATE clients SET yclients_client_id = ? WHERE telegram_id = ?", (client_id, telegram_id)
+        )
+        client_registry.set_yclients_id(telegram_id, client_id)
+        logger.info(f"Клиент {telegram_id}: ID в YClients {client_id}")
+    return client_id
+
+
+async def fetch_my_records_live(telegram_id: int, phone: str, client_id) -> list:
+    """Записи клиента напрямую из YClients (когда снимок опроса устарел)"""
+    try:
+        client_id = await resolve_yclients_client_id(telegram_id, phone, client_id)
+    except Exception as e:
+        logger.error(f"Не удалось найти клиента {telegram_id} в YClients: {e}")
+        client_id = None
+    if client_id:
+        return await yclients.get_client_records(client_id)
+    
+    # Клиента не нашли по телефону — ищем по всем записям салона
+    my_phone_key = phone_key(phone)
+    records = await yclients.get_upcoming_records()
+    return [r for r in records if r.phone_key == my_phone_key]
+
+
 async def show_my_records(message: Message):
     """Показать записи клиента"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT phone_number FROM clients WHERE telegram_id = ?", (message.from_user.id,))
-    result = cursor.fetchone()
-    conn.close()
+    result = client_registry.get(message.from_user.id)
     
     if not result:
         await message.answer(
@@ -773,33 +1333,19 @@ async def show_my_records(message: Message):
         )
         return
     
-    phone = result[0]
-    phone_clean = phone[-10:]
-    
-    try:
-        records = await yclients.get_upcoming_records()
-    except Exception as e:
-        logger.error(f"Ошибка получения записей: {e}")
-        await message.answer("😔 Не удалось загрузить записи. Попробуйте позже.", reply_markup=get_main_keyboard())
-        return
+    phone, my_phone_key, client_id = result
     
-    if not records:
-        await message.answer(
-            "📅 У вас нет предстоящих записей.",
-            reply_markup=get_main_keyboard()
-        )
-        await message.answer("Хотите записаться?", reply_markup=get_booking_keyboard())
-        return
-    
-    my_records = []
-    for r in records:
-        if not r or not isinstance(r, dict):
-            continue
-        client = r.get("client")
-        if client and isinstance(client, dict):
-            client_phone = client.get("phone", "")
-            if client_phone and client_phone[-10:] == phone_clean:
-                my_records.append(r)
+    # Свежий снимок опроса отвечает без обращения к YClients
+    my_records = records_poller.records_for_phone(my_phone_key)
+    if my_records is None:
+        try:
+            my_records = await my_records_cache.get_or_load(
+                my_phone_key, lambda: fetch_my_records_live(message.from_user.id, phone, client_id)
+            )
+        except Exception as e:
+            logger.error(f"Ошибка получения записей: {e}")
+            await message.answer("😔 Не удалось загрузить записи. Попробуйте позже.", reply_markup=get_main_keyboard())
+            return
     
     if not my_records:
         await message.answer(
@@ -813,26 +1359,14 @@ async def show_my_records(message: Message):
     await message.answer(f"📅 <b>Ваши записи ({len(my_records)}):</b>", parse_mode=ParseMode.HTML, reply_markup=get_main_keyboard())
     
     for record in my_records:
-        datetime_str = record.get("datetime", "")
-        formatted_date = format_record_datetime(datetime_str)
-        
-        services_list = record.get("services") or []
-        services = ", ".join([s.get("title", "") for s in services_list if isinstance(s, dict)])
-        
-        staff = record.get("staff") or {}
-        staff_name = staff.get("name", "") if isinstance(staff, dict) else ""
-        staff_position = staff.get("specialization", "") if isinstance(staff, dict) else ""
-        if not staff_position:
-            staff_position = staff.get("position", {}).get("title", "") if isinstance(staff.get("position"), dict) else ""
-        
-        staff_info = f"{staff_name}, {staff_position}" if staff_position else staff_name
-        
+        remember_record(record)
+        formatted_date = format_record_datetime(record.start or record.datetime_str)
         record_link = get_record_link(record)
         
         text = (
             f"🗓 <b>{formatted_date}</b>\n"
-            f"✂️ {services}\n"
-            f"👤 {staff_info}\n\n"
+            f"✂️ {record.services_title}\n"
+            f"👤 {record.staff.label}\n\n"
             f"<a href='{record_link}'>Изменить или отменить</a>"
         )
         
@@ -856,7 +1390,7 @@ async def handle_contact(message: Message):
     if not phone.startswith("+"):
         phone = "+" + phone
     
-    if save_client(message.from_user.id, phone, contact.first_name, contact.last_name, message.from_user.username):
+    if await save_client(message.from_user.id, phone, contact.first_name, contact.last_name, message.from_user.username):
         await message.answer(
             f"✅ Отлично, {contact.first_name or 'друг'}!\n\n"
             f"Номер <code>{phone}</code> сохранён.\n\n"
@@ -901,10 +1435,21 @@ async def handle_contact_button(message: Message):
 @dp.callback_query(F.data.startswith("calendar_"))
 async def handle_calendar_callback(callback: CallbackQuery):
     """Обработчик кнопки Добавить в календарь"""
-    record_id = callback.data.replace("calendar_", "")
+    try:
+        record_id = int(callback.data.replace("calendar_", ""))
+    except ValueError:
+        await callback.answer()
+        return
     
-    # Получаем запись из кэша
+    # Запись из кэша, иначе (перезапуск, вытеснение) — одна запись из YClients
     record = records_cache.get(record_id)
+    if record is None:
+        try:
+            record = await yclients.get_record(record_id)
+        except Exception as e:
+            logger.error(f"Не удалось получить запись #{record_id}: {e}")
+        if record:
+            remember_record(record)
     
     if not record:
         await callback.answer("⚠️ Запись не найдена. Попробуйте снова через 'Мои записи'.", show_alert=True)
@@ -914,8 +1459,7 @@ async def handle_calendar_callback(callback: CallbackQuery):
     ics_content = generate_ics_file(record)
     
     # Получаем информацию для имени файла
-    services_list = record.get("services") or []
-    service_name = services_list[0].get("title", "Запись") if services_list else "Запись"
+    service_name = record.services[0].title if record.services else "Запись"
     
     # Отправляем файл
     ics_file = BufferedInputFile(
@@ -943,8 +1487,12 @@ async def handle_text(message: Message):
         
         if reg_data.get("step") == "code":
             if message.text == STAFF_SECRET_CODE:
-                # Получаем список мастеров из YClients
-                staff_list = await yclients.get_staff_list()
+                # Список мастеров YClients (из кэша, обновляется в фоне)
+                try:
+                    staff_list = await staff_directory.yclients_staff()
+                except Exception as e:
+                    logger.error(f"Не удалось загрузить список мастеров: {e}")
+                    staff_list = ()
                 
                 if not staff_list:
                     await message.answer("❌ Не удалось загрузить список мастеров. Попробуйте позже.")
@@ -952,16 +1500,16 @@ async def handle_text(message: Message):
                     return
                 
                 # Получаем уже зарегистрированных
-                registered_ids = get_registered_yclients_staff_ids()
+                registered_ids = await get_registered_yclients_staff_ids()
                 
                 # Создаём кнопки для выбора мастера (исключаем зарегистрированных)
                 buttons = []
                 staff_names = {}
                 for staff in staff_list:
-                    staff_id = staff.get("id")
+                    staff_id = staff.id
                     if staff_id in registered_ids:
                         continue  # Пропускаем уже зарегистрированных
-                    staff_name = staff.get("name", "Без имени")
+                    staff_name = staff.name or "Без имени"
                     staff_names[staff_id] = staff_name
                     buttons.append([InlineKeyboardButton(
                         text=f"👤 {staff_name}",
@@ -988,13 +1536,7 @@ async def handle_text(message: Message):
             return
     
     # Обычная обработка текста
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT 1 FROM clients WHERE telegram_id = ?", (message.from_user.id,))
-    result = cursor.fetchone()
-    conn.close()
-    
-    if result:
+    if message.from_user.id in client_registry:
         await message.answer("Выберите действие:", reply_markup=get_main_keyboard())
     else:
         await message.answer("Поделитесь номером телефона:", reply_markup=get_contact_keyboard())
@@ -1002,27 +1544,15 @@ async def handle_text(message: Message):
 
 # ==================== УВЕДОМЛЕНИЯ ====================
 
-def get_record_link(record: dict) -> str:
+def get_record_link(record: Record) -> str:
     """Получить ссылку на изменение записи"""
-    # Проверяем все возможные поля со ссылкой
-    for field in ['visit_url', 'client_link', 'short_link', 'record_link', 'link', 'links']:
-        if record.get(field):
-            link = record.get(field)
-            if isinstance(link, str) and link.startswith('http'):
-                return link
-            elif isinstance(link, dict) and link.get('client'):
-                return link.get('client')
-    
-    # Проверяем вложенные объекты
-    if record.get("visit") and isinstance(record.get("visit"), dict):
-        visit = record.get("visit")
-        for field in ['url', 'link', 'short_link']:
-            if visit.get(field):
-                return visit.get(field)
+    # Ссылка из ответа YClients (найдена при разборе записи)
+    if record.link:
+        return record.link
     
     # Формируем ссылку через ID записи
-    record_id = record.get("id")
-    visit_id = record.get("visit_id")
+    record_id = record.id
+    visit_id = record.visit_id
     
     # Формат для мобильной версии YClients
     if visit_id:
@@ -1033,32 +1563,15 @@ def get_record_link(record: dict) -> str:
     return YCLIENTS_BOOKING_URL
 
 
-def get_google_calendar_url(record: dict) -> str:
+def get_google_calendar_url(record: Record) -> str:
     """Генерация ссылки на Google Calendar"""
-    datetime_str = record.get("datetime", "")
-    services_list = record.get("services") or []
-    services = ", ".join([s.get("title", "") for s in services_list if isinstance(s, dict)])
+    services = record.services_title
+    staff_name = record.staff.name
     
-    staff = record.get("staff") or {}
-    staff_name = staff.get("name", "") if isinstance(staff, dict) else ""
-    
-    # Парсим дату
-    try:
-        if "T" in datetime_str:
-            dt_start = datetime.fromisoformat(datetime_str.replace("Z", "+00:00")).replace(tzinfo=None)
-        else:
-            dt_start = datetime.strptime(datetime_str, "%Y-%m-%d %H:%M:%S")
-    except:
-        dt_start = datetime.now() + timedelta(days=1)
+    dt_start = record.start or datetime.now() + timedelta(days=1)
     
     # Длительность услуги
-    duration_minutes = 60
-    for s in services_list:
-        if isinstance(s, dict) and s.get("length"):
-            duration_minutes = s.get("length", 60)
-            break
-    
-    dt_end = dt_start + timedelta(minutes=duration_minutes)
+    dt_end = dt_start + timedelta(minutes=record.duration_minutes)
     
     # Формат для Google Calendar: 20260205T133000
     dt_format = "%Y%m%dT%H%M%S"
@@ -1074,30 +1587,23 @@ def get_google_calendar_url(record: dict) -> str:
     return f"https://calendar.google.com/calendar/render?action=TEMPLATE&text={title}&dates={dates}&details={details}&location={location}"
 
 
-def get_single_record_keyboard(record: dict):
+def get_single_record_keyboard(record: Record):
     """Кнопки для конкретной записи с персональной ссылкой"""
     record_link = get_record_link(record)
     
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="✏️ Изменить / Отменить", url=record_link)],
+        [InlineKeyboardButton(text="📅 В календарь", callback_data=f"calendar_{record.id}")],
         [InlineKeyboardButton(text="📍 Как добраться", url=f"https://yandex.ru/maps/?text={BARBERSHOP_ADDRESS.replace(' ', '+')}")]
     ])
 
 
-async def send_new_record_notification(telegram_id: int, record: dict):
-    """Уведомление о новой записи"""
-    datetime_str = record.get("datetime", "")
-    formatted_date = format_record_datetime(datetime_str)
+def queue_new_record_notification(state: "CycleState", telegram_ids: list, record: Record):
+    """Уведомление о новой записи (в очередь отправки)"""
+    formatted_date = format_record_datetime(record.start or record.datetime_str)
     
     # Получаем имя клиента
-    client = record.get("client") or {}
-    client_name = client.get("name", "").split()[0] if isinstance(client, dict) and client.get("name") else ""
-    
-    services_list = record.get("services") or []
-    services = ", ".join([s.get("title", "") for s in services_list if isinstance(s, dict)])
-    
-    staff = record.get("staff") or {}
-    staff_name = staff.get("name", "") if isinstance(staff, dict) else ""
+    client_name = record.client_name.split()[0] if record.client_name.strip() else ""
     
     record_link = get_record_link(record)
     
@@ -1106,43 +1612,21 @@ async def send_new_record_notification(telegram_id: int, record: dict):
     
     text = (
         f"{greeting} записаны в 💈 <b>{BARBERSHOP_NAME.upper()}</b> на услугу\n\n"
-        f"◾ {services}\n"
-        f"к мастеру {staff_name}\n\n"
+        f"◾ {record.services_title}\n"
+        f"к мастеру {record.staff.name}\n\n"
         f"👉 на <b>{formatted_date}</b>\n\n"
         f"С нетерпением ждём вашего визита!\n\n"
         f"<a href='{record_link}'>изменение записи</a>"
     )
     
-    try:
-        await bot.send_message(
-            telegram_id, 
-            text, 
-            parse_mode=ParseMode.HTML,
-            reply_markup=get_single_record_keyboard(record),
-            disable_web_page_preview=False
-        )
-        logger.info(f"Уведомление о записи отправлено: {telegram_id}")
-        return True
-    except Exception as e:
-        logger.error(f"Ошибка отправки: {e}")
-        return False
+    remember_record(record)
+    state.enqueue(telegram_ids, record.id, "new", text, get_single_record_keyboard(record))
 
 
-async def send_record_changed_notification(telegram_id: int, record: dict, old_datetime: str):
-    """Уведомление об изменении записи"""
-    datetime_str = record.get("datetime", "")
-    formatted_date = format_record_datetime(datetime_str)
-    
-    services_list = record.get("services") or []
-    services = ", ".join([s.get("title", "") for s in services_list if isinstance(s, dict)])
-    
-    staff = record.get("staff") or {}
-    staff_name = staff.get("name", "") if isinstance(staff, dict) else ""
-    staff_position = staff.get("specialization", "") if isinstance(staff, dict) else ""
-    if not staff_position:
-        staff_position = staff.get("position", {}).get("title", "") if isinstance(staff.get("position"), dict) else ""
-    
-    staff_info = f"{staff_name}, {staff_position}" if staff_position else staff_name
+def queue_record_changed_notification(state: "CycleState", telegram_ids: list, record: Record,
+                                     notification_type: str):
+    """Уведомление об изменении записи (в очередь отправки)"""
+    formatted_date = format_record_datetime(record.start or record.datetime_str)
     
     record_link = get_record_link(record)
     
@@ -1150,23 +1634,18 @@ async def send_record_changed_notification(telegram_id: int, record: dict, old_d
         f"Ваша запись перенесена 📅\n\n"
         f"Новое время:\n"
         f"👉 <b>{formatted_date}</b>\n\n"
-        f"◾ {services}\n"
-        f"к мастеру {staff_info}\n\n"
+        f"◾ {record.services_title}\n"
+        f"к мастеру {record.staff.label}\n\n"
         f"Ждём вас в 💈 <b>{BARBERSHOP_NAME.upper()}</b>!"
     )
     
-    try:
-        await bot.send_message(telegram_id, text, parse_mode=ParseMode.HTML, reply_markup=get_single_record_keyboard(record))
-        logger.info(f"Уведомление об изменении отправлено: {telegram_id}")
-        return True
-    except Exception as e:
-        logger.error(f"Ошибка отправки: {e}")
-        return False
+    remember_record(record)
+    state.enqueue(telegram_ids, record.id, notification_type, text, get_single_record_keyboard(record))
 
 
-async def send_record_cancelled_notification(telegram_id: int, old_record: dict):
-    """Уведомление об отмене записи"""
-    datetime_str = old_record.get("datetime", "")
+def queue_record_cancelled_notification(state: "CycleState", telegram_ids: list, record_id: int,
+                                       datetime_str: str):
+    """Уведомление об отмене записи (в очередь отправки)"""
     formatted_date = format_record_datetime(datetime_str) if datetime_str else ""
     
     date_text = f" на {formatted_date}" if formatted_date else ""
@@ -1177,202 +1656,1035 @@ async def send_record_cancelled_notification(telegram_id: int, old_record: dict)
         f"Хотите записаться?"
     )
     
-    try:
-        await bot.send_message(telegram_id, text, parse_mode=ParseMode.HTML, reply_markup=get_booking_keyboard())
-        logger.info(f"Уведомление об отмене отправлено: {telegram_id}")
-        return True
-    except Exception as e:
-        logger.error(f"Ошибка отправки: {e}")
-        return False
+    state.enqueue(telegram_ids, record_id, "cancelled", text, get_booking_keyboard())
 
 
-async def send_reminder_24h(telegram_id: int, record: dict):
-    """Напоминание за 24 часа"""
-    datetime_str = record.get("datetime", "")
-    formatted_date = format_record_datetime(datetime_str)
-    
-    # Получаем только время для короткого напоминания
-    time_only = ""
-    try:
-        if "T" in datetime_str:
-            dt = datetime.fromisoformat(datetime_str.replace("Z", "+00:00")).replace(tzinfo=None)
-        else:
-            dt = datetime.strptime(datetime_str, "%Y-%m-%d %H:%M:%S")
-        time_only = dt.strftime("%H:%M")
-    except:
-        pass
-    
-    services_list = record.get("services") or []
-    services = ", ".join([s.get("title", "") for s in services_list if isinstance(s, dict)])
-    
-    staff = record.get("staff") or {}
-    staff_name = staff.get("name", "") if isinstance(staff, dict) else ""
+def queue_reminder(state: "CycleState", telegram_ids: list, record: Record, hours: int):
+    """Напоминание за hours часов до визита (в очередь отправки)"""
+    # Короткое «сегодня в 13:30» / «завтра в 13:30» / «05.02 в 13:30»
+    when = ""
+    if record.start:
+        # «Сегодня» — по часовому поясу записи, а не сервера
+        today = datetime.fromtimestamp(time.time() + record.utc_offset, timezone.utc).date()
+        days = (record.start.date() - today).days
+        day = {0: "сегодня", 1: "завтра"}.get(days, record.start.strftime("%d.%m"))
+        when = f"{day} в {record.start.strftime('%H:%M')}"
     
     record_link = get_record_link(record)
     
     text = (
-        f"Мы Вас ждём 🤗 завтра в {time_only}\n\n"
-        f"◾ {services}\n"
-        f"к мастеру {staff_name}\n\n"
+        f"Мы Вас ждём 🤗 {when}\n\n"
+        f"◾ {record.services_title}\n"
+        f"к мастеру {record.staff.name}\n\n"
         f"📍 {BARBERSHOP_ADDRESS}\n\n"
         f"До встречи в 💈 <b>{BARBERSHOP_NAME.upper()}</b>!"
     )
     
-    try:
-        await bot.send_message(telegram_id, text, parse_mode=ParseMode.HTML, reply_markup=get_single_record_keyboard(record))
-        logger.info(f"Напоминание 24ч отправлено: {telegram_id}")
+    remember_record(record)
+    state.enqueue(telegram_ids, record.id, f"reminder_{hours}h", text, get_single_record_keyboard(record))
+
+
+# ==================== ОЧЕРЕДЬ ОТПРАВКИ ====================
+
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, запас не больше capacity"""
+    
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    async def acquire(self):
+        """Дождаться и забрать один токен"""
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+    
+    def is_idle(self) -> bool:
+        """Запас полон — ограничитель можно выбросить без потери состояния"""
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+OutboxMessage = namedtuple(
+    "OutboxMessage", "id chat_id record_id notification_type text reply_markup attempts"
+)
+
+
+class OutboxDispatcher:
+    """Отправка сообщений из outbox с лимитами Telegram.
+    
+    Глобальный и поканальный token bucket, пауза на RetryAfter, повторы
+    с экспоненциальной задержкой. sent_notifications отмечается только
+    после подтверждённой доставки — в той же транзакции, что и outbox.
+    
+    Каждый чат с сообщениями обслуживает своя задача: внутри чата сообщения
+    уходят строго по порядку, а очередь одного чата (30 отметок о приходе
+    мастеру при 1 сообщении/с) не задерживает остальные. Пока задача чата
+    работает, его сообщения из outbox не выбираются. Одновременных отправок —
+    не больше NOTIFY_CONCURRENCY.
+    """
+    
+    def __init__(self, tg_bot: Bot):
+        self.bot = tg_bot
+        self.global_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE)
+        self.chat_buckets = {}
+        self._paused_until = 0.0
+        self._wake = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(NOTIFY_CONCURRENCY)
+        self._chat_tasks = {}   # chat_id -> задача, отправляющая сообщения чата
+    
+    def wake(self):
+        """Сообщить, что в очереди появились сообщения"""
+        self._wake.set()
+    
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10000:
+                self.chat_buckets = {cid: b for cid, b in self.chat_buckets.items() if not b.is_idle()}
+            bucket = self.chat_buckets[chat_id] = TokenBucket(TELEGRAM_CHAT_RATE, 1)
+        return bucket
+    
+    def _busy_chats(self) -> str:
+        """Чаты, которые уже обслуживаются, — JSON-массив для json_each()"""
+        return json.dumps(list(self._chat_tasks))
+    
+    async def _fetch_due(self) -> list:
+        # Сообщение не берём, пока в том же чате ждёт повтора более раннее
+        now = time.time()
+        rows = await storage.fetchall("""
+            SELECT id, chat_id, record_id, notification_type, text, reply_markup, attempts
+            FROM outbox
+            WHERE status = 'pending' AND next_attempt_at <= ?
+              AND chat_id NOT IN (SELECT value FROM json_each(?))
+              AND NOT EXISTS (
+                  SELECT 1 FROM outbox AS earlier
+                  WHERE earlier.chat_id = outbox.chat_id
+                    AND earlier.status = 'pending'
+                    AND earlier.id < outbox.id
+                    AND earlier.next_attempt_at > ?
+              )
+            ORDER BY id
+            LIMIT ?
+        """, (now, self._busy_chats(), now, OUTBOX_BATCH_SIZE))
+        return [OutboxMessage(*row) for row in rows]
+    
+    async def _seconds_until_next(self) -> float:
+        row = await storage.fetchone(
+            "SELECT MIN(next_attempt_at) FROM outbox "
+            "WHERE status = 'pending' AND chat_id NOT IN (SELECT value FROM json_each(?))",
+            (self._busy_chats(),)
+        )
+        if not row or row[0] is None:
+            return 60.0
+        return min(60.0, max(0.0, row[0] - time.time()))
+    
+    async def run(self):
+        """Основной цикл: раздаёт сообщения задачам чатов, сам не ждёт отправки"""
+        try:
+            while True:
+                try:
+                    self._wake.clear()
+                    batch = await self._fetch_due()
+                    if not batch:
+                        timeout = await self._seconds_until_next()
+                        try:
+                            await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+                        except asyncio.TimeoutError:
+                            pass
+                        continue
+                    
+                    by_chat = {}
+                    for message in batch:
+                        by_chat.setdefault(message.chat_id, []).append(message)
+                    for chat_id, messages in by_chat.items():
+                        self._chat_tasks[chat_id] = asyncio.create_task(self._deliver_chat(chat_id, messages))
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Ошибка очереди отправки: {e}")
+                    await asyncio.sleep(5)
+        finally:
+            for task in self._chat_tasks.values():
+                task.cancel()
+    
+    async def _deliver_chat(self, chat_id: int, messages: list):
+        """Отправить сообщения одного чата по порядку; на первой неудаче остановиться"""
+        try:
+            for message in messages:
+                if not await self._deliver(message):
+                    return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка отправки в чат {chat_id}: {e}")
+        finally:
+            # Следующие сообщения чата (и повтор неудачного) выберет основной цикл
+            self._chat_tasks.pop(chat_id, None)
+            self._wake.set()
+    
+    async def _deliver(self, message: OutboxMessage) -> bool:
+        """Отправить одно сообщение и записать результат"""
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        await self._chat_bucket(message.chat_id).acquire()
+        
+        reply_markup = (
+            InlineKeyboardMarkup.model_validate_json(message.reply_markup) if message.reply_markup else None
+        )
+        try:
+            # Ожидание лимита чата — вне семафора: медленный чат не занимает место
+            async with self._semaphore:
+                await self.global_bucket.acquire()
+                await self.bot.send_message(
+                    message.chat_id,
+                    message.text,
+                    parse_mode=ParseMode.HTML,
+                    reply_markup=reply_markup
+                )
+        except TelegramRetryAfter as e:
+            # Флуд-контроль Telegram: ждём сколько сказано, попытку не считаем
+            logger.warning(f"Telegram RetryAfter {e.retry_after} сек (чат {message.chat_id})")
+            self._paused_until = time.monotonic() + e.retry_after
+            await self._reschedule(message, e.retry_after, str(e), count_attempt=False)
+            return False
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # Бот заблокирован / чат не найден — повтор не поможет
+            logger.error(f"Сообщение #{message.id} не доставлено в {message.chat_id}: {e}")
+            await self._fail(message, str(e))
+            # Следующие сообщения в этот чат тоже не дойдут, но пусть решит Telegram
+            return True
+        except Exception as e:
+            attempts = message.attempts + 1
+            if attempts >= OUTBOX_MAX_ATTEMPTS:
+                logger.error(f"Сообщение #{message.id} не доставлено после {attempts} попыток: {e}")
+                await self._fail(message, str(e))
+            else:
+                delay = min(OUTBOX_RETRY_BASE * 2 ** message.attempts, OUTBOX_RETRY_MAX)
+                logger.warning(f"Ошибка отправки #{message.id}, повтор через {delay} сек: {e}")
+                await self._reschedule(message, delay, str(e))
+            return False
+        
+        await self._mark_delivered(message)
+        logger.info(f"Отправлено {message.notification_type} → {message.chat_id}")
         return True
-    except Exception as e:
-        logger.error(f"Ошибка отправки: {e}")
-        return False
+    
+    async def _mark_delivered(self, message: OutboxMessage):
+        def apply(conn: sqlite3.Connection):
+            conn.execute(
+                "UPDATE outbox SET status = 'sent', sent_at = CURRENT_TIMESTAMP, attempts = attempts + 1, last_error = NULL "
+                "WHERE id = ?",
+                (message.id,)
+            )
+            if message.record_id is not None:
+                conn.execute(MARK_NOTIFICATION_SENT_SQL, (message.record_id, message.notification_type))
+        
+        await storage.write(apply)
+        # Иначе снимок в S3 оставит сообщение pending, и после восстановления оно уйдёт повторно
+        notify_db_changed()
+    
+    async def _reschedule(self, message: OutboxMessage, delay: float, error: str, count_attempt: bool = True):
+        await storage.execute(
+            "UPDATE outbox SET attempts = attempts + ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+            (1 if count_attempt else 0, time.time() + delay, error, message.id)
+        )
+        notify_db_changed()
+    
+    async def _fail(self, message: OutboxMessage, error: str):
+        await storage.execute(
+            "UPDATE outbox SET status = 'failed', attempts = attempts + 1, last_error = ? WHERE id = ?",
+            (error, message.id)
+        )
+        notify_db_changed()
+
+
+outbox_dispatcher = OutboxDispatcher(bot)
+
+
+# ==================== НАПОМИНАНИЯ ====================
+
+class ReminderScheduler:
+    """Напоминания по точному времени: куча (fire_at, record_id, offset_hours).
+    
+    Сроки хранятся в scheduled_reminders, при старте куча восстанавливается
+    из базы. Перенос записи заменяет сроки, отмена — снимает их; устаревшие
+    элементы кучи отбрасываются при извлечении (сверка с self.entries).
+    """
+    
+    def __init__(self, offsets: list):
+        self.offsets = sorted(set(offsets), reverse=True)
+        self.heap = []
+        self.entries = {}   # (record_id, offset_hours) -> fire_at
+        self._wake = asyncio.Event()
+    
+    async def load(self):
+        """Восстановить кучу из базы"""
+        rows = await storage.fetchall("SELECT record_id, offset_hours, fire_at FROM scheduled_reminders")
+        self.entries = {(record_id, offset): fire_at for record_id, offset, fire_at in rows}
+        self.heap = [(fire_at, record_id, offset) for (record_id, offset), fire_at in self.entries.items()]
+        heapq.heapify(self.heap)
+        logger.info(f"Запланировано напоминаний: {len(self.heap)}")
+    
+    def _push(self, record_id: int, offset_hours: int, fire_at: float):
+        self.entries[(record_id, offset_hours)] = fire_at
+        heapq.heappush(self.heap, (fire_at, record_id, offset_hours))
+        if self.heap[0][0] == fire_at:
+            self._wake.set()
+    
+    def _forget(self, record_id: int):
+        for offset in self.offsets:
+            self.entries.pop((record_id, offset), None)
+    
+    def plan(self, state: CycleState, record: Record, previous_datetime: str = None):
+        """Запланировать напоминания для новой или изменённой записи"""
+        record_id = record.id
+        starts_at = record.starts_at
+        if starts_at is None:
+            return
+        
+        # Перенос — сдвиг начала (а значит, и сроков напоминаний) не меньше
+        # MIN_RESCHEDULE_MINUTES; смена формата даты или сдвиг на минуты не сбрасывают
+        # отметки, иначе уже доставленное напоминание ушло бы повторно
+        previous = parse_datetime(previous_datetime) if previous_datetime else None
+        rescheduled = (
+            previous is not None
+            and abs(starts_at - previous.timestamp()) >= MIN_RESCHEDULE_MINUTES * 60
+        )
+        if rescheduled:
+            state.drop_reminders(record_id)
+            state.reset_reminders_sent(record_id)
+            state.after_commit(lambda: self._forget(record_id))
+        
+        payload = json.dumps(record.to_dict(), ensure_ascii=False, default=str)
+        earliest = time.time() - REMINDER_GRACE_MINUTES * 60
+        for hours in self.offsets:
+            fire_at = starts_at - hours * 3600
+            if fire_at < earliest:
+                continue
+            if not rescheduled and state.is_sent(record_id, f"reminder_{hours}h"):
+                continue
+            state.save_reminder(record_id, hours, fire_at, payload)
+            state.after_commit(lambda h=hours, t=fire_at: self._push(record_id, h, t))
+    
+    def cancel(self, state: CycleState, record_id: int):
+        """Снять напоминания отменённой записи"""
+        state.drop_reminders(record_id)
+        state.after_commit(lambda: self._forget(record_id))
+    
+    def _pop_due(self, now: float) -> list:
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            fire_at, record_id, offset = heapq.heappop(self.heap)
+            if self.entries.get((record_id, offset)) == fire_at:
+                del self.entries[(record_id, offset)]
+                due.append((record_id, offset, fire_at))
+        return due
+    
+    async def run(self):
+        """Ждать ближайший срок и ставить напоминания в очередь отправки"""
+        while True:
+            try:
+                self._wake.clear()
+                due = self._pop_due(time.time())
+                if due:
+                    await self._fire(due)
+                    continue
+                
+                timeout = min(60.0, self.heap[0][0] - time.time()) if self.heap else 60.0
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=max(0.0, timeout))
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка планировщика напоминаний: {e}")
+                await asyncio.sleep(5)
+    
+    async def _fire(self, due: list):
+        try:
+            # Под общей блокировкой: опрос и вебхуки не перепланируют запись посреди отправки
+            async with records_lock:
+                await self._fire_locked(due)
+        except Exception:
+            # Ничего не записано (одна транзакция) — сроки возвращаются в кучу, повтор из run()
+            self._restore(due)
+            raise
+    
+    def _restore(self, due: list):
+        """Вернуть извлечённые сроки, если запись тем временем не перепланировали"""
+        for record_id, offset, fire_at in due:
+            if (record_id, offset) not in self.entries:
+                self._push(record_id, offset, fire_at)
+    
+    async def _fire_locked(self, due: list):
+        record_ids = list({record_id for record_id, _, _ in due})
+        scheduled = {
+            (record_id, offset): (fire_at, payload)
+            for record_id, offset, fire_at, payload in await storage.read(
+                _select_in_chunks,
+                "SELECT record_id, offset_hours, fire_at, payload FROM scheduled_reminders WHERE record_id IN ({})",
+                record_ids
+            )
+        }
+        # Запись перенесли или отменили, пока срок ждал блокировки: новый срок уже в куче
+        current = [(record_id, offset, fire_at) for record_id, offset, fire_at in due
+                   if scheduled.get((record_id, offset), (None,))[0] == fire_at]
+        skipped = len(due) - len(current)
+        if skipped:
+            logger.info(f"Напоминаний перенесено или снято во время отправки: {skipped}")
+        due = current
+        payloads = {key: payload for key, (_, payload) in scheduled.items()}
+        
+        state = CycleState()
+        await state.load(record_ids)
+        records = {key: Record.from_api(json.loads(payload)) for key, payload in payloads.items()}
+        phones = [record.client_phone for record in records.values() if record.client_phone]
+        telegram_ids = await get_telegram_ids_by_phones(phones)
+        
+        late_after = REMINDER_GRACE_MINUTES * 60
+        now = time.time()
+        for record_id, offset, fire_at in due:
+            record = records.get((record_id, offset))
+            state.drop_reminder(record_id, offset, fire_at)
+            tracked = state.get_tracked(record_id)
+            if record is None or (tracked and tracked.status != "active"):
+                continue
+            if now - fire_at > late_after:
+                logger.info(f"Напоминание за {offset} ч для записи #{record_id} опоздало — пропущено")
+                continue
+            
+            chat_ids = telegram_ids.get(record.phone_key) if record.phone_key else None
+            if chat_ids and not state.is_sent(record_id, f"reminder_{offset}h"):
+                queue_reminder(state, chat_ids, record, offset)
+                logger.info(f"Напоминание за {offset} ч для записи #{record_id} поставлено в очередь")
+        
+        await state.commit()
+
+
+reminder_scheduler = ReminderScheduler(REMINDER_HOURS)
 
 
 # ==================== ОТСЛЕЖИВАНИЕ ЗАПИСЕЙ ====================
 
+# Метрики последнего цикла проверки (команда /metrics)
+poll_metrics = {}
+
+# Цикл проверки и события вебхуков меняют состояние записей по очереди
+records_lock = asyncio.Lock()
+
+
+class PollTier:
+    """Диапазон дней со своим интервалом опроса и последним снимком записей"""
+    
+    def __init__(self, name: str, first_day: int, last_day: int, interval: float):
+        self.name = name
+        self.first_day = first_day
+        self.last_day = last_day
+        self.interval = interval
+        self.records = []       # последний полученный снимок
+        self.ids = set()
+        self.fetched_at = None  # time.monotonic() последнего успешного опроса
+        self.day = None         # дата, от которой считался диапазон снимка
+    
+    def date_range(self, today: date) -> tuple:
+        return (
+            (today + timedelta(days=self.first_day)).strftime("%Y-%m-%d"),
+            (today + timedelta(days=self.last_day)).strftime("%Y-%m-%d"),
+        )
+    
+    def is_due(self, today: date) -> bool:
+        if self.fetched_at is None or self.day != today:
+            return True
+        return time.monotonic() - self.fetched_at >= self.interval
+
+
+class RecordsPoller:
+    """Планировщик уровней опроса: собирает единый вид записей на 7 дней.
+    
+    Уровни обходятся от ближних к дальним: просроченные запрашиваются заново,
+    остальные отдаются из снимка. Запись, уже отданная более свежим уровнем,
+    повторно не отдаётся.
+    
+    complete=False означает, что по результату опроса нельзя судить об
+    отменах: часть уровней не получена или запись пропала из одного уровня,
+    пока другие отдавались из снимка (она могла туда переехать). В этом случае
+    следующий опрос обновляет все уровни.
+    
+    Страницы запрашиваются без records_lock, поэтому вебхук может изменить
+    запись, пока идёт опрос. Такие записи (touched) остаются в снимке в
+    версии вебхука, а цикл проверки их пропускает: ответ API для них старше.
+    """
+    
+    def __init__(self, api: "YClientsAPI", tiers: list):
+        self.api = api
+        self.tiers = [PollTier(*tier) for tier in tiers]
+        self.complete = False
+        self.fetched = []       # названия уровней, запрошенных в последнем опросе
+        self._force_all = True
+        self._by_phone = {}     # phone_key -> {record_id: запись} по всем уровням
+        self._index_dirty = True
+        self.touched = set()    # ID записей, изменённых вебхуками с начала опроса
+    
+    def date_range(self) -> tuple:
+        """Общий диапазон дат всех уровней"""
+        today = date.today()
+        return (
+            self.tiers[0].date_range(today)[0],
+            self.tiers[-1].date_range(today)[1],
+        )
+    
+    async def iter_pages(self):
+        """Поток страниц записей для одного цикла проверки"""
+        today = date.today()
+        force_all, self._force_all = self._force_all, False
+        seen = set()
+        lost = False
+        failed = False
+        self.fetched = []
+        self.touched = set()
+        
+        for tier in self.tiers:
+            if force_all or tier.is_due(today):
+                records = []
+                known = {r.id: r for r in tier.records}
+                try:
+                    async for page in self.api.iter_record_pages(*tier.date_range(today), known=known):
+                        records.extend(page)
+                        fresh = [r for r in page if r.id not in seen]
+                        seen.update(r.id for r in fresh)
+                        yield fresh
+                except Exception as e:
+                    logger.error(f"Опрос уровня «{tier.name}» не удался: {e}")
+                    failed = True
+                    cached = [r for r in tier.records if r.id not in seen]
+                    seen.update(r.id for r in cached)
+                    yield cached
+                    continue
+                
+                ids = {r.id for r in records}
+                if tier.day == today and tier.ids - ids:
+                    lost = True
+                if self.touched:
+                    # Версия вебхука новее страницы, полученной до него
+                    records = ([r for r in records if r.id not in self.touched]
+                               + [r for r in tier.records if r.id in self.touched])
+                    ids = {r.id for r in records}
+                tier.records, tier.ids = records, ids
+                tier.fetched_at, tier.day = time.monotonic(), today
+                self._index_dirty = True
+                self.fetched.append(tier.name)
+            else:
+                cached = [r for r in tier.records if r.id not in seen]
+                seen.update(r.id for r in cached)
+                yield cached
+        
+        all_fresh = len(self.fetched) == len(self.tiers)
+        self.complete = not failed and (all_fresh or not lost)
+        if not self.complete:
+            self._force_all = True
+    
+    def _tier_for(self, record: Record):
+        """Уровень, в диапазон которого попадает дата записи"""
+        day = record.datetime_str[:10]
+        today = date.today()
+        for tier in self.tiers:
+            first, last = tier.date_range(today)
+            if first <= day <= last:
+                return tier
+        return None
+    
+    def covers(self, record: Record) -> bool:
+        return self._tier_for(record) is not None
+    
+    def discard(self, record_id: int):
+        """Убрать запись из снимков всех уровней"""
+        self.touched.add(record_id)
+        for tier in self.tiers:
+            if record_id in tier.ids:
+                tier.ids.discard(record_id)
+                tier.records = [r for r in tier.records if r.id != record_id]
+        for records in self._by_phone.values():
+            records.pop(record_id, None)
+    
+    def apply(self, record: Record):
+        """Обновить снимки записью, пришедшей вне опроса (вебхук)"""
+        self.discard(record.id)
+        tier = self._tier_for(record)
+        if tier is not None and tier.day == date.today():
+            tier.records.append(record)
+            tier.ids.add(record.id)
+            self._index(record)
+    
+    # ---------- индекс по телефону для «Мои записи» ----------
+    
+    def _index(self, record: Record):
+        if record.phone_key:
+            self._by_phone.setdefault(record.phone_key, {})[record.id] = record
+    
+    def _reindex(self):
+        self._by_phone = {}
+        for tier in self.tiers:
+            for record in tier.records:
+                self._index(record)
+        self._index_dirty = False
+    
+    def snapshot_age(self):
+        """Возраст самого старого уровня в секундах (None — снимка на сегодня нет)"""
+        today = date.today()
+        if any(tier.fetched_at is None or tier.day != today for tier in self.tiers):
+            return None
+        return time.monotonic() - min(tier.fetched_at for tier in self.tiers)
+    
+    def records_for_phone(self, key: str, max_age: float = MY_RECORDS_MAX_AGE):
+        """Записи клиента из снимка по времени; None — если снимок устарел"""
+        age = self.snapshot_age()
+        if age is None or age > max_age:
+            return None
+        if self._index_dirty:
+            self._reindex()
+        return sorted(self._by_phone.get(key, {}).values(), key=lambda r: r.datetime_str)
+
+
+records_poller = RecordsPoller(yclients, POLL_TIERS)
+
+
 async def check_records():
-    """Проверка записей и отправка уведомлений"""
+    """Проверка записей и отправка уведомлений. True — если были изменения"""
     logger.info("=== Проверка записей ===")
     
-    records = await yclients.get_upcoming_records()
-    if not records:
-        logger.info("Записей не найдено")
-        return
+    try:
+        pages = await _fetch_record_pages(records_poller)
+    except Exception as e:
+        logger.error(f"Ошибка опроса записей, цикл пропущен: {e}")
+        return False
     
-    logger.info(f"Найдено {len(records)} записей")
+    # Состояние цикла: чтения пачками, записи одной транзакцией в конце.
+    # Блокировка — только на сравнение и запись: вебхуки и напоминания не ждут сеть
+    state = CycleState()
+    async with records_lock:
+        try:
+            await _check_records_cycle(records_poller, state, pages)
+        finally:
+            await state.commit()
     
+    stats = state.stats
+    return bool(stats["new"] or stats["changed"] or stats["cancelled"])
+
+
+async def _fetch_record_pages(poller: "RecordsPoller") -> list:
+    """Все страницы одного опроса (сеть, без records_lock)"""
+    pages = []
+    try:
+        async for page in poller.iter_pages():
+            pages.append(page)
+    finally:
+        decode = poller.api.take_decode_stats()
+        poll_metrics.update(
+            decode_pages=decode["pages"],
+            decode_kb=round(decode["bytes"] / 1024, 1),
+            decode_ms=round(decode["seconds"] * 1000, 1),
+        )
+    poll_metrics["tiers_fetched"] = list(poller.fetched)
+    return pages
+
+
+async def _check_records_cycle(poller: "RecordsPoller", state: CycleState, pages: list):
+    """Один проход по записям опроса с общим состоянием цикла (под records_lock).
+    
+    Проверка отмен — только если опрос дал полный и согласованный вид всех
+    уровней. Записи, изменённые вебхуками во время опроса, уже обработаны:
+    они пропускаются и не считаются пропавшими.
+    """
     now = datetime.now()
-    current_record_ids = set()
+    touched = set(poller.touched)
+    current_record_ids = set(touched)
+    telegram_ids = {}
+    
+    try:
+        for page in pages:
+            if touched:
+                page = [r for r in page if r.id not in touched]
+            await _check_records_page(page, state, telegram_ids, current_record_ids, now)
+    except Exception as e:
+        logger.error(f"Ошибка обработки записей, проверка отмен пропущена: {e}")
+        return
+    
+    if not current_record_ids:
+        logger.info("Записей не найдено")
+        return
+    
+    logger.info(f"Найдено {len(current_record_ids)} записей (обновлены: {', '.join(poller.fetched) or 'нет'})")
+    if poller.complete:
+        await _check_cancelled_records(state, telegram_ids, current_record_ids, poller.date_range())
+    else:
+        logger.info("Опрос неполный — проверка отмен отложена до полного обновления")
+    
+    stats = state.stats
+    poll_metrics.update(stats, records=len(current_record_ids), checked_at=datetime.now().isoformat())
+    logger.info(
+        f"Цикл: записей {len(current_record_ids)}, новых {stats['new']}, изменённых {stats['changed']}, "
+        f"без изменений {stats['skipped']}, отменённых {stats['cancelled']}, прошедших {stats['completed']}; "
+        f"разбор {poll_metrics['decode_pages']} стр. ({poll_metrics['decode_kb']} КБ) "
+        f"за {poll_metrics['decode_ms']} мс"
+    )
+
+
+async def _check_records_page(records: list, state: CycleState, telegram_ids: dict,
+                              current_record_ids: set, now: datetime):
+    """Обработка одной страницы записей"""
+    # Телефоны страницы разрешаем в Telegram ID одним запросом
+    telegram_ids.update(await get_telegram_ids_by_phones(
+        r.client_phone for r in records if r.client_phone
+    ))
+    await state.load(r.id for r in records)
     
     for record in records:
-        if not record or not isinstance(record, dict):
-            continue
-        
-        record_id = record.get("id")
-        if not record_id:
-            continue
+        record_id = record.id
         
         current_record_ids.add(record_id)
         
-        client = record.get("client")
-        if not client or not isinstance(client, dict):
+        if not record.client_phone:
+            logger.info(f"Запись #{record_id}: нет телефона у клиента {record.client_name or 'Неизвестно'}")
             continue
         
-        client_phone = client.get("phone", "")
-        client_name = client.get("name", "Неизвестно")
+        chat_ids = telegram_ids.get(record.phone_key, [])
         
-        if not client_phone:
-            logger.info(f"Запись #{record_id}: нет телефона у клиента {client_name}")
-            continue
+        # Неизменённые записи пропускаем целиком: ни записи в БД, ни проверок изменений
+        if state.is_unchanged(record_id, record.fingerprint):
+            state.stats["skipped"] += 1
+        else:
+            await _process_changed_record(record, state, chat_ids)
+
+
+async def _check_cancelled_records(state: CycleState, telegram_ids: dict, current_record_ids: set,
+                                   date_range: tuple):
+    """Отмена записей, исчезнувших из ответа API в опрошенном окне дат.
+    
+    Записи до начала окна не отменяются, а закрываются как прошедшие.
+    """
+    window_start, last_day = date_range
+    window_end = (date.fromisoformat(last_day) + timedelta(days=1)).isoformat()
+    completed, vanished = await storage.write(
+        _diff_poll_window, list(current_record_ids), window_start, window_end
+    )
+    if completed:
+        state.stats["completed"] += completed
+        logger.info(f"Прошедших записей закрыто: {completed}")
+        notify_db_changed()
+    
+    await state.load(vanished)
+    await _cancel_records(state, telegram_ids, vanished)
+
+
+async def _cancel_records(state: CycleState, telegram_ids: dict, record_ids: list):
+    """Уведомить клиентов об отмене и отметить активные записи отменёнными"""
+    vanished = [state.get_tracked(record_id) for record_id in record_ids]
+    vanished = [tracked for tracked in vanished if tracked and tracked.status == "active"]
+    if not vanished:
+        return
+    
+    missing_phones = [t.client_phone for t in vanished
+                      if t.client_phone and phone_key(t.client_phone) not in telegram_ids]
+    telegram_ids.update(await get_telegram_ids_by_phones(missing_phones))
+    
+    for tracked in vanished:
+        record_id = tracked.record_id
+        client_phone = tracked.client_phone
+        chat_ids = telegram_ids.get(phone_key(client_phone)) if client_phone else None
         
-        telegram_id = get_telegram_id_by_phone(client_phone)
-        if not telegram_id:
-            logger.info(f"Запись #{record_id}: клиент {client_name} ({client_phone}) не в боте")
-            # Продолжаем обработку даже если клиент не в боте (для отслеживания attendance)
+        if chat_ids and not state.is_sent(record_id, "cancelled"):
+            queue_record_cancelled_notification(state, chat_ids, record_id, tracked.datetime)
         
-        logger.info(f"Запись #{record_id}: {client_name}, телефон {client_phone}, telegram_id={telegram_id}")
+        state.mark_cancelled(record_id)
+        reminder_scheduler.cancel(state, record_id)
+        records_cache.discard(record_id)
+
+
+async def _process_changed_record(record: Record, state: CycleState, telegram_ids: list):
+    """Обработка новой или изменённой записи: уведомления и сохранение"""
+    record_id = record.id
+    client_phone = record.client_phone
+    client_name = record.client_name or "Неизвестно"
+    datetime_str = record.datetime_str
+    
+    if not telegram_ids:
+        logger.info(f"Запись #{record_id}: клиент {client_name} ({client_phone}) не в боте")
+        # Продолжаем обработку даже если клиент не в боте (для отслеживания attendance)
+    
+    logger.info(f"Запись #{record_id}: {client_name}, телефон {client_phone}, telegram_ids={telegram_ids}")
+    
+    # Получаем сохранённую запись
+    tracked = state.get_tracked(record_id)
+    
+    if tracked is None:
+        # Новая запись!
+        state.stats["new"] += 1
+        logger.info(f"Новая запись #{record_id} найдена!")
         
-        datetime_str = record.get("datetime", "")
-        services_list = record.get("services") or []
-        services = ", ".join([s.get("title", "") for s in services_list if isinstance(s, dict)])
-        staff = record.get("staff") or {}
-        staff_name = staff.get("name", "") if isinstance(staff, dict) else ""
+        # Логируем полную структуру новой записи для поиска ссылки
+        logger.debug(json.dumps(record.to_dict(), ensure_ascii=False, indent=2, default=str))
         
-        # Логируем полную структуру первой записи для поиска ссылки
-        if len(current_record_ids) == 1:
-            logger.info(f"=== ПОЛНЫЕ ДАННЫЕ ЗАПИСИ #{record_id} ===")
-            logger.info(json.dumps(record, ensure_ascii=False, indent=2, default=str))
+        if telegram_ids:
+            if not state.is_sent(record_id, "new"):
+                logger.info(f"Уведомление о записи #{record_id} поставлено в очередь для {telegram_ids}")
+                queue_new_record_notification(state, telegram_ids, record)
+        else:
+            logger.info(f"Клиент записи #{record_id} не в боте - уведомление не отправлено")
+    
+    else:
+        state.stats["changed"] += 1
         
-        # Получаем сохранённую запись
-        tracked = get_tracked_record(record_id)
+        # Проверяем изменение времени
+        old_datetime = tracked.datetime
         
-        if tracked is None:
-            # Новая запись!
-            logger.info(f"Новая запись #{record_id} найдена!")
-            
-            if telegram_id:
-                if not is_notification_sent(record_id, "new"):
-                    logger.info(f"Отправляем уведомление клиенту {telegram_id}")
-                    if await send_new_record_notification(telegram_id, record):
-                        mark_notification_sent(record_id, "new")
-                        logger.info(f"Уведомление о записи #{record_id} отправлено!")
-                    else:
-                        logger.error(f"Не удалось отправить уведомление о записи #{record_id}")
-            else:
-                logger.info(f"Клиент записи #{record_id} не в боте - уведомление не отправлено")
-            
-            save_tracked_record(record_id, client_phone, datetime_str, services, staff_name)
+        if telegram_ids and old_datetime and datetime_str and old_datetime != datetime_str:
+            # Проверяем разницу во времени
+            old_dt = parse_datetime(old_datetime)
+            if old_dt and record.start:
+                diff_minutes = abs((record.start - old_dt.replace(tzinfo=None)).total_seconds() / 60)
+                
+                if diff_minutes >= MIN_RESCHEDULE_MINUTES:
+                    notification_key = f"changed_{datetime_str}"
+                    if not state.is_sent(record_id, notification_key):
+                        queue_record_changed_notification(state, telegram_ids, record, notification_key)
+    
+    # Сохраняем запись вместе с новым отпечатком
+    state.save_tracked(record_id, client_phone, datetime_str, record.services_title, record.staff.name,
+                       fingerprint=record.fingerprint)
+    
+    # Планируем напоминания (при переносе — заново)
+    reminder_scheduler.plan(state, record, tracked.datetime if tracked else None)
+    
+    # Проверяем статус "пришёл" (attendance)
+    # YClients использует attendance=1 или visit_attendance=1 когда клиент пришёл
+    if record.arrived and not state.is_attendance_notified(record_id):
+        logger.info(f"Клиент пришёл! Запись #{record_id}")
+        await notify_staff_client_arrived(state, record)
+        state.mark_attendance_notified(record_id)
+
+
+class AdaptivePollInterval:
+    """Интервал между циклами проверки записей.
+    
+    После изменений — минимальный; после POLL_IDLE_CYCLES циклов без изменений
+    растёт в POLL_BACKOFF_FACTOR раз до POLL_INTERVAL_MAX; вне BUSINESS_HOURS —
+    не меньше POLL_INTERVAL_OFF_HOURS. Retry-After и низкий остаток лимита
+    YClients имеют приоритет. К итогу добавляется разброс ±POLL_JITTER.
+    """
+    
+    def __init__(self, api: "YClientsAPI", minimum: float = CHECK_INTERVAL):
+        self.api = api
+        self.minimum = minimum
+        self.maximum = max(POLL_INTERVAL_MAX, minimum)
+        self.interval = minimum
+        self.idle_cycles = 0
+    
+    def next_delay(self, changed: bool, now: datetime = None) -> float:
+        """Пауза до следующего цикла с учётом его результата"""
+        # Рабочие часы — по часам салона: сервер обычно живёт в UTC
+        salon_tz = timezone(timedelta(hours=SALON_UTC_OFFSET_HOURS))
+        now = (now or datetime.now(timezone.utc)).astimezone(salon_tz)
         
+        if changed:
+            self.idle_cycles = 0
+            self.interval = self.minimum
+            reason = "изменения в записях"
         else:
-            # Проверяем изменение времени
-            old_datetime = tracked[2]  # datetime из БД
-            
-            if telegram_id and old_datetime and datetime_str and old_datetime != datetime_str:
-                # Проверяем разницу во времени
-                try:
-                    old_dt = datetime.fromisoformat(old_datetime.replace("Z", "+00:00")).replace(tzinfo=None)
-                    new_dt = datetime.fromisoformat(datetime_str.replace("Z", "+00:00")).replace(tzinfo=None)
-                    diff_minutes = abs((new_dt - old_dt).total_seconds() / 60)
-                    
-                    if diff_minutes >= MIN_RESCHEDULE_MINUTES:
-                        notification_key = f"changed_{datetime_str}"
-                        if not is_notification_sent(record_id, notification_key):
-                            if await send_record_changed_notification(telegram_id, record, old_datetime):
-                                mark_notification_sent(record_id, notification_key)
-                except:
-                    pass
-            
-            # Обновляем запись
-            save_tracked_record(record_id, client_phone, datetime_str, services, staff_name)
+            self.idle_cycles += 1
+            if self.idle_cycles >= POLL_IDLE_CYCLES:
+                self.interval = min(self.interval * POLL_BACKOFF_FACTOR, self.maximum)
+                reason = f"без изменений {self.idle_cycles} циклов"
+            else:
+                reason = "обычный режим"
         
-        # Проверяем напоминание за 24 часа
-        if datetime_str:
-            try:
-                record_time = datetime.fromisoformat(datetime_str.replace("Z", "+00:00")).replace(tzinfo=None)
-                hours_until = (record_time - now).total_seconds() / 3600
-                
-                # Напоминание за 24 часа (окно 23-25 часов)
-                if 23 <= hours_until <= 25:
-                    if not is_notification_sent(record_id, "reminder_24h"):
-                        if await send_reminder_24h(telegram_id, record):
-                            mark_notification_sent(record_id, "reminder_24h")
-            except:
-                pass
+        interval = self.interval
+        if not BUSINESS_HOURS[0] <= now.hour < BUSINESS_HOURS[1]:
+            interval = max(interval, POLL_INTERVAL_OFF_HOURS)
+            reason = "нерабочее время"
         
-        # Проверяем статус "пришёл" (attendance)
-        attendance = record.get("attendance")
-        visit_attendance = record.get("visit_attendance")
-        
-        # YClients использует attendance=1 или visit_attendance=1 когда клиент пришёл
-        if (attendance == 1 or visit_attendance == 1) and not is_attendance_notified(record_id):
-            logger.info(f"Клиент пришёл! Запись #{record_id}")
-            await notify_staff_client_arrived(record)
-            mark_attendance_notified(record_id)
-    
-    # Проверяем отменённые записи
-    tracked_ids = get_all_tracked_record_ids()
-    for record_id, old_datetime in tracked_ids.items():
-        if record_id not in current_record_ids:
-            # Запись исчезла — отменена!
-            tracked = get_tracked_record(record_id)
-            if tracked:
-                client_phone = tracked[1]
-                telegram_id = get_telegram_id_by_phone(client_phone)
-                
-                if telegram_id and not is_notification_sent(record_id, "cancelled"):
-                    if await send_record_cancelled_notification(telegram_id, {"datetime": old_datetime}):
-                        mark_notification_sent(record_id, "cancelled")
-                
-                mark_record_cancelled(record_id)
+        remaining = self.api.rate_limit_remaining
+        if remaining is not None and remaining <= RATE_LIMIT_LOW_REMAINING:
+            interval = max(interval, self.maximum)
+            reason = f"мало лимита YClients ({remaining})"
+        
+        delay = interval * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+        
+        retry_after = self.api.retry_after()
+        if retry_after > delay:
+            delay = retry_after
+            reason = "YClients 429, Retry-After"
+        
+        poll_metrics["poll_interval"] = round(delay, 2)
+        poll_metrics["poll_interval_reason"] = reason
+        return delay
 
 
 async def records_checker():
     """Планировщик проверки записей"""
+    # С вебхуками опрос — только редкая сверка
+    minimum = YCLIENTS_RECONCILE_INTERVAL if YCLIENTS_WEBHOOK_ENABLED else CHECK_INTERVAL
+    poll_interval = AdaptivePollInterval(yclients, minimum)
     while True:
+        changed = False
         try:
-            await check_records()
+            changed = await check_records()
         except Exception as e:
             logger.error(f"Ошибка проверки записей: {e}")
-        await asyncio.sleep(CHECK_INTERVAL)
+        delay = poll_interval.next_delay(changed)
+        logger.info(f"Следующая проверка через {delay:.1f} сек ({poll_metrics['poll_interval_reason']})")
+        await asyncio.sleep(delay)
+
+
+# ==================== ВЕБХУКИ YCLIENTS ====================
+
+YCLIENTS_EVENT_STATUSES = ("create", "update", "delete")
+
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+background_tasks = set()
+
+
+def validate_yclients_event(event) -> tuple:
+    """Проверка события вебхука: (status, ID записи) или ValueError.
+    
+    Для ресурсов, отличных от записи, возвращает (None, None). Данные записи
+    из события не используются: это только сигнал, запись перечитывается из API.
+    """
+    if not isinstance(event, dict):
+        raise ValueError("событие должно быть объектом")
+    if str(event.get("company_id")) != str(YCLIENTS_COMPANY_ID):
+        raise ValueError(f"чужая компания: {event.get('company_id')}")
+    if event.get("resource") != "record":
+        return None, None
+    
+    status = event.get("status")
+    if status not in YCLIENTS_EVENT_STATUSES:
+        raise ValueError(f"неизвестный статус: {status}")
+    
+    record = event.get("data")
+    if not isinstance(record, dict):
+        raise ValueError("нет данных записи")
+    if not isinstance(record.get("id"), int):
+        raise ValueError("нет ID записи")
+    resource_id = event.get("resource_id")
+    if resource_id is not None and resource_id != record["id"]:
+        raise ValueError(f"resource_id {resource_id} не совпадает с ID записи {record['id']}")
+    
+    return status, record["id"]
+
+
+async def handle_record_event(status: str, record_id: int):
+    """Обработка события записи так же, как в цикле проверки.
+    
+    Запись берётся из API, а не из тела запроса: поддельное событие не может
+    ни подменить текст уведомления, ни отменить существующую запись.
+    """
+    started = time.perf_counter()
+    try:
+        record = await yclients.get_record(record_id)
+    except Exception as e:
+        logger.warning(f"Вебхук: запись #{record_id} не получена из YClients ({e}), остаётся сверке опросом")
+        return
+    if record is not None and record.phone_key:
+        my_records_cache.invalidate(record.phone_key)
+    
+    async with records_lock:
+        state = CycleState()
+        telegram_ids = {}
+        try:
+            if record is None or record.deleted:
+                # В YClients записи нет (404) или она удалена
+                records_poller.discard(record_id)
+                await state.load([record_id])
+                tracked = state.get_tracked(record_id)
+                if tracked and tracked.client_phone:
+                    my_records_cache.invalidate(phone_key(tracked.client_phone))
+                await _cancel_records(state, telegram_ids, [record_id])
+            elif records_poller.covers(record):
+                records_poller.apply(record)
+                await _check_records_page([record], state, telegram_ids, set(), datetime.now())
+            else:
+                logger.info(f"Вебхук: запись #{record_id} вне окна отслеживания — пропущена")
+                return
+        finally:
+            await state.commit()
+    
+    logger.info(f"Вебхук: запись #{record_id} ({status}) обработана за {(time.perf_counter() - started) * 1000:.0f} мс")
+
+
+async def yclients_webhook_handler(request: web.Request) -> web.Response:
+    """Приём вебхуков YClients"""
+    # Байты, а не str: compare_digest не принимает строки с не-ASCII символами
+    secret = request.query.get("secret", "").encode()
+    if not hmac.compare_digest(secret, YCLIENTS_WEBHOOK_SECRET.encode()):
+        return web.json_response({"ok": False, "error": "forbidden"}, status=403)
+    
+    try:
+        payload = await request.json()
+    except ValueError:
+        return web.json_response({"ok": False, "error": "invalid json"}, status=400)
+    
+    events = payload if isinstance(payload, list) else [payload]
+    try:
+        validated = [validate_yclients_event(event) for event in events]
+    except ValueError as e:
+        logger.warning(f"Вебхук YClients отклонён: {e}")
+        return web.json_response({"ok": False, "error": str(e)}, status=400)
+    
+    # Отвечаем сразу, обработка — в фоне (YClients не ждёт отправки в Telegram)
+    accepted = 0
+    for status, record_id in validated:
+        if status is None:
+            continue
+        task = asyncio.create_task(handle_record_event(status, record_id))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+        accepted += 1
+    
+    return web.json_response({"ok": True, "accepted": accepted})
+
+
+# ==================== ВЕБ-СЕРВЕР ====================
+
+def create_web_app() -> web.Application:
+    """HTTP-приложение для входящих вебхуков YClients и Telegram"""
+    app = web.Application()
+    if YCLIENTS_WEBHOOK_ENABLED:
+        if not YCLIENTS_WEBHOOK_SECRET:
+            raise RuntimeError("YCLIENTS_WEBHOOK_ENABLED = True требует непустой YCLIENTS_WEBHOOK_SECRET")
+        app.router.add_post(YCLIENTS_WEBHOOK_PATH, yclients_webhook_handler)
+    if TELEGRAM_MODE == "webhook":
+        SimpleRequestHandler(
+            dispatcher=dp,
+            bot=bot,
+            handle_in_background=TELEGRAM_WEBHOOK_BACKGROUND,
+            secret_token=TELEGRAM_WEBHOOK_SECRET or None,
+        ).register(app, path=TELEGRAM_WEBHOOK_PATH)
+        setup_application(app, dp, bot=bot)
+    return app
+
+
+async def start_web_server(app: web.Application) -> web.AppRunner:
+    """Запуск HTTP-сервера в общем event loop"""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEB_SERVER_HOST, WEB_SERVER_PORT)
+    await site.start()
+    logger.info(f"🌐 Веб-сервер слушает {WEB_SERVER_HOST}:{WEB_SERVER_PORT}")
+    return runner
 
 
 # ==================== УВЕДОМЛЕНИЯ СОТРУДНИКАМ ====================
@@ -1386,52 +2698,36 @@ def mask_phone(phone: str) -> str:
     return f"+{digits[:3]} *** ** {digits[-2:]}"
 
 
-async def notify_staff_client_arrived(record: dict):
-    """Уведомить мастера о приходе его клиента"""
+async def notify_staff_client_arrived(state: "CycleState", record: Record):
+    """Уведомить мастера о приходе его клиента (в очередь отправки)"""
     try:
-        # Получаем данные о записи
-        client = record.get("client") or {}
-        client_name = client.get("name", "Клиент") if isinstance(client, dict) else "Клиент"
-        client_phone = client.get("phone", "") if isinstance(client, dict) else ""
+        client_name = record.client_name or "Клиент"
         
         # Маскируем номер телефона
-        masked_phone = mask_phone(client_phone) if client_phone else ""
-        
-        services_list = record.get("services") or []
-        services = ", ".join([s.get("title", "") for s in services_list if isinstance(s, dict)])
+        masked_phone = mask_phone(record.client_phone) if record.client_phone else ""
         
-        staff_info = record.get("staff") or {}
-        staff_name = staff_info.get("name", "Мастер") if isinstance(staff_info, dict) else "Мастер"
-        yclients_staff_id = staff_info.get("id") if isinstance(staff_info, dict) else None
+        staff_name = record.staff.name or "Мастер"
+        yclients_staff_id = record.staff.id
         
-        datetime_str = record.get("datetime", "")
-        time_str = format_record_datetime(datetime_str) if datetime_str else ""
+        time_str = format_record_datetime(record.start or record.datetime_str)
         
         # Формируем сообщение
         msg = (
             f"🔔 <b>К вам пришёл клиент!</b>\n\n"
             f"👤 {client_name}\n"
             f"📞 {masked_phone}\n"
-            f"✂️ {services}\n"
+            f"✂️ {record.services_title}\n"
             f"🗓 {time_str}"
         )
         
         # Ищем зарегистрированного мастера по YClients ID
         if yclients_staff_id:
-            staff_data = get_staff_by_yclients_id(yclients_staff_id)
+            staff_data = await get_staff_by_yclients_id(yclients_staff_id)
             
             if staff_data:
-                telegram_id = staff_data[0]
-                try:
-                    await bot.send_message(
-                        telegram_id,
-                        msg,
-                        parse_mode=ParseMode.HTML
-                    )
-                    logger.info(f"Уведомление о приходе отправлено мастеру {staff_name} ({telegram_id})")
-                    return
-                except Exception as e:
-                    logger.error(f"Ошибка отправки мастеру {telegram_id}: {e}")
+                telegram_ids = staff_data[0]
+                state.enqueue(telegram_ids, record.id, "arrived", msg)
+                logger.info(f"Уведомление о приходе поставлено в очередь мастеру {staff_name} ({telegram_ids})")
             else:
                 logger.info(f"Мастер {staff_name} (ID: {yclients_staff_id}) не зарегистрирован в боте")
         else:
@@ -1441,21 +2737,18 @@ async def notify_staff_client_arrived(record: dict):
         logger.error(f"Ошибка notify_staff_client_arrived: {e}")
 
 
-
-
 # ==================== ЗАПУСК ====================
 
-def restore_backup_data():
-    """Восстановление резервных данных из кода"""
-    conn = sqlite3.connect(DB_PATH)
+def _restore_backup_rows(conn: sqlite3.Connection):
+    """Вставка резервных клиентов и сотрудников (в потоке-писателе)"""
     cursor = conn.cursor()
     
     # Восстанавливаем клиентов
     for telegram_id, phone in BACKUP_CLIENTS.items():
         cursor.execute("""
-            INSERT OR IGNORE INTO clients (telegram_id, phone_number)
-            VALUES (?, ?)
-        """, (telegram_id, phone))
+            INSERT OR IGNORE INTO clients (telegram_id, phone_number, phone_key)
+            VALUES (?, ?, ?)
+        """, (telegram_id, phone, phone_key(phone)))
     
     # Восстанавливаем сотрудников
     for telegram_id, (staff_name, yclients_id) in BACKUP_STAFF.items():
@@ -1463,32 +2756,87 @@ def restore_backup_data():
             INSERT OR IGNORE INTO staff (telegram_id, staff_name, yclients_staff_id)
             VALUES (?, ?, ?)
         """, (telegram_id, staff_name, yclients_id))
-    
-    conn.commit()
-    conn.close()
+
+
+async def restore_backup_data():
+    """Восстановление резервных данных из кода"""
+    await storage.write(_restore_backup_rows)
+    for telegram_id, phone in BACKUP_CLIENTS.items():
+        if telegram_id not in client_registry:
+            client_registry.add(telegram_id, phone)
+    staff_directory.invalidate()
     logger.info(f"✅ Восстановлено {len(BACKUP_CLIENTS)} клиентов и {len(BACKUP_STAFF)} сотрудников из резерва")
 
 
 async def main():
     """Запуск бота"""
-    # Сначала пробуем загрузить базу из S3
-    sync_db_from_s3()
+    started = time.perf_counter()
+    
+    # Целая локальная копия — стартуем с неё, сверка с S3 пойдёт в фоне.
+    # Новее ли копия в S3, без сети не узнать (версия — ETag/поколение в S3),
+    # поэтому это решает фоновая сверка: версия совпала с метаданными — ничего
+    # не делаем, иначе дописываем недостающие строки (локальные не затираются).
+    # Иначе (первый запуск, пустой или битый файл) ждём загрузку из S3.
+    local_ok = local_copy_is_valid(DB_PATH)
+    if local_ok:
+        logger.info(f"Локальная база {DB_PATH} в порядке — старт без загрузки из S3")
+    else:
+        sync_db_from_s3()
+    
+    # Открываем хранилище (WAL, поток-писатель, пул чтения)
+    storage.open()
     
-    # Инициализируем базу (создаст таблицы если их нет)
-    init_db()
+    # Создаём таблицы и восстанавливаем резервные данные
+    await prepare_db()
+    await staff_directory.load()
     
-    # Восстанавливаем резервные данные
-    restore_backup_data()
+    s3_sync_task = None
+    if db_persistence is not None:
+        s3_sync_task = asyncio.create_task(sync_with_s3(reconcile=local_ok))
     
-    await bot.delete_webhook(drop_pending_updates=True)
+    if TELEGRAM_MODE == "webhook":
+        await bot.set_webhook(
+            f"{TELEGRAM_WEBHOOK_URL.rstrip('/')}{TELEGRAM_WEBHOOK_PATH}",
+            secret_token=TELEGRAM_WEBHOOK_SECRET or None,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=True,
+        )
+    else:
+        await bot.delete_webhook(drop_pending_updates=True)
     
-    # Запускаем проверку записей
+    # Запускаем отправку из очереди и проверку записей
+    await reminder_scheduler.load()
+    asyncio.create_task(outbox_dispatcher.run())
+    asyncio.create_task(reminder_scheduler.run())
     asyncio.create_task(records_checker())
+    asyncio.create_task(retention_job.run_forever(RETENTION_INTERVAL, first_delay=RETENTION_FIRST_RUN_DELAY))
+    asyncio.create_task(staff_directory.run_forever(STAFF_LIST_REFRESH_INTERVAL))
     
-    logger.info("🚀 Бот запущен!")
-    logger.info(f"⏱ Проверка записей каждые {CHECK_INTERVAL} сек")
+    # HTTP-сервер для вебхуков (в том же event loop, что и опрос YClients)
+    web_runner = None
+    if YCLIENTS_WEBHOOK_ENABLED or TELEGRAM_MODE == "webhook":
+        web_runner = await start_web_server(create_web_app())
+    
+    logger.info(f"🚀 Бот запущен за {time.perf_counter() - started:.2f} сек!")
+    if YCLIENTS_WEBHOOK_ENABLED:
+        logger.info(f"⏱ Вебхуки YClients включены, сверка опросом раз в {YCLIENTS_RECONCILE_INTERVAL} сек")
+    else:
+        logger.info(f"⏱ Проверка записей каждые {CHECK_INTERVAL}–{POLL_INTERVAL_MAX} сек (адаптивно)")
     
-    await dp.start_polling(bot)
+    try:
+        if TELEGRAM_MODE == "webhook":
+            logger.info(f"📨 Обновления Telegram через вебхук {TELEGRAM_WEBHOOK_PATH}")
+            await asyncio.Event().wait()
+        else:
+            await dp.start_polling(bot)
+    finally:
+        if web_runner:
+            await web_runner.cleanup()
+        if s3_sync_task is not None:
+            s3_sync_task.cancel()
+        if db_persistence is not None:
+            await db_persistence.close()
+        storage.close()
 
 
 if __name__ == "__main__":
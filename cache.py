@@ -0,0 +1,149 @@
+"""
+Кэши в памяти для ответов YClients.
+- TTLCache: значение живёт ttl секунд; одновременные промахи по одному
+  ключу объединяются в одну загрузку (single-flight)
+- RecordCache: записи по ID с вытеснением LRU + TTL и лимитом по памяти
+"""
+
+import asyncio
+import json
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Кэш с временем жизни и объединением одновременных загрузок"""
+
+    def __init__(self, ttl: float, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = {}         # key -> (expires_at, value)
+        self._inflight = {}     # key -> asyncio.Future текущей загрузки
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        if item[0] <= time.monotonic():
+            del self._data[key]
+            return default
+        return item[1]
+
+    def set(self, key, value):
+        if key not in self._data and len(self._data) >= self.max_size:
+            self._evict()
+        self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def _evict(self):
+        """Убрать просроченные, а если их нет — самое старое значение"""
+        now = time.monotonic()
+        expired = [key for key, (expires_at, _) in self._data.items() if expires_at <= now]
+        for key in expired:
+            del self._data[key]
+        if not expired and self._data:
+            del self._data[next(iter(self._data))]
+
+    async def get_or_load(self, key, loader):
+        """Значение из кэша или результат await loader(); ошибки не кэшируются"""
+        item = self._data.get(key)
+        if item is not None and item[0] > time.monotonic():
+            self.hits += 1
+            return item[1]
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.hits += 1
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передано ожидающим; если их нет — не шумим в логах
+            future.exception()
+            raise
+        else:
+            self.set(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            del self._inflight[key]
+
+
+class RecordCache:
+    """Записи YClients по record_id: не больше max_items штук и max_bytes байт.
+
+    Вытесняются давно не использованные (LRU) и устаревшие (старше ttl).
+    Размер записи считается по её JSON — приблизительно, но стабильно.
+    """
+
+    def __init__(self, max_items: int = 2000, max_bytes: int = 4 * 1024 * 1024, ttl: float = 6 * 3600):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data = OrderedDict()  # record_id -> (expires_at, size, запись)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    @staticmethod
+    def _size(record) -> int:
+        data = record.to_dict() if hasattr(record, "to_dict") else record
+        return len(json.dumps(data, ensure_ascii=False, default=str).encode())
+
+    def get(self, record_id: int):
+        item = self._data.get(record_id)
+        if item is None:
+            self.misses += 1
+            return None
+        if item[0] <= time.monotonic():
+            self._remove(record_id)
+            self.misses += 1
+            return None
+        self._data.move_to_end(record_id)
+        self.hits += 1
+        return item[2]
+
+    def put(self, record_id: int, record):
+        size = self._size(record)
+        if size > self.max_bytes:
+            return
+        if record_id in self._data:
+            self._remove(record_id)
+        self._data[record_id] = (time.monotonic() + self.ttl, size, record)
+        self.bytes += size
+        while len(self._data) > self.max_items or self.bytes > self.max_bytes:
+            self._remove(next(iter(self._data)))
+            self.evictions += 1
+
+    def discard(self, record_id: int):
+        if record_id in self._data:
+            self._remove(record_id)
+
+    def _remove(self, record_id: int):
+        _, size, _ = self._data.pop(record_id)
+        self.bytes -= size
+
+    def stats(self) -> dict:
+        return {
+            "items": len(self._data),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
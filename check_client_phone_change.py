@@ -0,0 +1,82 @@
+"""
+Проверка смены телефона клиентом: ID клиента YClients, найденный по старому
+номеру, не должен переживать смену номера — иначе «Мои записи» покажут чужие
+записи. Проверяются таблица clients и реестр в памяти; YClients подменяется.
+
+Запустите: python check_client_phone_change.py
+"""
+
+import asyncio
+import tempfile
+from pathlib import Path
+
+import bot
+from storage import Storage
+
+TELEGRAM_ID = 7
+OLD_PHONE, OLD_CLIENT_ID = "+79990000001", 1001
+NEW_PHONE, NEW_CLIENT_ID = "+79990000002", 1002
+
+
+class FakeYClients:
+    """find_client_id по телефону, без сети"""
+
+    def __init__(self):
+        self.searched = []
+
+    async def find_client_id(self, phone: str):
+        self.searched.append(phone)
+        return {OLD_PHONE: OLD_CLIENT_ID, NEW_PHONE: NEW_CLIENT_ID}.get(phone)
+
+
+async def client_id_in_db():
+    row = await bot.storage.fetchone(
+        "SELECT yclients_client_id FROM clients WHERE telegram_id = ?", (TELEGRAM_ID,)
+    )
+    return row[0]
+
+
+async def run() -> bool:
+    bot.storage = Storage(Path(tempfile.mkdtemp()) / "clients.db")
+    bot.storage.open()
+    bot.yclients = FakeYClients()
+    try:
+        await bot.prepare_db()
+
+        await bot.save_client(TELEGRAM_ID, OLD_PHONE)
+        assert await bot.resolve_yclients_client_id(TELEGRAM_ID, OLD_PHONE, None) == OLD_CLIENT_ID
+        assert await client_id_in_db() == OLD_CLIENT_ID
+        assert bot.client_registry.get(TELEGRAM_ID)[2] == OLD_CLIENT_ID
+
+        # Тот же номер ещё раз — найденный ID сохраняется
+        await bot.save_client(TELEGRAM_ID, OLD_PHONE)
+        assert await client_id_in_db() == OLD_CLIENT_ID
+        assert bot.client_registry.get(TELEGRAM_ID)[2] == OLD_CLIENT_ID
+
+        # Другой номер — старый ID сброшен и в базе, и в реестре
+        await bot.save_client(TELEGRAM_ID, NEW_PHONE)
+        assert await client_id_in_db() is None, "в базе остался ID клиента по старому номеру"
+        phone, _, client_id = bot.client_registry.get(TELEGRAM_ID)
+        assert (phone, client_id) == (NEW_PHONE, None), "в реестре остался ID клиента по старому номеру"
+        assert bot.client_registry.telegram_ids(bot.phone_key(OLD_PHONE)) == []
+
+        # «Мои записи» ищут клиента заново — по новому номеру
+        assert await bot.resolve_yclients_client_id(TELEGRAM_ID, phone, client_id) == NEW_CLIENT_ID
+        assert bot.yclients.searched == [OLD_PHONE, NEW_PHONE]
+        assert await client_id_in_db() == NEW_CLIENT_ID
+    except AssertionError as e:
+        print(f"❌ {e or 'проверка не прошла'}")
+        return False
+    finally:
+        bot.storage.close()
+
+    print("✅ Смена телефона сбрасывает ID клиента YClients в базе и в реестре")
+    return True
+
+
+def main():
+    raise SystemExit(0 if asyncio.run(run()) else 1)
+
+
+if __name__ == "__main__":
+    main()
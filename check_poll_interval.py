@@ -0,0 +1,45 @@
+"""
+Проверка рабочих часов адаптивного опроса: часы салона (SALON_UTC_OFFSET_HOURS),
+а не сервера. Время передаётся в UTC, как в контейнере; YClients подменяется.
+
+Запустите: python check_poll_interval.py
+"""
+
+from datetime import datetime, timezone
+
+import bot
+
+# (время UTC, рабочие ли это часы салона UTC+3 при BUSINESS_HOURS = (9, 22))
+CASES = [
+    (datetime(2026, 2, 5, 5, 59, tzinfo=timezone.utc), False),   # 08:59 у салона
+    (datetime(2026, 2, 5, 6, 0, tzinfo=timezone.utc), True),     # 09:00 — по UTC ещё ночь
+    (datetime(2026, 2, 5, 8, 30, tzinfo=timezone.utc), True),    # 11:30
+    (datetime(2026, 2, 5, 18, 59, tzinfo=timezone.utc), True),   # 21:59
+    (datetime(2026, 2, 5, 19, 0, tzinfo=timezone.utc), False),   # 22:00 — по UTC ещё день
+]
+
+
+class FakeYClients:
+    rate_limit_remaining = None
+
+    def retry_after(self) -> float:
+        return 0.0
+
+
+def main():
+    bot.BUSINESS_HOURS = (9, 22)
+    bot.SALON_UTC_OFFSET_HOURS = 3
+    failed = 0
+    for now, business in CASES:
+        interval = bot.AdaptivePollInterval(FakeYClients(), minimum=15)
+        interval.next_delay(changed=True, now=now)
+        off_hours = bot.poll_metrics["poll_interval_reason"] == "нерабочее время"
+        ok = off_hours != business
+        failed += not ok
+        print(f"{'✅' if ok else '❌'} {now:%H:%M} UTC: {'нерабочее время' if off_hours else 'рабочие часы'}")
+
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Проверка согласованности страниц записей: страницы по смещению читаются
+параллельно, и если между ними запись удалили или добавили, смещения
+сдвигаются и чужая запись выпадает. Такой опрос должен считаться неполным,
+чтобы выпавшая запись не ушла клиенту как отменённая. YClients подменяется.
+
+Запустите: python check_records_pages.py
+"""
+
+import asyncio
+from datetime import date
+
+import bot
+
+COUNT = 450     # три страницы по RECORDS_PAGE_SIZE = 200
+
+
+class ShiftingRecords:
+    """Страницы /records из списка, который можно изменить после первой страницы"""
+
+    def __init__(self, count: int, shift=None):
+        day = date.today().strftime("%Y-%m-%d")
+        self.records = [{"id": 1000 + i, "datetime": f"{day}T12:00:00+03:00"} for i in range(count)]
+        self.shift = shift
+
+    async def get_page(self, date_from, date_to, page, client_id=None, known=None):
+        size = bot.RECORDS_PAGE_SIZE
+        chunk = self.records[(page - 1) * size:page * size]
+        total = len(self.records)
+        if page == 1 and self.shift:
+            self.shift(self.records)
+        await asyncio.sleep(0)
+        return [bot.Record.from_api(r) for r in chunk], total
+
+
+async def poll(shift=None) -> tuple:
+    """(ID, полученные опросом; опрос полный)"""
+    source = ShiftingRecords(COUNT, shift)
+    api = bot.YClientsAPI("", "", "0")
+    api._get_records_page = source.get_page
+    poller = bot.RecordsPoller(api, [("все", 0, 0, 60)])
+    ids = set()
+    async for page in poller.iter_pages():
+        ids.update(r.id for r in page)
+    return ids, poller.complete
+
+
+async def run() -> bool:
+    ok = True
+    cases = [
+        ("список не менялся", None, True),
+        ("удалена запись с первой страницы", lambda records: records.pop(10), False),
+        ("добавлена запись в начало", lambda records: records.insert(0, {**records[0], "id": 1}), False),
+    ]
+    for title, shift, complete in cases:
+        ids, polled_complete = await poll(shift)
+        passed = polled_complete == complete
+        ok &= passed
+        print(f"{'✅' if passed else '❌'} {title}: получено {len(ids)}, опрос "
+              f"{'полный' if polled_complete else 'неполный — проверка отмен отложена'}")
+    return ok
+
+
+def main():
+    raise SystemExit(0 if asyncio.run(run()) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Проверка сохранения базы в S3 без боевого бакета: пишет во временную базу,
+выгружает её (снимком и репликацией WAL) и восстанавливает в новый файл.
+Отдельно — checkpoint, занятый читателем: SQLite начинает WAL заново без
+обрезки файла, и репликация должна перейти на новое поколение.
+
+По умолчанию S3 подменяется moto (pip install "moto[s3]"), либо укажите
+локальный MinIO:
+    python check_s3_replication.py
+    python check_s3_replication.py --endpoint http://127.0.0.1:9000 --access-key minioadmin --secret-key minioadmin
+"""
+
+import argparse
+import asyncio
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+from persistence import S3Persistence, WalReplicator, make_s3_client
+from storage import Storage
+
+BUCKET = "bot-mesto-check"
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS tracked_records (
+        record_id INTEGER PRIMARY KEY,
+        client_phone TEXT,
+        datetime TEXT,
+        status TEXT
+    )
+"""
+INSERT_SQL = "INSERT OR REPLACE INTO tracked_records VALUES (?, ?, ?, 'active')"
+
+
+def rows(path: Path) -> list:
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT * FROM tracked_records ORDER BY record_id").fetchall()
+    finally:
+        conn.close()
+
+
+async def fill(storage: Storage, start: int, count: int):
+    for i in range(start, start + count):
+        await storage.execute(INSERT_SQL, (i, f"+7999{i:07d}", "2026-02-05T13:30:00+03:00"))
+
+
+async def check_snapshot(client_factory, tmp: Path) -> bool:
+    db_path = tmp / "snapshot.db"
+    storage = Storage(db_path)
+    storage.open()
+    await storage.execute(SCHEMA)
+
+    persistence = S3Persistence(db_path, client_factory, BUCKET, "check/clients.db", debounce=0.2)
+    await persistence.start()
+    for batch in range(5):
+        await fill(storage, batch * 100, 100)
+        persistence.notify_change()
+    await asyncio.sleep(1)
+    persistence.notify_change()  # содержимое не менялось — выгрузка будет пропущена
+    await asyncio.sleep(1)
+    await persistence.close()
+    storage.close()
+
+    restored = S3Persistence(tmp / "snapshot-restored.db", client_factory, BUCKET, "check/clients.db")
+    ok = restored.restore() and rows(restored.db_path) == rows(db_path)
+    print(f"snapshot: выгрузок {persistence.uploads}, пропущено {persistence.skipped}, "
+          f"восстановлено {'✅' if ok else '❌'}")
+    return ok
+
+
+async def check_wal(client_factory, tmp: Path) -> bool:
+    db_path = tmp / "wal.db"
+    storage = Storage(db_path)
+    storage.open()
+    await storage.execute(SCHEMA)
+
+    replicator = WalReplicator(storage, client_factory, BUCKET, "check/replica", snapshot_wal_bytes=1024 * 1024)
+    await replicator.start()
+    started = time.perf_counter()
+    await fill(storage, 0, 3000)  # WAL перерастёт порог — будет новое поколение
+    await fill(storage, 1000, 200)
+    elapsed = time.perf_counter() - started
+    expected = await storage.fetchall("SELECT * FROM tracked_records ORDER BY record_id")
+    await replicator.close()
+    storage.close()
+
+    restored = WalReplicator(Storage(tmp / "wal-restored.db"), client_factory, BUCKET, "check/replica")
+    ok = restored.restore() and rows(restored.db_path) == expected
+    print(f"wal: {len(expected)} строк за {elapsed:.2f} с, сегментов {replicator.segments}, "
+          f"поколение {replicator.generation}, восстановлено {'✅' if ok else '❌'}")
+    return ok
+
+
+async def check_wal_busy_checkpoint(client_factory, tmp: Path) -> bool:
+    db_path = tmp / "busy.db"
+    storage = Storage(db_path)
+    storage.open()
+    await storage.execute(SCHEMA)
+
+    replicator = WalReplicator(storage, client_factory, BUCKET, "check/busy")
+    await replicator.start()
+    await fill(storage, 0, 200)
+    first_generation = replicator.generation
+
+    # Читатель держит WAL: checkpoint переносит все кадры, но WAL не обрезает.
+    # Фиксация без изменений страниц — чтобы после чтения не появилось новых кадров
+    reader = sqlite3.connect(db_path, isolation_level=None)
+    reader.execute("BEGIN")
+    reader.execute("SELECT count(*) FROM tracked_records").fetchone()
+    replicator.snapshot_interval = 0
+    await storage.execute("DELETE FROM tracked_records WHERE 0")
+    replicator.snapshot_interval = 3600
+    reader.execute("COMMIT")
+
+    # Новый читатель не мешает SQLite начать WAL заново, но снова занимает checkpoint
+    reader.execute("BEGIN")
+    reader.execute("SELECT count(*) FROM tracked_records").fetchone()
+    await fill(storage, 300, 100)
+    expected = await storage.fetchall("SELECT * FROM tracked_records ORDER BY record_id")
+    await replicator.close()
+    reader.execute("COMMIT")
+    reader.close()
+    storage.close()
+
+    restored = WalReplicator(Storage(tmp / "busy-restored.db"), client_factory, BUCKET, "check/busy")
+    ok = (
+        replicator.generation != first_generation
+        and restored.restore()
+        and rows(restored.db_path) == expected
+    )
+    print(f"wal, checkpoint занят: {len(expected)} строк, поколение {first_generation} → "
+          f"{replicator.generation}, восстановлено {'✅' if ok else '❌'}")
+    return ok
+
+
+async def run(client_factory) -> bool:
+    client_factory().create_bucket(Bucket=BUCKET)
+    with tempfile.TemporaryDirectory() as tmp:
+        results = [
+            await check_snapshot(client_factory, Path(tmp)),
+            await check_wal(client_factory, Path(tmp)),
+            await check_wal_busy_checkpoint(client_factory, Path(tmp)),
+        ]
+    return all(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка сохранения базы в S3")
+    parser.add_argument("--endpoint", help="URL S3-совместимого хранилища (без него — moto)")
+    parser.add_argument("--access-key", default="minioadmin")
+    parser.add_argument("--secret-key", default="minioadmin")
+    args = parser.parse_args()
+
+    if args.endpoint:
+        client = make_s3_client(args.endpoint, args.access_key, args.secret_key, region="us-east-1")
+        ok = asyncio.run(run(lambda: client))
+    else:
+        from moto import mock_aws
+
+        with mock_aws():
+            client = make_s3_client(None, "testing", "testing", region="us-east-1")
+            ok = asyncio.run(run(lambda: client))
+
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,8 @@ import sqlite3
 from pathlib import Path
 from datetime import datetime
 
-DB_PATH = Path(__file__).parent / "clients.db"
+from storage import DB_PATH
+
 OUTPUT_PATH = Path(__file__).parent / f"clients_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
 
 
@@ -0,0 +1,87 @@
+"""
+Имитация вебхуков YClients для локальной проверки бота.
+Отправляет события create / update / delete для синтетической записи
+и печатает время ответа эндпоинта. Бот перечитывает запись из API YClients,
+поэтому для уведомлений --record-id должен быть ID настоящей записи.
+
+Запустите бота с YCLIENTS_WEBHOOK_ENABLED = True, затем:
+    python fake_yclients_webhook.py --url "http://127.0.0.1:8080/yclients/webhook?secret=..." --phone +79991234567
+    python fake_yclients_webhook.py --url "...?secret=..." --scenario create --count 100
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import aiohttp
+
+DEFAULT_URL = "http://127.0.0.1:8080/yclients/webhook"
+DEFAULT_COMPANY_ID = "1540716"
+
+
+def make_record(record_id: int, phone: str, starts_in_hours: float) -> dict:
+    """Запись в формате YClients"""
+    dt = (datetime.now() + timedelta(hours=starts_in_hours)).replace(second=0, microsecond=0)
+    return {
+        "id": record_id,
+        "datetime": dt.strftime("%Y-%m-%dT%H:%M:%S+03:00"),
+        "services": [{"id": 1, "title": "Мужская стрижка", "length": 3600}],
+        "staff": {"id": 1, "name": "Тестовый мастер", "specialization": "барбер"},
+        "client": {"id": 1, "name": "Тест Тестов", "phone": phone},
+        "attendance": 0,
+        "deleted": False,
+    }
+
+
+def make_event(company_id: str, status: str, record: dict) -> dict:
+    return {
+        "company_id": int(company_id),
+        "resource": "record",
+        "resource_id": record["id"],
+        "status": status,
+        "data": record,
+    }
+
+
+async def post(session: aiohttp.ClientSession, url: str, event: dict):
+    started = time.perf_counter()
+    async with session.post(url, json=event) as resp:
+        body = await resp.text()
+    elapsed = (time.perf_counter() - started) * 1000
+    print(f"{event['status']:<7} #{event['resource_id']:<10} → {resp.status} за {elapsed:6.1f} мс  {body}")
+    return elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Имитация вебхуков YClients")
+    parser.add_argument("--url", default=DEFAULT_URL, help="URL эндпоинта с ?secret=...")
+    parser.add_argument("--company-id", default=DEFAULT_COMPANY_ID)
+    parser.add_argument("--phone", default="+79990000000", help="телефон клиента записи")
+    parser.add_argument("--record-id", type=int, default=900000000)
+    parser.add_argument("--scenario", choices=["lifecycle", "create", "update", "delete"], default="lifecycle",
+                        help="lifecycle = создание, перенос на час, отмена")
+    parser.add_argument("--count", type=int, default=1, help="сколько записей отправить")
+    args = parser.parse_args()
+
+    timings = []
+    async with aiohttp.ClientSession() as session:
+        for i in range(args.count):
+            record = make_record(args.record_id + i, args.phone, starts_in_hours=26)
+
+            if args.scenario in ("lifecycle", "create"):
+                timings.append(await post(session, args.url, make_event(args.company_id, "create", record)))
+            if args.scenario in ("lifecycle", "update"):
+                moved = make_record(record["id"], args.phone, starts_in_hours=27)
+                timings.append(await post(session, args.url, make_event(args.company_id, "update", moved)))
+            if args.scenario in ("lifecycle", "delete"):
+                timings.append(await post(session, args.url, make_event(args.company_id, "delete", record)))
+
+    if timings:
+        timings.sort()
+        print(f"\n📊 Событий: {len(timings)}, медиана {timings[len(timings) // 2]:.1f} мс, "
+              f"максимум {timings[-1]:.1f} мс")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
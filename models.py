@@ -0,0 +1,234 @@
+"""
+Модели данных YClients: запись, мастер, услуга.
+Ответ API разбирается один раз при получении: дата уже распознана,
+услуги собраны в строку, телефон приведён к ключу. Дальше бот работает
+только с этими объектами (__slots__ — без словаря на каждый экземпляр).
+"""
+
+import hashlib
+import json
+from datetime import datetime
+
+try:
+    import orjson  # из requirements.txt; без него — стандартный json (медленнее)
+except ImportError:
+    orjson = None
+
+
+def loads(body: bytes):
+    """JSON прямо из байтов ответа, без промежуточной строки"""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def normalize_phone(phone: str) -> str:
+    """Нормализация номера телефона"""
+    digits = ''.join(filter(str.isdigit, phone))
+    if len(digits) == 11 and digits.startswith('8'):
+        digits = '7' + digits[1:]
+    elif len(digits) == 10:
+        digits = '7' + digits
+    return '+' + digits
+
+
+def phone_key(phone: str) -> str:
+    """Канонический ключ телефона для поиска: последние 10 цифр"""
+    return normalize_phone(phone)[1:][-10:]
+
+
+def parse_datetime(value: str):
+    """Дата записи YClients ('2026-02-05T13:30:00+03:00' или '2026-02-05 13:30:00'); None — не разобрать"""
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+class Service:
+    __slots__ = ("id", "title", "length")
+
+    def __init__(self, id=None, title: str = "", length=None):
+        self.id = id
+        self.title = title
+        self.length = length
+
+    @classmethod
+    def from_api(cls, data: dict) -> "Service":
+        return cls(data.get("id"), data.get("title", ""), data.get("length"))
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "title": self.title, "length": self.length}
+
+
+class Staff:
+    __slots__ = ("id", "name", "position")
+
+    def __init__(self, id=None, name: str = "", position: str = ""):
+        self.id = id
+        self.name = name
+        self.position = position
+
+    @classmethod
+    def from_api(cls, data) -> "Staff":
+        if not isinstance(data, dict):
+            return cls()
+        position = data.get("specialization", "")
+        if not position and isinstance(data.get("position"), dict):
+            position = data["position"].get("title", "")
+        return cls(data.get("id"), data.get("name", ""), position or "")
+
+    @property
+    def label(self) -> str:
+        """'Имя, должность' (или только имя)"""
+        return f"{self.name}, {self.position}" if self.position else self.name
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "name": self.name, "specialization": self.position}
+
+
+# Поля со ссылкой на запись в ответе YClients (в порядке приоритета)
+_LINK_FIELDS = ("visit_url", "client_link", "short_link", "record_link", "link", "links")
+_VISIT_LINK_FIELDS = ("url", "link", "short_link")
+
+
+def _find_link(data: dict):
+    for field in _LINK_FIELDS:
+        link = data.get(field)
+        if isinstance(link, str) and link.startswith("http"):
+            return link
+        if isinstance(link, dict) and link.get("client"):
+            return link.get("client")
+    visit = data.get("visit")
+    if isinstance(visit, dict):
+        for field in _VISIT_LINK_FIELDS:
+            if visit.get(field):
+                return visit.get(field)
+    return None
+
+
+def _fingerprint(data: dict) -> str:
+    """Отпечаток значимых полей: дата, услуги, мастер, телефон, статус, приход.
+
+    Считается по словарю ответа до разбора, чтобы неизменённую запись
+    можно было пропустить; значения — те же, что у полей Record.
+    """
+    staff = data.get("staff")
+    staff = staff if isinstance(staff, dict) else {}
+    client = data.get("client")
+    client = client if isinstance(client, dict) else {}
+    fields = (
+        data.get("datetime") or "",
+        tuple((s.get("id"), s.get("title", ""), s.get("length"))
+              for s in (data.get("services") or []) if isinstance(s, dict)),
+        staff.get("id"),
+        staff.get("name", ""),
+        client.get("phone") or "",
+        data.get("deleted"),
+        data.get("confirmed"),
+        data.get("attendance"),
+        data.get("visit_attendance"),
+    )
+    # repr кортежа простых значений стабилен и заметно быстрее json.dumps
+    return hashlib.blake2b(repr(fields).encode("utf-8"), digest_size=16).hexdigest()
+
+
+class Record:
+    """Запись клиента"""
+
+    __slots__ = (
+        "id", "datetime_str", "start", "starts_at", "utc_offset", "duration_minutes",
+        "services", "services_title", "staff",
+        "client_id", "client_name", "client_phone", "phone_key",
+        "attendance", "visit_attendance", "deleted", "confirmed",
+        "visit_id", "link", "fingerprint",
+    )
+
+    @classmethod
+    def from_api(cls, data: dict, known: dict = None) -> "Record":
+        """Разобрать запись из ответа API (или из to_dict()).
+
+        known — {id: Record} прошлого опроса: запись с тем же отпечатком
+        не разбирается заново, возвращается прежний объект.
+        """
+        fingerprint = _fingerprint(data)
+        if known:
+            previous = known.get(data.get("id"))
+            if previous is not None and previous.fingerprint == fingerprint:
+                return previous
+
+        record = cls()
+        record.id = data.get("id")
+        record.datetime_str = data.get("datetime") or ""
+
+        parsed = parse_datetime(record.datetime_str)
+        record.start = parsed.replace(tzinfo=None) if parsed else None          # время по часам салона
+        record.starts_at = parsed.timestamp() if parsed else None               # момент начала (UNIX)
+        record.utc_offset = 0                                                   # смещение от UTC, секунды
+        if parsed:
+            # Дата без пояса — по часам сервера
+            aware = parsed if parsed.tzinfo else parsed.astimezone()
+            record.utc_offset = aware.utcoffset().total_seconds()
+
+        record.services = tuple(Service.from_api(s) for s in (data.get("services") or []) if isinstance(s, dict))
+        record.services_title = ", ".join(s.title for s in record.services)
+        record.duration_minutes = next((s.length for s in record.services if s.length), 60)
+        record.staff = Staff.from_api(data.get("staff"))
+
+        client = data.get("client")
+        client = client if isinstance(client, dict) else {}
+        record.client_id = client.get("id")
+        record.client_name = client.get("name", "")
+        record.client_phone = client.get("phone") or ""
+        record.phone_key = phone_key(record.client_phone) if record.client_phone else None
+
+        record.attendance = data.get("attendance")
+        record.visit_attendance = data.get("visit_attendance")
+        record.deleted = data.get("deleted")
+        record.confirmed = data.get("confirmed")
+        record.visit_id = data.get("visit_id")
+        record.link = _find_link(data)
+        record.fingerprint = fingerprint
+        return record
+
+    @property
+    def arrived(self) -> bool:
+        """Клиент пришёл (attendance=1 или visit_attendance=1)"""
+        return self.attendance == 1 or self.visit_attendance == 1
+
+    def to_dict(self) -> dict:
+        """Компактный словарь в формате API (для хранения в базе)"""
+        data = {
+            "id": self.id,
+            "datetime": self.datetime_str,
+            "services": [s.to_dict() for s in self.services],
+            "staff": self.staff.to_dict(),
+            "client": {"id": self.client_id, "name": self.client_name, "phone": self.client_phone},
+            "attendance": self.attendance,
+            "visit_attendance": self.visit_attendance,
+            "deleted": self.deleted,
+            "confirmed": self.confirmed,
+            "visit_id": self.visit_id,
+        }
+        if self.link:
+            data["link"] = self.link
+        return data
+
+    def __repr__(self):
+        return f"Record(id={self.id}, datetime={self.datetime_str!r}, phone_key={self.phone_key!r})"
+
+
+def parse_records_page(body: bytes, known: dict = None) -> tuple:
+    """Страница /records: (список Record, total_count из meta или None).
+
+    Из ответа берутся только поля записи, нужные боту; исходные словари
+    (карточки клиентов, документы, цены услуг) сразу освобождаются.
+    known — записи прошлого опроса по id (см. Record.from_api).
+    """
+    data = loads(body)
+    meta = data.get("meta") or {}
+    total = meta.get("total_count") if isinstance(meta, dict) else None
+    records = [Record.from_api(r, known) for r in data.get("data") or [] if isinstance(r, dict) and r.get("id")]
+    return records, total
@@ -0,0 +1,505 @@
+"""
+Сохранение базы бота в S3 в фоне, не блокируя event loop.
+- S3Persistence: отложенная выгрузка целого снимка базы (backup API, gzip,
+  пропуск неизменённого содержимого, одна выгрузка на окно debounce)
+- WalReplicator: непрерывная выгрузка сегментов WAL + периодические базовые
+  снимки; восстановление = последний снимок + сегменты после него
+Рядом с базой лежит {db}.s3.json — версия копии в S3, с которой база
+последний раз совпадала; по ней при старте решается, нужна ли сверка.
+Все обращения к S3 — в отдельном потоке с одним переиспользуемым клиентом.
+"""
+
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Смещения счётчиков в заголовке файла SQLite: меняются при каждой
+# транзакции, даже если содержимое то же — при сравнении хэшей их обнуляем
+_HEADER_COUNTERS = ((24, 28), (92, 100))
+
+SNAPSHOT_NAME = "snapshot.db.gz"
+
+# Формат -wal: заголовок 32 байта (12:16 — номер checkpoint, 16:24 — соли),
+# затем кадры: заголовок 24 байта (4:8 — размер базы у кадра фиксации,
+# 8:16 — соли WAL) и страница
+WAL_HEADER_SIZE = 32
+WAL_FRAME_HEADER_SIZE = 24
+
+
+def make_s3_client(endpoint: str, access_key: str, secret_key: str, region: str = "ru-1"):
+    """Клиент S3 (boto3 импортируется только здесь)"""
+    import boto3
+    from botocore.config import Config
+
+    return boto3.client(
+        "s3",
+        endpoint_url=endpoint,
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_key,
+        region_name=region,
+        config=Config(signature_version="s3v4"),
+    )
+
+
+def snapshot_bytes(source) -> bytes:
+    """Согласованная копия базы через sqlite backup API (путь или открытое соединение)"""
+    own = not isinstance(source, sqlite3.Connection)
+    with tempfile.TemporaryDirectory() as tmp:
+        copy_path = Path(tmp) / "snapshot.db"
+        conn = sqlite3.connect(source) if own else source
+        target = sqlite3.connect(copy_path)
+        try:
+            conn.backup(target)
+        finally:
+            target.close()
+            if own:
+                conn.close()
+        return copy_path.read_bytes()
+
+
+def content_hash(data: bytes) -> str:
+    """sha256 содержимого базы без счётчиков изменений в заголовке"""
+    data = bytearray(data)
+    for start, end in _HEADER_COUNTERS:
+        data[start:end] = bytes(end - start)
+    return hashlib.sha256(data).hexdigest()
+
+
+def read_metadata(db_path) -> dict:
+    """Метаданные последней синхронизации с S3 ({} — если их нет)"""
+    try:
+        return json.loads(Path(str(db_path) + ".s3.json").read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def write_metadata(db_path, version: str):
+    path = Path(str(db_path) + ".s3.json")
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(json.dumps({"version": version, "synced_at": time.time()}))
+    os.replace(tmp_path, path)
+
+
+def local_copy_is_valid(db_path) -> bool:
+    """Локальная база есть и проходит PRAGMA quick_check"""
+    db_path = Path(db_path)
+    if not db_path.exists() or db_path.stat().st_size == 0:
+        return False
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            return conn.execute("PRAGMA quick_check").fetchone()[0] == "ok"
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError as e:
+        logger.warning(f"Локальная база повреждена: {e}")
+        return False
+
+
+def _list_keys(s3, bucket: str, prefix: str) -> list:
+    keys = []
+    kwargs = {"Bucket": bucket, "Prefix": prefix}
+    while True:
+        response = s3.list_objects_v2(**kwargs)
+        keys.extend(item["Key"] for item in response.get("Contents", []))
+        if not response.get("IsTruncated"):
+            return keys
+        kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+
+def _delete_keys(s3, bucket: str, keys: list):
+    for i in range(0, len(keys), 1000):
+        s3.delete_objects(
+            Bucket=bucket, Delete={"Objects": [{"Key": key} for key in keys[i:i + 1000]]}
+        )
+
+
+class _S3Worker:
+    """Один поток и один клиент S3 на всё время работы"""
+
+    def __init__(self, client_factory, bucket: str):
+        self.client_factory = client_factory
+        self.bucket = bucket
+        self._client = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="s3")
+
+    @property
+    def s3(self):
+        if self._client is None:
+            self._client = self.client_factory()
+        return self._client
+
+    def submit(self, fn, *args):
+        """Выполнить fn в потоке S3; задачи идут строго по порядку"""
+        return self._executor.submit(fn, *args)
+
+    async def run(self, fn, *args):
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+class _S3Sync:
+    """Общее для режимов: версия копии в S3 и скачивание в отдельный файл"""
+
+    async def remote_version(self):
+        """Версия копии в S3 (None — копии нет)"""
+        return await self.worker.run(self._remote_version)
+
+    async def download(self, target) -> bool:
+        """Скачать копию из S3 в target, не трогая рабочую базу"""
+        return await self.worker.run(self.restore, Path(target))
+
+    def _restored(self, target: Path, version: str):
+        if target == self.db_path:
+            write_metadata(self.db_path, version)
+
+
+class S3Persistence(_S3Sync):
+    """Отложенная выгрузка снимка базы в S3.
+
+    notify_change() только отмечает базу изменённой; фоновая задача ждёт
+    debounce секунд, собирая все изменения за окно, и выгружает один
+    сжатый снимок. Если содержимое не изменилось — выгрузка пропускается.
+    """
+
+    def __init__(self, db_path, client_factory, bucket: str, key: str, debounce: float = 10.0):
+        self.db_path = Path(db_path)
+        self.key = key
+        self.debounce = debounce
+        self.worker = _S3Worker(client_factory, bucket)
+        self.last_hash = None
+        self.uploads = 0
+        self.skipped = 0
+        self._dirty = asyncio.Event()
+        self._task = None
+
+    # ---------- восстановление ----------
+
+    def _remote_version(self):
+        for key in (self.key + ".gz", self.key):
+            try:
+                return self.worker.s3.head_object(Bucket=self.worker.bucket, Key=key)["ETag"]
+            except Exception:
+                continue
+        return None
+
+    def restore(self, target: Path = None) -> bool:
+        """Скачать базу (сжатый снимок, иначе старый несжатый файл)"""
+        target = target or self.db_path
+        s3, bucket = self.worker.s3, self.worker.bucket
+        try:
+            try:
+                response = s3.get_object(Bucket=bucket, Key=self.key + ".gz")
+                data = gzip.decompress(response["Body"].read())
+            except Exception as e:
+                logger.info(f"Сжатого снимка нет ({type(e).__name__}), пробую {self.key}")
+                response = s3.get_object(Bucket=bucket, Key=self.key)
+                data = response["Body"].read()
+        except Exception as e:
+            logger.info(f"S3 ошибка загрузки: {type(e).__name__}: {e}")
+            return False
+
+        _write_database(target, data)
+        if target == self.db_path:
+            self.last_hash = content_hash(data)
+        self._restored(target, response.get("ETag"))
+        logger.info(f"✅ База загружена из S3 ({len(data)} байт)")
+        return True
+
+    # ---------- выгрузка ----------
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def notify_change(self):
+        """Отметить базу изменённой (выгрузка — в фоне, после паузы)"""
+        self._dirty.set()
+
+    async def _run(self):
+        while True:
+            await self._dirty.wait()
+            await asyncio.sleep(self.debounce)
+            self._dirty.clear()
+            try:
+                await self.worker.run(self._upload)
+            except Exception as e:
+                logger.error(f"S3 ошибка сохранения: {type(e).__name__}: {e}")
+                self._dirty.set()
+
+    def _upload(self):
+        """Снимок → хэш → gzip → put_object (в потоке S3)"""
+        data = snapshot_bytes(self.db_path)
+        digest = content_hash(data)
+        if digest == self.last_hash:
+            self.skipped += 1
+            logger.debug("База в S3 актуальна — выгрузка пропущена")
+            return False
+
+        body = gzip.compress(data, compresslevel=6)
+        response = self.worker.s3.put_object(
+            Bucket=self.worker.bucket, Key=self.key + ".gz", Body=body, Metadata={"sha256": digest}
+        )
+        write_metadata(self.db_path, response.get("ETag"))
+        self.last_hash = digest
+        self.uploads += 1
+        logger.info(f"✅ База сохранена в S3 ({len(data)} → {len(body)} байт)")
+        return True
+
+    async def close(self):
+        """Остановить фоновую задачу и выгрузить несохранённые изменения"""
+        if self._task:
+            self._task.cancel()
+        if self._dirty.is_set():
+            try:
+                await self.worker.run(self._upload)
+            except Exception as e:
+                logger.error(f"S3 ошибка сохранения: {type(e).__name__}: {e}")
+        self.worker.shutdown()
+
+
+class WalReplicator(_S3Sync):
+    """Репликация WAL в S3.
+
+    Автоматический checkpoint отключён: после каждой фиксации в потоке-писателе
+    новые кадры -wal выгружаются сегментом. Раз в snapshot_interval секунд или
+    когда WAL вырос больше snapshot_wal_bytes, делается checkpoint(TRUNCATE),
+    выгружается базовый снимок и начинается новое поколение.
+    
+    Если checkpoint занят читателями, SQLite может начать WAL заново с первого
+    кадра, не обрезая файл. Это видно по заголовку -wal (номер checkpoint и
+    соли): цепочка сегментов порвана, и новое поколение начинается сразу —
+    снимком без checkpoint и сегментами с начала WAL (кадры поверх снимка
+    дают то же содержимое).
+
+    Раскладка в S3:
+        {prefix}/{generation}/snapshot.db.gz
+        {prefix}/{generation}/wal/{offset:016x}.gz
+    """
+
+    def __init__(self, storage, client_factory, bucket: str, prefix: str,
+                 snapshot_interval: float = 3600, snapshot_wal_bytes: int = 16 * 1024 * 1024,
+                 keep_generations: int = 2):
+        self.storage = storage
+        self.db_path = Path(storage.db_path)
+        self.wal_path = Path(str(self.db_path) + "-wal")
+        self.prefix = prefix.rstrip("/")
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_wal_bytes = snapshot_wal_bytes
+        self.keep_generations = keep_generations
+        self.worker = _S3Worker(client_factory, bucket)
+        self.generation = None
+        self.offset = 0
+        self.wal_header = None      # заголовок -wal, к которому относится offset
+        self.snapshot_at = 0.0
+        self.segments = 0
+        self._needs_snapshot = True
+
+    # ---------- восстановление ----------
+
+    def _generations(self) -> dict:
+        """generation -> список ключей, по возрастанию"""
+        generations = {}
+        for key in _list_keys(self.worker.s3, self.worker.bucket, self.prefix + "/"):
+            generation = key[len(self.prefix) + 1:].split("/", 1)[0]
+            generations.setdefault(generation, []).append(key)
+        return dict(sorted(generations.items()))
+
+    def _remote_version(self):
+        """Версия = последнее поколение со снимком"""
+        for generation, keys in reversed(list(self._generations().items())):
+            if f"{self.prefix}/{generation}/{SNAPSHOT_NAME}" in keys:
+                return generation
+        return None
+
+    def restore(self, target: Path = None) -> bool:
+        """Последний снимок + все сегменты WAL после него"""
+        target = target or self.db_path
+        s3, bucket = self.worker.s3, self.worker.bucket
+        try:
+            generations = self._generations()
+            for generation in reversed(list(generations)):
+                keys = generations[generation]
+                snapshot_key = f"{self.prefix}/{generation}/{SNAPSHOT_NAME}"
+                if snapshot_key not in keys:
+                    continue
+                snapshot = gzip.decompress(s3.get_object(Bucket=bucket, Key=snapshot_key)["Body"].read())
+                segments = sorted(key for key in keys if "/wal/" in key)
+                wal = b"".join(
+                    gzip.decompress(s3.get_object(Bucket=bucket, Key=key)["Body"].read()) for key in segments
+                )
+                _write_database(target, snapshot, wal)
+                self._restored(target, generation)
+                logger.info(
+                    f"✅ База восстановлена из S3: поколение {generation}, "
+                    f"снимок {len(snapshot)} байт, сегментов WAL {len(segments)} ({len(wal)} байт)"
+                )
+                return True
+        except Exception as e:
+            logger.info(f"S3 ошибка восстановления: {type(e).__name__}: {e}")
+            return False
+
+        logger.info("В S3 нет снимков базы")
+        return False
+
+    # ---------- репликация ----------
+
+    async def start(self):
+        """Подключиться к писателю: отключить autocheckpoint и начать поколение"""
+        await self.storage.write_raw(lambda conn: conn.execute("PRAGMA wal_autocheckpoint = 0"))
+        self.storage.add_commit_hook(self._on_commit)
+        await self.storage.write_raw(self._on_commit)
+
+    def notify_change(self):
+        """Сегменты выгружаются после каждой фиксации — отдельный сигнал не нужен"""
+
+    def _on_commit(self, conn: sqlite3.Connection):
+        """Вызывается в потоке-писателе после каждой фиксации"""
+        try:
+            wal_size = self.wal_path.stat().st_size if self.wal_path.exists() else 0
+            header = _read_wal_header(self.wal_path)
+            if wal_size < self.offset or (self.wal_header is not None and header != self.wal_header):
+                # WAL сброшен или начат заново — цепочка сегментов порвана
+                self._needs_snapshot = True
+            if (
+                self._needs_snapshot
+                or wal_size >= self.snapshot_wal_bytes
+                or time.monotonic() - self.snapshot_at >= self.snapshot_interval
+            ):
+                self._snapshot(conn)
+            self._ship_segment()
+        except Exception as e:
+            logger.error(f"Ошибка репликации WAL: {type(e).__name__}: {e}")
+            self._needs_snapshot = True
+
+    def _snapshot(self, conn: sqlite3.Connection):
+        """checkpoint(TRUNCATE) + базовый снимок нового поколения"""
+        busy, _, _ = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        if busy:
+            if not self._needs_snapshot:
+                logger.info("Checkpoint занят читателями — снимок отложен")
+                return
+            logger.info("Checkpoint занят читателями — новое поколение без обрезки WAL")
+
+        data = snapshot_bytes(conn)
+        self.generation = f"{int(time.time() * 1000):013d}"
+        self.offset = 0
+        self.wal_header = None
+        self.snapshot_at = time.monotonic()
+        self._needs_snapshot = False
+        self.worker.submit(self._upload_snapshot, self.generation, data)
+
+    def _ship_segment(self):
+        """Выгрузить кадры после offset до последней фиксации текущего WAL"""
+        header = _read_wal_header(self.wal_path)
+        if header is None:
+            return
+        self.wal_header = header
+        with open(self.wal_path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+        end = _committed_end(data, self.offset, header)
+        if end <= self.offset:
+            return
+        key = f"{self.prefix}/{self.generation}/wal/{self.offset:016x}.gz"
+        data = data[:end - self.offset]
+        self.offset = end
+        self.worker.submit(self._upload, key, data)
+
+    # ---------- поток S3 ----------
+
+    def _upload(self, key: str, data: bytes):
+        try:
+            self.worker.s3.put_object(
+                Bucket=self.worker.bucket, Key=key, Body=gzip.compress(data, compresslevel=6)
+            )
+            self.segments += 1
+        except Exception as e:
+            # Цепочка сегментов порвана — следующее изменение начнёт новое поколение
+            logger.error(f"S3 ошибка выгрузки {key}: {type(e).__name__}: {e}")
+            self._needs_snapshot = True
+
+    def _upload_snapshot(self, generation: str, data: bytes):
+        self._upload(f"{self.prefix}/{generation}/{SNAPSHOT_NAME}", data)
+        if self._needs_snapshot:
+            return
+        write_metadata(self.db_path, generation)
+        logger.info(f"✅ Снимок базы выгружен в S3: поколение {generation}, {len(data)} байт")
+        try:
+            generations = list(self._generations())
+            stale = generations[:-self.keep_generations]
+            keys = [
+                key for old in stale
+                for key in _list_keys(self.worker.s3, self.worker.bucket, f"{self.prefix}/{old}/")
+            ]
+            if keys:
+                _delete_keys(self.worker.s3, self.worker.bucket, keys)
+        except Exception as e:
+            logger.error(f"S3 ошибка очистки старых поколений: {type(e).__name__}: {e}")
+
+    async def close(self):
+        """Дождаться выгрузки поставленных сегментов"""
+        self.storage.remove_commit_hook(self._on_commit)
+        await self.worker.run(lambda: None)
+        self.worker.shutdown()
+
+
+def _read_wal_header(wal_path: Path):
+    """Заголовок -wal (None — WAL пуст или его нет)"""
+    try:
+        with open(wal_path, "rb") as f:
+            header = f.read(WAL_HEADER_SIZE)
+    except FileNotFoundError:
+        return None
+    return header if len(header) == WAL_HEADER_SIZE else None
+
+
+def _committed_end(data: bytes, offset: int, header: bytes) -> int:
+    """Конец последнего кадра фиксации текущего WAL в data (data начинается с offset).
+
+    Кадры с чужими солями — остаток прежнего WAL за концом нового: файл при
+    перезапуске WAL не обрезается.
+    """
+    salts = header[16:24]
+    page_size = int.from_bytes(header[8:12], "big")
+    if page_size == 1:
+        page_size = 65536       # так в заголовке записывается размер 64 КБ
+    frame_size = WAL_FRAME_HEADER_SIZE + page_size
+    end = offset
+    pos = max(offset, WAL_HEADER_SIZE)
+    while pos + frame_size <= offset + len(data):
+        frame = data[pos - offset:pos - offset + WAL_FRAME_HEADER_SIZE]
+        if frame[8:16] != salts:
+            break
+        pos += frame_size
+        if frame[4:8] != bytes(4):
+            end = pos
+    return end
+
+
+def _write_database(db_path: Path, data: bytes, wal: bytes = b""):
+    """Атомарно заменить файл базы; WAL — рядом, SQLite применит его при открытии"""
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = db_path.with_name(db_path.name + ".download")
+    tmp_path.write_bytes(data)
+    for suffix in ("-wal", "-shm"):
+        Path(str(db_path) + suffix).unlink(missing_ok=True)
+    os.replace(tmp_path, db_path)
+    if wal:
+        Path(str(db_path) + "-wal").write_bytes(wal)
+        conn = sqlite3.connect(db_path)
+        try:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            conn.close()
@@ -0,0 +1,137 @@
+"""
+Клиенты бота в памяти: telegram_id -> телефон и phone_key -> telegram_id.
+Обработчики сообщений и цикл проверки записей читают отсюда, без SQLite.
+Таблица clients остаётся источником истины: реестр загружается из неё при
+старте и обновляется сразу после каждой успешной записи (write-through).
+
+Хранение — отсортированные параллельные массивы array('q') (8 байт на поле):
+100 тыс. клиентов занимают ~4 МБ против десятков МБ у словарей с кортежами.
+Поиск — бинарный (bisect), вставка — сдвиг массива, что при таких объёмах
+и редкой регистрации дешевле, чем держать объект на каждого клиента.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+from models import phone_key
+
+
+def _phone_digits(phone: str) -> int:
+    """Нормализованный телефон '+79991234567' как число 79991234567"""
+    digits = "".join(filter(str.isdigit, phone or ""))
+    return int(digits) if digits else 0
+
+
+def _key_number(key: str) -> int:
+    """phone_key как число; ведущая 1 сохраняет нули и длину ключа"""
+    return int("1" + key)
+
+
+class ClientRegistry:
+    """Реестр клиентов: telegram_id, телефон, ID в YClients"""
+
+    def __init__(self):
+        self._ids = array("q")        # telegram_id по возрастанию
+        self._phones = array("q")     # цифры телефона (параллельно _ids)
+        self._yclients = array("q")   # ID клиента в YClients, 0 — неизвестен
+        self._keys = array("q")       # _key_number(phone_key) по возрастанию
+        self._key_ids = array("q")    # telegram_id для _keys (внутри ключа — по возрастанию)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, telegram_id: int) -> bool:
+        return self._find(telegram_id) is not None
+
+    def load(self, rows):
+        """Заполнить из строк (telegram_id, phone_number, yclients_client_id)"""
+        rows = sorted((int(tid), _phone_digits(phone), client_id or 0) for tid, phone, client_id in rows)
+        self._ids = array("q", (row[0] for row in rows))
+        self._phones = array("q", (row[1] for row in rows))
+        self._yclients = array("q", (row[2] for row in rows))
+        pairs = sorted((_key_number(phone_key(str(row[1]))), row[0]) for row in rows)
+        self._keys = array("q", (pair[0] for pair in pairs))
+        self._key_ids = array("q", (pair[1] for pair in pairs))
+
+    def _find(self, telegram_id: int):
+        i = bisect_left(self._ids, telegram_id)
+        if i < len(self._ids) and self._ids[i] == telegram_id:
+            return i
+        return None
+
+    def get(self, telegram_id: int):
+        """(телефон, phone_key, ID в YClients или None) либо None"""
+        i = self._find(telegram_id)
+        if i is None:
+            return None
+        phone = f"+{self._phones[i]}"
+        return phone, phone_key(phone), self._yclients[i] or None
+
+    def telegram_ids(self, key: str) -> list:
+        """Все telegram_id с этим ключом телефона (по возрастанию)"""
+        number = _key_number(key)
+        keys = self._keys
+        i = bisect_left(keys, number)
+        found = []
+        # Обычно на ключ один клиент — без второго поиска границы
+        while i < len(keys) and keys[i] == number:
+            found.append(self._key_ids[i])
+            i += 1
+        return found
+
+    def lookup(self, keys) -> dict:
+        """{phone_key: [telegram_id, ...]} для найденных ключей"""
+        index, key_ids = self._keys, self._key_ids
+        size = len(index)
+        found = {}
+        i = 0
+        # Ключи по возрастанию: каждый следующий поиск начинается с прошлой позиции
+        for number, key in sorted((_key_number(key), key) for key in set(keys)):
+            i = bisect_left(index, number, i)
+            while i < size and index[i] == number:
+                found.setdefault(key, []).append(key_ids[i])
+                i += 1
+        return found
+
+    def add(self, telegram_id: int, phone: str, yclients_client_id: int = None):
+        """Добавить клиента или сменить ему телефон (после записи в базу)"""
+        digits = _phone_digits(phone)
+        i = self._find(telegram_id)
+        if i is not None:
+            if self._phones[i] == digits:
+                return
+            self._unlink_key(self._phones[i], telegram_id)
+            self._phones[i] = digits
+            self._yclients[i] = 0       # другой телефон — другой клиент YClients, как и в базе
+        else:
+            i = bisect_left(self._ids, telegram_id)
+            self._ids.insert(i, telegram_id)
+            self._phones.insert(i, digits)
+            self._yclients.insert(i, yclients_client_id or 0)
+
+        number = _key_number(phone_key(str(digits)))
+        lo = bisect_left(self._keys, number)
+        hi = bisect_right(self._keys, number, lo)
+        j = lo + bisect_left(self._key_ids[lo:hi], telegram_id)
+        self._keys.insert(j, number)
+        self._key_ids.insert(j, telegram_id)
+
+    def _unlink_key(self, digits: int, telegram_id: int):
+        number = _key_number(phone_key(str(digits)))
+        lo = bisect_left(self._keys, number)
+        hi = bisect_right(self._keys, number, lo)
+        for j in range(lo, hi):
+            if self._key_ids[j] == telegram_id:
+                del self._keys[j]
+                del self._key_ids[j]
+                return
+
+    def set_yclients_id(self, telegram_id: int, client_id: int):
+        i = self._find(telegram_id)
+        if i is not None:
+            self._yclients[i] = client_id or 0
+
+    def memory_bytes(self) -> int:
+        """Память под массивы (без накладных расходов самих объектов array)"""
+        arrays = (self._ids, self._phones, self._yclients, self._keys, self._key_ids)
+        return sum(a.buffer_info()[1] * a.itemsize for a in arrays)
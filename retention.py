@@ -0,0 +1,166 @@
+"""
+Хранение истории в базе бота: старые строки уходят в архив.
+- Строки старше горизонта выгружаются в архив {archive_dir}/retention-*.jsonl.gz
+  (по строке JSON на запись таблицы) и только потом удаляются из базы
+- Освободившиеся страницы возвращаются incremental VACUUM (при первом запуске
+  база один раз переводится в auto_vacuum = INCREMENTAL полным VACUUM)
+- До и после каждого прогона замеряются число строк и размер базы
+"""
+
+import asyncio
+import gzip
+import json
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+# Что и когда считается устаревшим: (таблица, условие).
+# :date — дата горизонта (YYYY-MM-DD, для даты визита), :ts — момент горизонта
+# в формате CURRENT_TIMESTAMP (UTC). Отметки активных записей не трогаем,
+# иначе бот повторит уже отправленные уведомления.
+RETENTION_RULES = (
+    ("tracked_records", "status != 'active' AND datetime < :date"),
+    ("sent_notifications", "sent_at < :ts AND record_id NOT IN "
+                           "(SELECT record_id FROM tracked_records WHERE status = 'active')"),
+    ("attendance_notified", "notified_at < :ts AND record_id NOT IN "
+                            "(SELECT record_id FROM tracked_records WHERE status = 'active')"),
+    ("outbox", "status IN ('sent', 'failed') AND created_at < :ts"),
+)
+
+# auto_vacuum: 0 — NONE, 1 — FULL, 2 — INCREMENTAL
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def _table_stats(conn) -> dict:
+    """Число строк в таблицах и размер базы"""
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return {
+        "rows": {
+            table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table, _ in RETENTION_RULES
+        },
+        "size": conn.execute("PRAGMA page_count").fetchone()[0] * page_size,
+        "free": conn.execute("PRAGMA freelist_count").fetchone()[0] * page_size,
+    }
+
+
+class RetentionJob:
+    """Архивирование и удаление старых строк по расписанию"""
+
+    def __init__(self, storage: Storage, archive_dir, days: int, batch: int = 5000, on_change=None):
+        self.storage = storage
+        self.archive_dir = Path(archive_dir)
+        self.days = days
+        self.batch = batch
+        self.on_change = on_change  # вызывается, если база изменилась (выгрузка в S3)
+        self.last_run = {}      # метрики последнего прогона
+
+    def _horizon(self) -> dict:
+        horizon = datetime.now(timezone.utc) - timedelta(days=self.days)
+        return {"date": horizon.strftime("%Y-%m-%d"), "ts": horizon.strftime("%Y-%m-%d %H:%M:%S")}
+
+    async def _ensure_incremental_vacuum(self):
+        """Один раз перевести базу в auto_vacuum = INCREMENTAL (нужен полный VACUUM)"""
+        mode = (await self.storage.fetchone("PRAGMA auto_vacuum"))[0]
+        if mode == AUTO_VACUUM_INCREMENTAL:
+            return
+
+        def convert(conn):
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+
+        started = time.perf_counter()
+        await self.storage.write_raw(convert)
+        logger.info(f"🗜 База переведена в auto_vacuum=INCREMENTAL за {time.perf_counter() - started:.1f} сек")
+
+    async def _archive_table(self, table: str, where: str, params: dict, archive_path: Path) -> int:
+        """Выгрузить устаревшие строки таблицы в архив и удалить их; вернуть число строк"""
+        total = 0
+        while True:
+            def select(conn):
+                cursor = conn.execute(
+                    f"SELECT rowid, * FROM {table} WHERE {where} ORDER BY rowid LIMIT {self.batch}", params
+                )
+                columns = [column[0] for column in cursor.description][1:]
+                return columns, cursor.fetchall()
+
+            columns, rows = await self.storage.read(select)
+            if not rows:
+                return total
+
+            lines = "".join(
+                json.dumps({"table": table, "row": dict(zip(columns, row[1:]))}, ensure_ascii=False, default=str)
+                + "\n"
+                for row in rows
+            )
+            # Сначала архив на диске, потом удаление: при сбое строки останутся в базе
+            await asyncio.to_thread(self._append_archive, archive_path, lines)
+
+            rowids = [(row[0],) for row in rows]
+            await self.storage.write(
+                lambda conn: conn.executemany(f"DELETE FROM {table} WHERE rowid = ?", rowids)
+            )
+            total += len(rows)
+            if len(rows) < self.batch:
+                return total
+
+    @staticmethod
+    def _append_archive(path: Path, lines: str):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with gzip.open(path, "at", encoding="utf-8") as archive:
+            archive.write(lines)
+
+    async def run(self) -> dict:
+        """Один прогон: архив, удаление, incremental VACUUM; вернуть метрики"""
+        started = time.perf_counter()
+        await self._ensure_incremental_vacuum()
+        before = await self.storage.read(_table_stats)
+
+        params = self._horizon()
+        archive_path = self.archive_dir / f"retention-{datetime.now():%Y%m%d-%H%M%S}.jsonl.gz"
+        archived = {}
+        for table, where in RETENTION_RULES:
+            archived[table] = await self._archive_table(table, where, params, archive_path)
+
+        # execute() делает один шаг — освобождает одну страницу; executescript доводит до конца
+        await self.storage.write_raw(lambda conn: conn.executescript("PRAGMA incremental_vacuum"))
+        after = await self.storage.read(_table_stats)
+        if self.on_change and (any(archived.values()) or after["size"] != before["size"]):
+            self.on_change()
+
+        self.last_run = {
+            "finished_at": datetime.now().isoformat(),
+            "seconds": round(time.perf_counter() - started, 2),
+            "horizon": params["date"],
+            "archived": archived,
+            "archive": str(archive_path) if archive_path.exists() else None,
+            "rows_before": before["rows"],
+            "rows_after": after["rows"],
+            "size_before": before["size"],
+            "size_after": after["size"],
+            "free_after": after["free"],
+        }
+        return self.last_run
+
+    async def run_forever(self, interval: float, first_delay: float = 0):
+        """Прогон каждые interval секунд (первый — через first_delay)"""
+        await asyncio.sleep(first_delay)
+        while True:
+            try:
+                metrics = await self.run()
+                logger.info(
+                    f"🧹 Очистка истории (старше {metrics['horizon']}): в архив {metrics['archived']}, "
+                    f"строк {sum(metrics['rows_before'].values())} → {sum(metrics['rows_after'].values())}, "
+                    f"база {metrics['size_before'] / 1024:.0f} → {metrics['size_after'] / 1024:.0f} КБ "
+                    f"за {metrics['seconds']} сек"
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка очистки истории: {e}")
+            await asyncio.sleep(interval)
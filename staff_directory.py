@@ -0,0 +1,104 @@
+"""
+Справочник мастеров в памяти.
+- Зарегистрированные в боте: yclients_staff_id -> все его telegram_id (из таблицы staff);
+  загружается при старте и перечитывается после изменения таблицы (invalidate)
+- Список мастеров YClients: кэш с TTL, обновляется в фоне, поэтому клавиатура
+  регистрации /staff и уведомления о приходе не ждут ни базы, ни API
+"""
+
+import asyncio
+import logging
+
+from cache import TTLCache
+from models import Staff
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+REGISTERED_STAFF_SQL = """
+    SELECT yclients_staff_id, telegram_id, staff_name FROM staff
+    WHERE is_active = 1 AND yclients_staff_id IS NOT NULL
+    ORDER BY id
+"""
+
+STAFF_LIST_KEY = "staff"
+
+
+class StaffDirectory:
+    """Мастера: регистрации в боте и список из YClients"""
+
+    def __init__(self, storage: Storage, api, list_ttl: float):
+        self.storage = storage
+        self.api = api
+        self._registered = None     # yclients_staff_id -> ([telegram_id, ...], staff_name); None — перечитать
+        self._generation = 0        # растёт при invalidate(): загрузка, начатая раньше, не сохраняется
+        self._lock = asyncio.Lock()
+        self._list = TTLCache(list_ttl, max_size=1)
+
+    # ---------- Зарегистрированные мастера ----------
+
+    async def load(self):
+        """Перечитать зарегистрированных мастеров из базы"""
+        generation = self._generation
+        rows = await self.storage.fetchall(REGISTERED_STAFF_SQL)
+        registered = {}
+        for yclients_staff_id, telegram_id, staff_name in rows:
+            # Несколько аккаунтов на одного мастера — имя из первой регистрации, уведомления всем
+            registered.setdefault(yclients_staff_id, ([], staff_name))[0].append(telegram_id)
+        if generation == self._generation:
+            self._registered = registered
+        return registered
+
+    def invalidate(self):
+        """Таблица staff изменилась — перечитать при следующем обращении"""
+        self._registered = None
+        self._generation += 1
+
+    async def _get_registered(self) -> dict:
+        registered = self._registered
+        if registered is not None:
+            return registered
+        # Одновременные обращения после invalidate() ждут одну загрузку
+        async with self._lock:
+            if self._registered is not None:
+                return self._registered
+            return await self.load()
+
+    async def accounts(self, yclients_staff_id: int):
+        """([telegram_id, ...], staff_name) зарегистрированного мастера или None"""
+        return (await self._get_registered()).get(yclients_staff_id)
+
+    async def registered_ids(self) -> set:
+        """YClients ID мастеров, уже зарегистрированных в боте"""
+        return set(await self._get_registered())
+
+    # ---------- Список мастеров YClients ----------
+
+    async def _load_list(self) -> tuple:
+        staff = await self.api.get_staff_list()
+        if not staff:
+            # Пустой ответ (ошибка API) не кэшируем
+            raise LookupError("YClients не вернул список мастеров")
+        return tuple(Staff.from_api(s) for s in staff if isinstance(s, dict))
+
+    async def yclients_staff(self) -> tuple:
+        """Мастера YClients (Staff): из кэша, при промахе — запрос к API"""
+        return await self._list.get_or_load(STAFF_LIST_KEY, self._load_list)
+
+    async def refresh_list(self) -> tuple:
+        """Запросить список мастеров заново; при ошибке в кэше остаётся прежний"""
+        staff = await self._load_list()
+        self._list.set(STAFF_LIST_KEY, staff)
+        return staff
+
+    async def run_forever(self, interval: float):
+        """Фоном: обновлять список мастеров раньше, чем истечёт TTL"""
+        while True:
+            try:
+                staff = await self.refresh_list()
+                logger.debug(f"Список мастеров YClients обновлён: {len(staff)}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Не удалось обновить список мастеров YClients: {e}")
+            await asyncio.sleep(interval)
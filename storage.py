@@ -0,0 +1,242 @@
+"""
+Асинхронное хранилище SQLite для бота.
+- Одно долгоживущее соединение на запись (WAL) в отдельном потоке-писателе
+- Пул соединений на чтение
+- Кэш подготовленных выражений sqlite3 на каждом соединении
+Все методы awaitable — event loop не блокируется дисковым I/O.
+"""
+
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Размер кэша подготовленных выражений (на одно соединение)
+STATEMENT_CACHE_SIZE = 256
+
+# Сколько операций записи писатель объединяет в одну транзакцию
+MAX_WRITE_BATCH = 64
+
+# Таймаут ожидания блокировки (мс)
+BUSY_TIMEOUT_MS = 5000
+
+# Постоянный том (/data в Docker/на хостинге), иначе — рядом с ботом.
+# Общие для бота и утилит (export_clients.py), чтобы все читали одну базу
+DATA_DIR = Path("/data") if Path("/data").is_dir() else Path(__file__).parent
+DB_PATH = DATA_DIR / "clients.db"
+
+_STOP = object()
+
+
+class Storage:
+    """Один писатель в отдельном потоке + пул читателей"""
+
+    def __init__(self, db_path, read_pool_size: int = 4):
+        self.db_path = Path(db_path)
+        self.read_pool_size = read_pool_size
+        self._write_queue = queue.Queue()
+        self._writer_thread = None
+        self._readers = queue.Queue()
+        self._read_executor = None
+        self._commit_hooks = []
+        self._opened = False
+
+    # ---------- подключение ----------
+
+    def _connect(self, read_only: bool = False) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            isolation_level=None,  # транзакциями управляем сами
+        )
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        if read_only:
+            conn.execute("PRAGMA query_only = 1")
+        return conn
+
+    def open(self):
+        """Открыть соединения и запустить поток-писатель"""
+        if self._opened:
+            return
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+
+        writer_conn = self._connect()
+        writer_conn.execute("PRAGMA journal_mode = WAL")
+        writer_conn.execute("PRAGMA synchronous = NORMAL")
+
+        for _ in range(self.read_pool_size):
+            self._readers.put(self._connect(read_only=True))
+        self._read_executor = ThreadPoolExecutor(
+            max_workers=self.read_pool_size, thread_name_prefix="sqlite-read"
+        )
+
+        self._writer_thread = threading.Thread(
+            target=self._writer_loop, args=(writer_conn,), name="sqlite-writer", daemon=True
+        )
+        self._writer_thread.start()
+        self._opened = True
+        logger.info(f"Хранилище открыто: {self.db_path} (WAL, читателей: {self.read_pool_size})")
+
+    def close(self):
+        """Дождаться всех записей и закрыть соединения"""
+        if not self._opened:
+            return
+        self._write_queue.put(_STOP)
+        self._writer_thread.join()
+        self._read_executor.shutdown(wait=True)
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+        self._opened = False
+        logger.info("Хранилище закрыто")
+
+    # ---------- поток-писатель ----------
+
+    def _writer_loop(self, conn: sqlite3.Connection):
+        """Выполняет записи по очереди; пачку ожидающих — в одной транзакции"""
+        while True:
+            item = self._write_queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            stop = False
+            while len(batch) < MAX_WRITE_BATCH:
+                try:
+                    nxt = self._write_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is _STOP:
+                    stop = True
+                    break
+                batch.append(nxt)
+
+            try:
+                self._run_batch(conn, batch)
+            except Exception as e:
+                # Поток-писатель один: его гибель повесила бы все последующие write()
+                logger.error(f"Ошибка пачки записи: {type(e).__name__}: {e}")
+                for _, _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            if stop:
+                break
+
+        conn.close()
+
+    def _run_commit_hooks(self, conn: sqlite3.Connection):
+        for hook in self._commit_hooks:
+            try:
+                hook(conn)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика фиксации: {e}")
+
+    def _run_batch(self, conn: sqlite3.Connection, batch: list):
+        """Групповая фиксация: каждая операция в своей SAVEPOINT"""
+        raw = [item for item in batch if not item[3]]
+        transactional = [item for item in batch if item[3]]
+
+        # Операции вне транзакции (VACUUM, checkpoint) выполняем по одной
+        for fn, args, future, _ in raw:
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(conn, *args))
+            except BaseException as e:
+                future.set_exception(e)
+        if raw:
+            self._run_commit_hooks(conn)
+
+        # Отменённые до начала выполнения пропускаем; остальные больше нельзя отменить
+        transactional = [item for item in transactional if item[2].set_running_or_notify_cancel()]
+        if not transactional:
+            return
+
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args, future, _ in transactional:
+                conn.execute("SAVEPOINT op")
+                try:
+                    results.append((future, True, fn(conn, *args)))
+                    conn.execute("RELEASE op")
+                except BaseException as e:
+                    conn.execute("ROLLBACK TO op")
+                    conn.execute("RELEASE op")
+                    results.append((future, False, e))
+            conn.execute("COMMIT")
+        except BaseException as e:
+            try:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+            except sqlite3.Error as rollback_error:
+                logger.error(f"Ошибка ROLLBACK: {rollback_error}")
+            for fn, args, future, _ in transactional:
+                future.set_exception(e)
+            return
+        self._run_commit_hooks(conn)
+
+        for future, ok, value in results:
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    # ---------- публичный API ----------
+
+    async def write(self, fn, *args):
+        """Выполнить fn(conn, *args) в потоке-писателе внутри транзакции"""
+        future = Future()
+        self._write_queue.put((fn, args, future, True))
+        return await asyncio.wrap_future(future)
+
+    async def write_raw(self, fn, *args):
+        """Выполнить fn(conn, *args) в потоке-писателе без транзакции"""
+        future = Future()
+        self._write_queue.put((fn, args, future, False))
+        return await asyncio.wrap_future(future)
+
+    def _read_call(self, fn, args):
+        conn = self._readers.get()
+        try:
+            return fn(conn, *args)
+        finally:
+            self._readers.put(conn)
+
+    async def read(self, fn, *args):
+        """Выполнить fn(conn, *args) на соединении из пула чтения"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_executor, self._read_call, fn, args)
+
+    async def fetchone(self, sql: str, params=()):
+        return await self.read(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql: str, params=()):
+        return await self.read(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def execute(self, sql: str, params=()) -> int:
+        """Выполнить одно выражение на запись, вернуть rowcount"""
+        return await self.write(lambda conn: conn.execute(sql, params).rowcount)
+
+    async def executemany(self, sql: str, seq_of_params) -> int:
+        seq_of_params = list(seq_of_params)
+        return await self.write(lambda conn: conn.executemany(sql, seq_of_params).rowcount)
+
+    def add_commit_hook(self, hook):
+        """hook(conn) вызывается в потоке-писателе после каждой фиксации"""
+        self._commit_hooks.append(hook)
+
+    def remove_commit_hook(self, hook):
+        if hook in self._commit_hooks:
+            self._commit_hooks.remove(hook)
+
+    async def checkpoint(self, mode: str = "TRUNCATE"):
+        """Перенести WAL в основной файл базы"""
+        return await self.write_raw(
+            lambda conn: conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        )